@@ -0,0 +1,174 @@
+# 准入控制：限制同时发往每种上游资源的请求数，流量突增时排队或快速拒绝，而不是把请求全部放给上游
+# - 资源：大模型流式回答（llm）、ES 查询（es）、网络搜索（web_search）、每个 MCP 服务器（mcp:<地址>），
+#   并发上限、等待队列长度和最长等待时间由各自的模块配置
+# - 有空位时直接进入；没有空位时进入有上限的先进先出队列，超过等待时间（或调用方给的截止时间）就放弃；
+#   队列已满时立即拒绝，抛出 Overloaded，由调用方转换成 429、SSE 错误帧或检索/工具失败
+# - 统计每个资源的进行中数量、排队数量和等待时间（平均、p50/p99、最大），通过 /api/metrics 查看
+# - 多进程部署时上限按进程计算
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi.responses import StreamingResponse
+
+# 计算等待时间分位数时保留的最近样本数
+ADMISSION_WAIT_SAMPLES = int(os.getenv("ADMISSION_WAIT_SAMPLES", "1000"))
+
+
+class Overloaded(Exception):
+    def __init__(self, resource: str, reason: str, retry_after: float):
+        self.resource = resource
+        # queue_full：队列已满，立即拒绝；timeout：排队超过等待时间
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"{resource} 繁忙（{'排队已满' if reason == 'queue_full' else '排队超时'}），请稍后再试")
+
+
+class Slot:
+    """占用的一个并发名额；release 可以重复调用"""
+
+    def __init__(self, resource):
+        self._resource = resource
+
+    def release(self):
+        resource, self._resource = self._resource, None
+        if resource is not None:
+            resource.release()
+
+
+class Resource:
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters = deque()
+        self._waits = deque(maxlen=ADMISSION_WAIT_SAMPLES)
+        self.stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0,
+                      "max_waiting": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0}
+
+    async def acquire(self, deadline: float = None) -> Slot:
+        """deadline 是 time.monotonic() 的截止时间，和 max_wait 取较早的一个"""
+        slot = self.try_acquire()
+        if slot is not None:
+            return slot
+        if len(self._waiters) >= self.queue_size:
+            self.stats["rejected_queue_full"] += 1
+            raise Overloaded(self.name, "queue_full", self.max_wait)
+        start = time.monotonic()
+        timeout = self.max_wait if deadline is None else min(self.max_wait, deadline - start)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.stats["queued"] += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(timeout, 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 名额已经交过来了，但调用方不再需要，让给下一个
+                self.release()
+            else:
+                future.cancel()
+                self._remove(future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.stats["rejected_timeout"] += 1
+            raise Overloaded(self.name, "timeout", self.max_wait) from None
+        self.stats["admitted"] += 1
+        self._record_wait(time.monotonic() - start)
+        return Slot(self)
+
+    def try_acquire(self):
+        """有空位时占用并返回 Slot，否则返回 None，不排队（用于可以放弃的附加请求）"""
+        if self.active >= self.limit or self._waiters:
+            return None
+        self.active += 1
+        self.stats["admitted"] += 1
+        self._record_wait(0.0)
+        return Slot(self)
+
+    def release(self):
+        # 名额直接交给队首仍在等待的请求，active 不变
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _remove(self, future):
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def _record_wait(self, seconds: float):
+        ms = seconds * 1000
+        self._waits.append(ms)
+        self.stats["wait_total_ms"] += ms
+        self.stats["wait_max_ms"] = max(self.stats["wait_max_ms"], ms)
+
+    def metrics(self) -> dict:
+        waits = sorted(self._waits)
+        admitted = self.stats["admitted"]
+        return {
+            **self.stats,
+            "wait_total_ms": round(self.stats["wait_total_ms"], 1),
+            "wait_max_ms": round(self.stats["wait_max_ms"], 1),
+            "wait_avg_ms": round(self.stats["wait_total_ms"] / admitted, 1) if admitted else 0.0,
+            "wait_p50_ms": round(waits[len(waits) // 2], 1) if waits else 0.0,
+            "wait_p99_ms": round(waits[int(len(waits) * 0.99)], 1) if waits else 0.0,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "max_wait_s": self.max_wait,
+        }
+
+
+class AdmissionController:
+    def __init__(self):
+        self._resources = {}
+
+    def resource(self, name: str, limit: int, queue_size: int, max_wait: float) -> Resource:
+        """按名称取资源，第一次使用时按给定的配置创建"""
+        resource = self._resources.get(name)
+        if resource is None:
+            resource = self._resources[name] = Resource(name, limit, queue_size, max_wait)
+        return resource
+
+    @asynccontextmanager
+    async def slot(self, resource: Resource, deadline: float = None):
+        slot = await resource.acquire(deadline)
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def forget(self, name: str):
+        """资源不再使用（比如 MCP 服务器被删除）；正在进行的请求结束时仍然归还到原来的对象上"""
+        self._resources.pop(name, None)
+
+    def metrics(self) -> dict:
+        return {name: resource.metrics() for name, resource in self._resources.items()}
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """流式响应结束（包括客户端断开、还没开始输出就被取消）时归还名额"""
+
+    def __init__(self, content, slot: Slot = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+
+
+admission = AdmissionController()
@@ -0,0 +1,373 @@
+# Agent 引擎：使用 OpenAI 兼容的 tools（function calling）接口
+# - 决策轮也是流式的：模型直接回答时文本逐字转发给前端，不需要先等一次完整的非流式调用
+# - 一轮里模型给出的多个工具调用用 asyncio.gather 并发执行，结果一起交回模型
+# - 可以多步：拿到工具结果后模型还可以继续调用工具，最多 AGENT_MAX_STEPS 步
+# - 每一步（等待模型决策 + 执行工具）有截止时间 AGENT_STEP_TIMEOUT，所有工具步骤合计不超过 AGENT_TOTAL_TIMEOUT；
+#   超时后不再调用工具，用已经拿到的结果直接生成回答
+# - 推测执行（AGENT_SPECULATIVE，默认关闭）：第一步决策的同时发出一个不带工具的直接回答请求，先缓存其增量文本；
+#   决策一出现工具调用就取消直接回答；决策的文本先缓存（模型先说一句话再调用工具时照常发给前端），
+#   决策没有工具调用就结束时直接发出决策自己的完整回答，文本超过 AGENT_SPECULATIVE_COMMIT_CHARS 个字符或决策超时
+#   才改用直接回答流。直接回答请求也占用一个大模型名额，没有空闲名额时不做推测执行。
+#   因为要等决策结束或足够长才能确定不需要工具，短回答的首字时间反而比关闭时晚（决策 300ms 时约晚 110ms），
+#   大模型请求数翻倍；只适合决策很慢、回答通常很长的模型
+import asyncio
+import json
+import os
+import re
+import time
+
+import anyio
+
+from context_assembler import count_tokens, truncate_tokens
+from retrieval_cache import LoadCancelled
+from tool_cache import effective_ttl, tool_result_cache
+
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "4"))
+AGENT_STEP_TIMEOUT = float(os.getenv("AGENT_STEP_TIMEOUT", "30"))
+AGENT_TOTAL_TIMEOUT = float(os.getenv("AGENT_TOTAL_TIMEOUT", "60"))
+AGENT_SPECULATIVE = os.getenv("AGENT_SPECULATIVE", "false").lower() in ("1", "true", "yes")
+# 推测执行时决策输出这么多字符仍没有工具调用，就认定是直接回答
+AGENT_SPECULATIVE_COMMIT_CHARS = int(os.getenv("AGENT_SPECULATIVE_COMMIT_CHARS", "100"))
+
+AGENT_SYSTEM_PROMPT = (
+    "你是一个智能助手，可以调用工具获取信息后回答问题，不需要工具时直接回答。"
+    "多个互不依赖的工具请在同一轮里一起调用。"
+)
+
+# 预算用完时每个工具结果仍然至少保留这么多 token，不会被截成空
+TOOL_RESULT_MIN_TOKENS = 100
+
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_-]")
+
+stats = {"runs": 0, "steps": 0, "tool_calls": 0, "parallel_batches": 0, "tool_errors": 0,
+         "step_timeouts": 0, "total_timeouts": 0, "max_steps_reached": 0,
+         "speculative_runs": 0, "speculative_answers": 0, "speculative_cancelled": 0, "speculative_failures": 0,
+         "speculative_skipped": 0, "speculative_unused": 0}
+
+
+async def completion_text(stream):
+    """从大模型的流式响应中取出增量文本，读到结束标记就停止；生成器关闭时关闭上游响应，把连接还给连接池"""
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.choices[0].finish_reason is not None:
+                return
+    finally:
+        with anyio.CancelScope(shield=True):
+            await stream.close()
+
+
+def build_functions(tools: list) -> tuple:
+    """
+    把工具目录里的工具转换成 tools 参数，返回 (tools 参数, 函数名 -> 工具)。
+    不同服务器上的同名工具加序号区分，函数名只保留接口允许的字符。
+    """
+    specs = []
+    by_name = {}
+    for tool in tools:
+        base = _INVALID_NAME.sub("_", tool.name)[:60] or "tool"
+        name = base
+        n = 2
+        while name in by_name:
+            name = f"{base}_{n}"
+            n += 1
+        by_name[name] = tool
+        specs.append({"type": "function", "function": {**tool.function, "name": name}})
+    return specs, by_name
+
+
+def tools_tokens(tools: list) -> int:
+    """工具说明在提示词里大约占用的 token，组装上下文时预留"""
+    return count_tokens(json.dumps([tool.function for tool in tools], ensure_ascii=False))
+
+
+class DirectAnswer:
+    """
+    推测执行的直接回答：创建时立即发出不带工具的流式请求，由后台任务把增量文本放进队列，
+    决策选择直接回答时通过 stream() 转发（先取出已经缓存的部分），选择工具时 cancel()。
+    slot 是这个请求占用的大模型名额，请求结束或取消时归还。
+    """
+
+    def __init__(self, client, model: str, messages: list, slot=None):
+        self.delivered = 0
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump(client, model, list(messages), slot))
+
+    async def _pump(self, client, model: str, messages: list, slot):
+        try:
+            upstream = await client.chat.completions.create(model=model, messages=messages, stream=True)
+            async for text in completion_text(upstream):
+                self._queue.put_nowait(text)
+        except Exception as e:
+            self._queue.put_nowait(e)
+        finally:
+            if slot is not None:
+                slot.release()
+            self._queue.put_nowait(None)
+
+    async def stream(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            self.delivered += 1
+            yield item
+
+    async def cancel(self):
+        if self._task.done():
+            return
+        self._task.cancel()
+        with anyio.CancelScope(shield=True):
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class AgentRun:
+    def __init__(self, client, model: str, tools: list, query: str, context: str = "", history: list = (),
+                 tool_budget: int = None, llm_resource=None):
+        """
+        history 和 tool_budget 来自上下文组装：之前的对话（可能带摘要），以及留给工具结果的 token 数（None 不限制）。
+        llm_resource 是大模型的准入资源，推测执行的直接回答从中另外占用一个名额（None 时不限制）。
+        """
+        self.client = client
+        self.llm_resource = llm_resource
+        self.model = model
+        self.specs, self.tools = build_functions(tools)
+        self.tool_budget = tool_budget
+        # 本次执行中失败的工具调用数；有失败时回答不进回答缓存
+        self.tool_errors = 0
+        # 本次执行调用过的工具里最短的结果有效期（秒），None 表示没有调用工具；回答在回答缓存里的有效期不超过它
+        self.tool_ttl = None
+        user_content = f"上下文信息:\n{context}\n\n问题: {query}" if context else query
+        self.messages = [
+            {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+            *history,
+            {"role": "user", "content": user_content},
+        ]
+        # 每一步的记录：调用了哪些工具、耗时，用于日志
+        self.trace = []
+        self._step_text = []
+        # 推测执行的直接回答，只在第一步存在
+        self._direct = None
+
+    async def stream(self):
+        """异步生成器，产出要发给前端的增量文本"""
+        stats["runs"] += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + AGENT_TOTAL_TIMEOUT
+        try:
+            for step in range(AGENT_MAX_STEPS if self.specs else 0):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    stats["total_timeouts"] += 1
+                    break
+                step_deadline = loop.time() + min(AGENT_STEP_TIMEOUT, remaining)
+                stats["steps"] += 1
+                started = time.perf_counter()
+                calls = {}
+                if step == 0 and AGENT_SPECULATIVE:
+                    self._direct = self._speculate()
+                try:
+                    async for text in self._decide(step_deadline, calls):
+                        yield text
+                except asyncio.TimeoutError:
+                    stats["step_timeouts"] += 1
+                    self.trace.append({"step": step + 1, "timeout": "decision"})
+                    break
+                if not calls:
+                    if self._direct is not None:
+                        # 决策选择直接回答：转发已经在生成的直接回答
+                        self.trace.append({"step": step + 1, "answer": "speculative", "ms": _ms(started)})
+                        async for text in self._speculative_answer():
+                            yield text
+                        return
+                    # 模型直接给出了回答（已经流式发出）
+                    self.trace.append({"step": step + 1, "answer": True, "ms": _ms(started)})
+                    return
+                await self._run_tools(list(calls.values()), step_deadline)
+                self.trace.append({"step": step + 1, "tools": [c["name"] for c in calls.values()], "ms": _ms(started)})
+            else:
+                if self.specs:
+                    stats["max_steps_reached"] += 1
+            if self._direct is not None:
+                # 第一步决策就超时了：直接回答已经在生成，不必再发请求
+                async for text in self._speculative_answer():
+                    yield text
+                return
+            # 步数或时间用完：不再提供工具，用已有的工具结果生成回答
+            final = await self.client.chat.completions.create(
+                model=self.model,
+                messages=self.messages,
+                stream=True,
+                **({"tools": self.specs, "tool_choice": "none"} if self.specs else {})
+            )
+            async for text in completion_text(final):
+                yield text
+        finally:
+            if self._direct is not None:
+                await self._direct.cancel()
+            print(f"-----Agent 执行记录: {self.trace}")
+
+    def _speculate(self):
+        """发出推测执行的直接回答；大模型名额已满时不做推测执行，返回 None"""
+        slot = None
+        if self.llm_resource is not None:
+            slot = self.llm_resource.try_acquire()
+            if slot is None:
+                stats["speculative_skipped"] += 1
+                return None
+        stats["speculative_runs"] += 1
+        return DirectAnswer(self.client, self.model, self.messages, slot)
+
+    async def _speculative_answer(self):
+        """转发推测执行的直接回答；还没有产出任何文本就失败时，退回到普通的流式回答"""
+        direct = self._direct
+        stats["speculative_answers"] += 1
+        try:
+            async for text in direct.stream():
+                yield text
+            return
+        except Exception as e:
+            if direct.delivered:
+                raise
+            stats["speculative_failures"] += 1
+            print(f"推测执行的直接回答失败，重新请求: {str(e)}")
+        final = await self.client.chat.completions.create(model=self.model, messages=self.messages, stream=True)
+        async for text in completion_text(final):
+            yield text
+
+    async def _decide(self, step_deadline: float, calls: dict):
+        """
+        流式读取一轮决策：文本直接产出，工具调用按 index 拼接到 calls。
+        在产出第一段文本之前受本步截止时间约束；已经开始回答后不再限制。
+        有推测执行的直接回答时，文本先缓存不产出：第一个工具调用到达或没有工具调用就结束时取消直接回答，产出缓存的文本；
+        缓存的文本达到 AGENT_SPECULATIVE_COMMIT_CHARS 时结束，由调用方改用直接回答流。
+        """
+        loop = asyncio.get_running_loop()
+        upstream = await asyncio.wait_for(
+            self.client.chat.completions.create(
+                model=self.model, messages=self.messages, tools=self.specs, stream=True
+            ),
+            max(0.0, step_deadline - loop.time())
+        )
+        chunks = upstream.__aiter__()
+        answered = False
+        self._step_text = []
+        # 推测执行期间缓存的决策文本
+        held = []
+        try:
+            while True:
+                timeout = None if answered and not calls else max(0.0, step_deadline - loop.time())
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if self._direct is not None and choice.delta.tool_calls:
+                    stats["speculative_cancelled"] += 1
+                    direct, self._direct = self._direct, None
+                    await direct.cancel()
+                    if held:
+                        # 模型在调用工具前说的话
+                        answered = True
+                        yield "".join(held)
+                if choice.delta.content:
+                    self._step_text.append(choice.delta.content)
+                    if self._direct is not None:
+                        held.append(choice.delta.content)
+                        if sum(len(text) for text in held) >= AGENT_SPECULATIVE_COMMIT_CHARS:
+                            return
+                    else:
+                        answered = True
+                        yield choice.delta.content
+                for delta in choice.delta.tool_calls or []:
+                    call = calls.setdefault(delta.index, {"id": None, "name": "", "arguments": ""})
+                    if delta.id:
+                        call["id"] = delta.id
+                    if delta.function is not None:
+                        call["name"] += delta.function.name or ""
+                        call["arguments"] += delta.function.arguments or ""
+                if choice.finish_reason is not None:
+                    break
+            if self._direct is not None and held and not calls:
+                # 决策已经给出完整的回答，不再等还在生成的直接回答
+                stats["speculative_unused"] += 1
+                direct, self._direct = self._direct, None
+                await direct.cancel()
+                yield "".join(held)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await upstream.close()
+
+    async def _run_tools(self, calls: list, step_deadline: float):
+        for i, call in enumerate(calls):
+            call["id"] = call["id"] or f"call_{len(self.messages)}_{i}"
+        self.messages.append({
+            "role": "assistant",
+            # 有的模型会在调用工具前先说一句话，这段文字已经发给前端，也要留在对话里
+            "content": "".join(self._step_text) or None,
+            "tool_calls": [
+                {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"] or "{}"}}
+                for c in calls
+            ],
+        })
+        stats["tool_calls"] += len(calls)
+        if len(calls) > 1:
+            stats["parallel_batches"] += 1
+        results = await asyncio.gather(*(self._call(call, step_deadline) for call in calls))
+        # 这一轮的工具结果平分剩余预算，超出的截断
+        share = max(self.tool_budget // len(calls), TOOL_RESULT_MIN_TOKENS) if self.tool_budget is not None else None
+        for call, result in zip(calls, results):
+            if share is not None:
+                result = truncate_tokens(result, share)
+                self.tool_budget = max(0, self.tool_budget - count_tokens(result))
+            print(f"#################工具 {call['name']} 的执行结果：{result}")
+            self.messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+
+    async def _call(self, call: dict, step_deadline: float) -> str:
+        tool = self.tools.get(call["name"])
+        if tool is None:
+            stats["tool_errors"] += 1
+            self.tool_errors += 1
+            return f"工具 {call['name']} 不存在"
+        try:
+            arguments = json.loads(call["arguments"]) if call["arguments"] else {}
+        except json.JSONDecodeError as e:
+            stats["tool_errors"] += 1
+            self.tool_errors += 1
+            return f"工具参数不是合法的JSON：{str(e)}"
+        ttl = effective_ttl(tool.cache_ttl)
+        self.tool_ttl = ttl if self.tool_ttl is None else min(self.tool_ttl, ttl)
+        timeout = max(0.0, step_deadline - asyncio.get_running_loop().time())
+        try:
+            # 有效期内相同参数的调用直接复用结果；未命中时通过会话池的长连接会话调用
+            return await asyncio.wait_for(tool_result_cache.call(tool.url, tool.name, arguments, tool), timeout)
+        except asyncio.TimeoutError:
+            # wait_for 只取消本请求的等待，合并在一起的其他请求继续等同一个调用的结果
+            stats["tool_errors"] += 1
+            self.tool_errors += 1
+            return f"工具 {tool.name} 执行超时"
+        except LoadCancelled:
+            # 共享的工具调用被取消，本请求并没有被取消：当作这次调用失败，不中断整轮工具调用和回答
+            stats["tool_errors"] += 1
+            self.tool_errors += 1
+            return f"工具 {tool.name} 执行被取消"
+        except Exception as e:
+            stats["tool_errors"] += 1
+            self.tool_errors += 1
+            print(f"@@@@@@Error in call_tool:{e}")
+            return f"工具 {tool.name} 执行失败：{str(e)}"
+
+
+def _ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def metrics() -> dict:
+    return dict(stats)
@@ -0,0 +1,134 @@
+# 回答缓存：同样的问题在同样的上下文下直接回放之前的回答，不再调用大模型（默认关闭，ANSWER_CACHE_ENABLED 开启）
+# - 键：归一化后的问题 + 范围指纹。范围指纹由检索到的上下文、会话历史、检索开关（web_search/es_search/agent_mode）
+#   以及 Agent 模式下提供给模型的工具组成，任何一项不同都不会命中
+# - 近似问题（可选，ANSWER_CACHE_SIMILARITY > 0）：同一范围内按词袋向量（中文二元组 + 英文单词）的余弦相似度
+#   找最相近的已缓存问题，超过阈值即命中，不依赖外部向量服务
+# - 复用检索缓存的 TTL + LRU 和内存上限；请求带 bypass_cache=true 时既不读也不写缓存
+# - Agent 的回答有效期不超过用到的工具里最短的结果有效期，调用过不缓存的工具（有效期 0）的回答不缓存
+# - 命中时按同样的 SSE 帧格式分段回放，前端无感知
+import asyncio
+import hashlib
+import json
+import math
+import os
+from collections import Counter, OrderedDict
+
+from retrieval_cache import RetrievalCache, normalize_query
+from tool_index import tokenize
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# 近似问题命中的相似度阈值，0 表示只做精确匹配
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+# 参与近似匹配的范围数，以及每个范围内的问题数上限
+ANSWER_CACHE_MAX_CANDIDATES = int(os.getenv("ANSWER_CACHE_MAX_CANDIDATES", "256"))
+# 回放时每帧的字符数
+ANSWER_CACHE_REPLAY_CHUNK = int(os.getenv("ANSWER_CACHE_REPLAY_CHUNK", "16"))
+
+
+def fingerprint(context: str = "", history: list = (), flags: dict = None, tools: list = ()) -> str:
+    raw = json.dumps([context or "", list(history), flags or {}, sorted(tools)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _vector(query: str) -> dict:
+    counts = Counter(tokenize(query))
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {term: v / norm for term, v in counts.items()}
+
+
+def _cosine(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(term, 0.0) for term, v in a.items())
+
+
+class AnswerCache:
+    def __init__(self, enabled: bool = None, ttl: float = None, max_bytes: int = None, similarity: float = None):
+        self.enabled = ANSWER_CACHE_ENABLED if enabled is None else enabled
+        self.ttl = ANSWER_CACHE_TTL if ttl is None else ttl
+        self.similarity = ANSWER_CACHE_SIMILARITY if similarity is None else similarity
+        self.cache = RetrievalCache(ttl=self.ttl, max_bytes=ANSWER_CACHE_MAX_BYTES if max_bytes is None else max_bytes)
+        # 范围指纹 -> {归一化问题: 向量}，最近写入的在末尾
+        self._candidates = OrderedDict()
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "uncacheable": 0}
+
+    def get(self, query: str, scope: str, bypass: bool = False):
+        """返回缓存的回答，未命中返回 None；bypass 为 True 或未开启时不查缓存"""
+        if not self.enabled:
+            return None
+        if bypass:
+            self.stats["bypassed"] += 1
+            return None
+        answer = self.cache.peek("answer", query, {"scope": scope})
+        if answer is not None:
+            self.stats["hits"] += 1
+            return answer
+        if self.similarity > 0:
+            answer = self._near(query, scope)
+            if answer is not None:
+                self.stats["near_hits"] += 1
+                return answer
+        self.stats["misses"] += 1
+        return None
+
+    def _near(self, query: str, scope: str):
+        candidates = self._candidates.get(scope)
+        if not candidates:
+            return None
+        vector = _vector(query)
+        best, best_score = None, self.similarity
+        for other, other_vector in candidates.items():
+            score = _cosine(vector, other_vector)
+            if score >= best_score:
+                best, best_score = other, score
+        if best is None:
+            return None
+        answer = self.cache.peek("answer", best, {"scope": scope})
+        if answer is None:
+            # 已过期或被淘汰
+            del candidates[best]
+        return answer
+
+    def put(self, query: str, scope: str, answer: str, ttl: float = None):
+        """ttl 是回答依赖的数据的有效期（比如用到的工具结果），实际有效期取它和 ANSWER_CACHE_TTL 中较短的"""
+        if not self.enabled or not answer:
+            return
+        ttl = self.ttl if ttl is None else min(self.ttl, ttl)
+        if ttl <= 0:
+            self.stats["uncacheable"] += 1
+            return
+        self.cache.put("answer", query, {"scope": scope}, answer, ttl)
+        self.stats["stores"] += 1
+        if self.similarity > 0:
+            candidates = self._candidates.pop(scope, None) or OrderedDict()
+            # 范围按最近写入排序，最旧的范围先丢弃
+            self._candidates[scope] = candidates
+            normalized = normalize_query(query)
+            candidates.pop(normalized, None)
+            candidates[normalized] = _vector(normalized)
+            while len(candidates) > ANSWER_CACHE_MAX_CANDIDATES:
+                candidates.popitem(last=False)
+            while len(self._candidates) > ANSWER_CACHE_MAX_CANDIDATES:
+                self._candidates.popitem(last=False)
+
+    async def replay(self, answer: str):
+        """把缓存的回答切成小段产出，和大模型的增量输出走同一条 SSE 输出路径"""
+        for i in range(0, len(answer), ANSWER_CACHE_REPLAY_CHUNK):
+            yield answer[i:i + ANSWER_CACHE_REPLAY_CHUNK]
+            await asyncio.sleep(0)
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["near_hits"] + self.stats["misses"]
+        cache = self.cache.metrics()
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "similarity": self.similarity,
+            "hit_rate": round((self.stats["hits"] + self.stats["near_hits"]) / lookups, 4) if lookups else 0.0,
+            **{name: cache[name] for name in ("entries", "bytes", "max_bytes", "evictions", "expired")},
+        }
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,83 @@
+# 准入控制基准：模拟流量突增，同时发起大量 /api/stream 请求，对比不限制（上限设得足够大）和限制大模型并发时
+# 上游同时承受的流数、被拒绝的请求数和拒绝耗时（队列满时应立即返回 429），以及 /api/metrics 里的排队深度和等待时间
+# 用法（在 app 目录下）：python -m bench.admission_spike --spike 100 --limit 8 --queue 16 --max-wait 2
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench.es_client_standin import summarize
+from bench.harness import AppProcess
+from bench.mock_llm import BackgroundServer, create_mock_llm_app
+
+
+async def one_request(client: httpx.AsyncClient, url: str, index: int) -> tuple:
+    start = time.perf_counter()
+    async with client.stream("GET", f"{url}/api/stream", params={"query": f"突增请求{index}"}) as response:
+        if response.status_code == 429:
+            await response.aread()
+            return "rejected", time.perf_counter() - start
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = json.loads(line[6:])
+            if data.get("done"):
+                status = "error" if data.get("content", "").startswith("错误") else "ok"
+                return status, time.perf_counter() - start
+    return "error", time.perf_counter() - start
+
+
+async def spike(url: str, count: int) -> dict:
+    limits = httpx.Limits(max_connections=count + 5)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        results = await asyncio.gather(*(one_request(client, url, i) for i in range(count)))
+        metrics = (await client.get(f"{url}/api/metrics")).json()
+    report = {}
+    for status in ("ok", "rejected", "error"):
+        latencies = [seconds for result, seconds in results if result == status]
+        report[status] = {"count": len(latencies), **(summarize(latencies) if latencies else {})}
+    report["admission"] = {key: metrics["admission"]["llm"][key]
+                           for key in ("admitted", "queued", "rejected_queue_full", "rejected_timeout", "max_waiting",
+                                       "wait_avg_ms", "wait_p99_ms", "wait_max_ms")}
+    return report
+
+
+def run(llm, args, limit: int, queue: int) -> dict:
+    stats = llm.server.config.app.state.stats
+    stats["max_active_streams"] = 0
+    app = AppProcess({"API_KEY": "bench", "BASE_URL": f"{llm.url}/v1", "MODEL_NAME": "mock",
+                      "LLM_CONCURRENCY": str(limit), "LLM_QUEUE_SIZE": str(queue),
+                      "LLM_MAX_WAIT": str(args.max_wait)}).start()
+    try:
+        report = asyncio.run(spike(app.url, args.spike))
+    finally:
+        app.stop()
+    return {"llm_concurrency": limit, "queue_size": queue, **report,
+            "upstream_max_active_streams": stats["max_active_streams"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spike", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=8)
+    parser.add_argument("--queue", type=int, default=16)
+    parser.add_argument("--max-wait", type=float, default=2)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    llm = BackgroundServer(create_mock_llm_app(args.tokens, args.token_delay)).start()
+    try:
+        report = {
+            "unlimited": run(llm, args, args.spike * 10, args.spike * 10),
+            "admission_control": run(llm, args, args.limit, args.queue),
+        }
+    finally:
+        llm.stop()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Agent 引擎基准：本地启动 order_service 和模拟大模型（按 tool_plan 返回 function calling 的工具调用），
+# 对比复合问题（"销售冠军和本月销售额"）下：
+# - parallel：模型在一轮里同时调用两个工具，工具并发执行，两次大模型往返
+# - sequential：模型每轮只调用一个工具，需要三次大模型往返
+# - step_timeout：决策超过 AGENT_STEP_TIMEOUT，放弃工具直接回答
+# - direct / direct_speculative：不需要工具的问题，对比关闭和开启推测执行（AGENT_SPECULATIVE）时的首字时间
+# 统计首个内容帧时间、总耗时和大模型请求数；工具结果缓存关闭，保证每次都真正调用工具
+# 用法（在 app 目录下）：python -m bench.agent_loop --requests 10 --decision-ms 200
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import httpx
+
+from bench.es_client_standin import summarize
+from bench.harness import APP_DIR, AppProcess
+from bench.mcp_pool_bench import MCPServerProcess
+from bench.mock_llm import BackgroundServer, create_mock_llm_app
+
+RANKING = {"name": "get_salesperson_ranking", "arguments": {"limit": 1}}
+MONTHLY = {"name": "get_monthly_sales_total", "arguments": {"month": 7}}
+NO_SPECULATION = {"AGENT_SPECULATIVE": "false"}
+SPECULATION = {"AGENT_SPECULATIVE": "true"}
+SCENARIOS = {
+    "parallel": {"plan": [[RANKING, MONTHLY]], "env": NO_SPECULATION},
+    "parallel_speculative": {"plan": [[RANKING, MONTHLY]], "env": SPECULATION},
+    "sequential": {"plan": [[RANKING], [MONTHLY]], "env": NO_SPECULATION},
+    "step_timeout": {"plan": [[RANKING, MONTHLY]], "env": {**NO_SPECULATION, "AGENT_STEP_TIMEOUT": "0.1"}},
+    "direct": {"plan": None, "env": NO_SPECULATION},
+    "direct_speculative": {"plan": None, "env": SPECULATION},
+}
+
+
+def timed_request(client: httpx.Client) -> tuple:
+    start = time.perf_counter()
+    first = None
+    with client.stream("GET", "/api/stream", params={"query": "销售冠军是谁，7月销售额是多少", "agent_mode": "true"}) as response:
+        for line in response.iter_lines():
+            if first is None and line.startswith("data:") and json.loads(line[5:]).get("content"):
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def run_scenario(name: str, args, order: MCPServerProcess) -> dict:
+    scenario = SCENARIOS[name]
+    llm = BackgroundServer(create_mock_llm_app(args.tokens, args.token_ms / 1000, tool_plan=scenario["plan"],
+                                               decision_delay=args.decision_ms / 1000)).start()
+    env = {"API_KEY": "x", "BASE_URL": f"{llm.url}/v1", "MODEL_NAME": "m", "MCP_TOOL_CACHE_DEFAULT_TTL": "0",
+           **scenario["env"]}
+    app = AppProcess(env).start()
+    try:
+        client = httpx.Client(base_url=app.url, timeout=60)
+        client.post("/api/mcp/servers", json={"name": "order", "url": order.url}).raise_for_status()
+        stats = llm.server.config.app.state.stats
+        stats["requests"] = 0
+        firsts, totals = [], []
+        for _ in range(args.requests):
+            first, total = timed_request(client)
+            firsts.append(first)
+            totals.append(total)
+        agent = client.get("/api/metrics").json()["agent"]
+        return {
+            "first_content": summarize(firsts),
+            "total": summarize(totals),
+            "llm_requests_per_question": stats["requests"] / args.requests,
+            "llm_cancelled_streams": stats["cancelled_streams"],
+            "agent": agent,
+        }
+    finally:
+        app.stop()
+        llm.stop()
+        shutil.rmtree(app.workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--decision-ms", type=float, default=200)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="agent_bench_")
+    order_db = os.path.join(workdir, "orders.db")
+    shutil.copy(os.path.join(APP_DIR, "chat_history.db"), order_db)
+    order = MCPServerProcess("mcp_server.order_service", {"ORDER_DB_PATH": order_db}).start()
+    try:
+        report = {name: run_scenario(name, args, order) for name in SCENARIOS}
+        print(json.dumps({"requests": args.requests, "decision_ms": args.decision_ms, **report}, ensure_ascii=False, indent=2))
+    finally:
+        order.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# 上下文检索阶段对比：改造前逐个 await 各检索来源，耗时是各来源之和；
+# 改造后并发执行，耗时约等于最慢的来源，且超过截止时间的来源被跳过
+# 检索来源用固定延迟的替身函数模拟，不依赖真实的搜索服务
+# 用法（在 app 目录下）：python -m bench.context_gather --web-ms 400 --es-ms 150 --slow-ms 5000 --deadline 1
+import argparse
+import asyncio
+import json
+import time
+
+from retrievers import RetrieverRegistry
+
+
+def standin(name: str, delay: float):
+    async def fetch(query: str) -> str:
+        await asyncio.sleep(delay)
+        return f"{name} 关于 {query} 的结果"
+    return fetch
+
+
+async def run(args) -> dict:
+    sources = {"web_search": args.web_ms / 1000, "es_search": args.es_ms / 1000, "slow_source": args.slow_ms / 1000}
+
+    start = time.perf_counter()
+    for name, delay in sources.items():
+        await standin(name, delay)("问题")
+    sequential = time.perf_counter() - start
+
+    registry = RetrieverRegistry()
+    for name, delay in sources.items():
+        registry.register(name, standin(name, delay), deadline=args.deadline)
+    start = time.perf_counter()
+    context, timings = await registry.gather("问题", {name: True for name in sources})
+    parallel = time.perf_counter() - start
+    return {
+        "sequential_seconds": round(sequential, 3),
+        "parallel_seconds": round(parallel, 3),
+        "deadline_seconds": args.deadline,
+        "timings": timings,
+        "context": context,
+        "metrics": registry.metrics(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--web-ms", type=float, default=400)
+    parser.add_argument("--es-ms", type=float, default=150)
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--deadline", type=float, default=1)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
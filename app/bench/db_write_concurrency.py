@@ -0,0 +1,150 @@
+# SQLite 并发写入基准：对比改造前"每次调用 sqlite3.connect + 回滚日志模式"与 db 模块（WAL + 单写线程 + 读连接池）
+# 每个"对话轮次"写入两条 messages 并更新 chat_sessions.updated_at，与 add_message_to_session 相同
+# 用法（在 app 目录下）：python -m bench.db_write_concurrency --writers 32 --turns 50
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY, summary TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, content TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+def new_database(sessions: int) -> tuple:
+    path = os.path.join(tempfile.mkdtemp(prefix="chat_db_bench_"), "chat_history.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    conn.executemany("INSERT INTO chat_sessions (id, summary) VALUES (?, ?)", [(i, "bench") for i in ids])
+    conn.commit()
+    conn.close()
+    return path, ids
+
+
+def write_turn(conn, session_id: str, text: str):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute("INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)", (session_id, "user", text, now))
+    conn.execute("INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)", (session_id, "assistant", text, now))
+    conn.execute("UPDATE chat_sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+
+
+def legacy_turn(path: str, session_id: str, text: str):
+    conn = sqlite3.connect(path)
+    write_turn(conn, session_id, text)
+    conn.commit()
+    conn.close()
+
+
+async def loop_lag_probe(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - start - 0.005)
+
+
+async def run_async(writers: int, turns: int, text: str, turn) -> dict:
+    stop = asyncio.Event()
+    lags = []
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+
+    async def writer(index):
+        for _ in range(turns):
+            await turn(index)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(i) for i in range(writers)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return {
+        "turns_per_s": round(writers * turns / elapsed, 1),
+        "elapsed_s": round(elapsed, 3),
+        "loop_lag_max_ms": round(max(lags, default=0) * 1000, 1),
+    }
+
+
+def bench_legacy_inline(writers, turns, text):
+    # 改造前的写法：在协程里直接同步执行，阻塞事件循环
+    path, ids = new_database(writers)
+
+    async def turn(index):
+        legacy_turn(path, ids[index], text)
+
+    return asyncio.run(run_async(writers, turns, text, turn))
+
+
+def bench_legacy_threads(writers, turns, text):
+    # 改造前的写法放到多线程（或多进程）里并发执行时，回滚日志模式下写者互相争锁
+    path, ids = new_database(writers)
+    errors = []
+
+    def worker(index):
+        for _ in range(turns):
+            try:
+                legacy_turn(path, ids[index], text)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "turns_per_s": round((writers * turns - len(errors)) / elapsed, 1),
+        "elapsed_s": round(elapsed, 3),
+        "locked_errors": len(errors),
+    }
+
+
+def bench_pooled(writers, turns, text):
+    path, ids = new_database(writers)
+    db.configure(path=path)
+
+    async def turn(index):
+        await db.transaction(write_turn, ids[index], text)
+
+    try:
+        return asyncio.run(run_async(writers, turns, text, turn))
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--content-bytes", type=int, default=800)
+    args = parser.parse_args()
+    text = "字" * (args.content_bytes // 3)
+
+    report = {
+        "writers": args.writers,
+        "turns_per_writer": args.turns,
+        "legacy_inline": bench_legacy_inline(args.writers, args.turns, text),
+        "legacy_threads": bench_legacy_threads(args.writers, args.turns, text),
+        "pooled_wal": bench_pooled(args.writers, args.turns, text),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
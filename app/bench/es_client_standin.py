@@ -0,0 +1,139 @@
+# ES 客户端对比：用本地的 Elasticsearch 替身服务（只实现 / 和 /{index}/_search），
+# 对比改造前"每次查询新建客户端 + ping + 同步 search"与共享异步客户端的延迟和 TCP 连接复用情况，
+# 并演示替身服务挂起时熔断器的快速失败
+# 用法（在 app 目录下）：python -m bench.es_client_standin --queries 50 --delay-ms 5
+import argparse
+import asyncio
+import json
+import time
+
+from elasticsearch import Elasticsearch
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from bench.mock_llm import BackgroundServer
+
+ES_HEADERS = {"X-Elastic-Product": "Elasticsearch"}
+
+
+def create_standin_app(delay: float):
+    state = {"connections": set(), "requests": 0, "hang": False}
+
+    async def track(request: Request):
+        state["requests"] += 1
+        # 客户端的 (ip, 端口) 相同说明复用了同一条 TCP 连接
+        state["connections"].add(tuple(request.scope["client"]))
+        if state["hang"]:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(delay)
+
+    async def info(request: Request):
+        await track(request)
+        return JSONResponse({"name": "standin", "cluster_name": "standin", "version": {"number": "8.18.0"},
+                             "tagline": "You Know, for Search"}, headers=ES_HEADERS)
+
+    async def search(request: Request):
+        await track(request)
+        body = await request.json()
+        query = body["query"]["multi_match"]["query"]
+        return JSONResponse({"took": 1, "timed_out": False,
+                             "hits": {"total": {"value": 1, "relation": "eq"}, "max_score": 1.0,
+                                      "hits": [{"_index": request.path_params["index"], "_id": "1", "_score": 1.0,
+                                                "_source": {"title": query, "content": "替身内容"}}]}},
+                            headers=ES_HEADERS)
+
+    app = Starlette(routes=[Route("/", info, methods=["GET", "HEAD"]),
+                            Route("/{index}/_search", search, methods=["POST"])])
+    app.state.standin = state
+    return app
+
+
+def search_body(query: str) -> dict:
+    return {"query": {"multi_match": {"query": query, "fields": ["title", "content"], "type": "best_fields"}},
+            "size": 10, "_source": ["title", "content"]}
+
+
+def legacy_search(url: str, query: str):
+    # 改造前 perform_es_search 的做法
+    es = Elasticsearch([url], verify_certs=False)
+    if not es.ping():
+        raise RuntimeError("ping failed")
+    return es.search(index="news_index", body=search_body(query)).body
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {"p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2)}
+
+
+async def pooled_queries(queries: int) -> list:
+    import es_client
+    latencies = []
+    for i in range(queries):
+        start = time.perf_counter()
+        await es_client.search(search_body(f"问题{i}"))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def breaker_demo(state: dict) -> dict:
+    import es_client
+    state["hang"] = True
+    timings = []
+    for i in range(es_client.ES_BREAKER_FAILURES + 3):
+        start = time.perf_counter()
+        try:
+            await es_client.search(search_body("挂起"))
+            outcome = "ok"
+        except es_client.CircuitOpenError:
+            outcome = "circuit_open"
+        except Exception as e:
+            outcome = type(e).__name__
+        timings.append({"outcome": outcome, "ms": round((time.perf_counter() - start) * 1000, 1)})
+    state["hang"] = False
+    await es_client.close()
+    return {"breaker_state": es_client.breaker.state, "calls": timings}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--delay-ms", type=float, default=5)
+    parser.add_argument("--request-timeout", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server = BackgroundServer(create_standin_app(args.delay_ms / 1000)).start()
+    state = server.server.config.app.state.standin
+    try:
+        latencies = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            legacy_search(server.url, f"问题{i}")
+            latencies.append(time.perf_counter() - start)
+        legacy = {**summarize(latencies), "requests": state["requests"], "tcp_connections": len(state["connections"])}
+
+        import es_client
+        es_client.ES_URL = server.url
+        es_client.ES_REQUEST_TIMEOUT = args.request_timeout
+        state["connections"].clear()
+        state["requests"] = 0
+
+        async def run_pooled():
+            await es_client.warm_up()
+            latencies = await pooled_queries(args.queries)
+            report = {**summarize(latencies), "requests": state["requests"], "tcp_connections": len(state["connections"])}
+            report["breaker"] = await breaker_demo(state)
+            return report
+
+        pooled = asyncio.run(run_pooled())
+        print(json.dumps({"queries": args.queries, "legacy_client_per_query": legacy, "shared_async_client": pooled},
+                         ensure_ascii=False, indent=2))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# 导出内存基准：会话越来越长时，流式导出的峰值内存（tracemalloc）应保持平稳
+# 用法（在 app 目录下）：python -m bench.export_memory --sizes 1000,10000,100000
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import db
+from bench.db_write_concurrency import SCHEMA
+from export import export_archive_stream, export_session_stream
+
+
+def build_session(path: str, messages: int, content_bytes: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("CREATE INDEX idx_messages_session_id ON messages (session_id, id)")
+    conn.execute("INSERT INTO chat_sessions (id, summary) VALUES ('s', '导出测试')")
+    content = "x" * content_bytes
+    conn.executemany("INSERT INTO messages (session_id, role, content) VALUES ('s', ?, ?)",
+                     (("user" if i % 2 == 0 else "assistant", content) for i in range(messages)))
+    conn.commit()
+    conn.close()
+
+
+async def consume(stream) -> int:
+    total = 0
+    async for chunk in stream:
+        total += len(chunk)
+    return total
+
+
+async def measure(stream_factory) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = await consume(stream_factory())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"output_mb": round(size / 1e6, 1), "peak_mb": round(peak / 1e6, 2), "elapsed_s": round(elapsed, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000", help="会话消息条数，逗号分隔")
+    parser.add_argument("--content-bytes", type=int, default=1000)
+    args = parser.parse_args()
+
+    session = {"id": "s", "summary": "导出测试"}
+    for messages in (int(n) for n in args.sizes.split(",")):
+        workdir = tempfile.mkdtemp(prefix="chat_export_bench_")
+        try:
+            path = os.path.join(workdir, "chat_history.db")
+            build_session(path, messages, args.content_bytes)
+            db.configure(path=path)
+            report = {
+                "messages": messages,
+                "markdown": asyncio.run(measure(lambda: export_session_stream(session, "md"))),
+                "jsonl_gzip": asyncio.run(measure(lambda: export_session_stream(session, "jsonl", compress=True))),
+                "zip_archive": asyncio.run(measure(lambda: export_archive_stream(["s"], "md"))),
+            }
+            print(json.dumps(report, ensure_ascii=False))
+        finally:
+            db.close()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# 在临时目录里启动一份完整的 FastAPI 应用，供压测脚本使用，不会读写仓库里的 chat_history.db
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench.mock_llm import free_port
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_app_dir(env: dict) -> str:
+    workdir = tempfile.mkdtemp(prefix="chat_bench_")
+    for name in os.listdir(APP_DIR):
+        if name.endswith(".py"):
+            shutil.copy(os.path.join(APP_DIR, name), workdir)
+    shutil.copytree(os.path.join(APP_DIR, "static"), os.path.join(workdir, "static"))
+    with open(os.path.join(workdir, ".env"), "w") as f:
+        for key, value in env.items():
+            f.write(f"{key}={value}\n")
+    subprocess.run([sys.executable, "-c", "import main; main.init_db()"], cwd=workdir, check=True, capture_output=True)
+    return workdir
+
+
+class AppProcess:
+    """用 uvicorn 子进程运行应用，extra_args 可传入 --workers 等参数"""
+
+    def __init__(self, env: dict, extra_args=None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workdir = prepare_app_dir(env)
+        self.extra_args = extra_args or []
+        self.proc = None
+
+    def start(self, timeout: float = 30):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning", *self.extra_args],
+            cwd=self.workdir,
+            stdout=subprocess.DEVNULL,
+        )
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if httpx.get(f"{self.url}/api/health", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("应用启动超时")
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
@@ -0,0 +1,112 @@
+# 会话列表 / 会话消息读取基准：在合成数据库（默认 10 万会话、100 万条消息）上对比建索引前后的查询耗时，
+# 以及游标分页在不同深度下的耗时（应与深度无关）
+# 用法（在 app 目录下）：python -m bench.history_pagination --sessions 100000 --messages 1000000
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import db
+from bench.db_write_concurrency import SCHEMA
+
+
+def build_database(path: str, sessions: int, messages: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("CREATE TABLE mcp_tools (id TEXT PRIMARY KEY, server_id TEXT)")
+    start = datetime(2025, 1, 1)
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    conn.executemany(
+        "INSERT INTO chat_sessions (id, summary, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        ((sid, f"会话{i}", start.strftime('%Y-%m-%d %H:%M:%S'),
+          (start + timedelta(seconds=random.randrange(10_000_000))).strftime('%Y-%m-%d %H:%M:%S'))
+         for i, sid in enumerate(session_ids))
+    )
+    # 消息随机分布到各个会话，模拟多个会话交替对话的真实写入顺序
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)",
+        ((random.choice(session_ids), "user" if i % 2 == 0 else "assistant", "消息内容" * 20) for i in range(messages))
+    )
+    conn.commit()
+    conn.close()
+    return session_ids
+
+
+def timed(conn, sql, params=(), repeat=20) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(sql, params).fetchall()
+    return round((time.perf_counter() - start) / repeat * 1000, 3)
+
+
+def measure(conn, session_ids, pages: int, page_size: int) -> dict:
+    sid = random.choice(session_ids)
+    result = {
+        "get_session_all_ms": timed(conn, "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id asc", (sid,)),
+        "delete_lookup_ms": timed(conn, "SELECT count(*) FROM messages WHERE session_id = ?", (sid,)),
+        "history_all_ms": timed(conn, "SELECT id, summary, updated_at FROM chat_sessions ORDER BY updated_at DESC, id DESC", repeat=3),
+        "history_first_page_ms": timed(conn, "SELECT id, summary, updated_at FROM chat_sessions ORDER BY updated_at DESC, id DESC LIMIT ?", (page_size + 1,)),
+    }
+    # 沿游标翻到第 pages 页，记录最后一页的耗时
+    cursor = None
+    for _ in range(pages):
+        if cursor:
+            rows = conn.execute(
+                "SELECT id, summary, updated_at FROM chat_sessions WHERE (updated_at, id) < (?, ?) ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (*cursor, page_size + 1)).fetchall()
+        else:
+            rows = conn.execute("SELECT id, summary, updated_at FROM chat_sessions ORDER BY updated_at DESC, id DESC LIMIT ?",
+                                (page_size + 1,)).fetchall()
+        cursor = (rows[page_size - 1][2], rows[page_size - 1][0])
+    result[f"history_page_{pages}_ms"] = timed(
+        conn,
+        "SELECT id, summary, updated_at FROM chat_sessions WHERE (updated_at, id) < (?, ?) ORDER BY updated_at DESC, id DESC LIMIT ?",
+        (*cursor, page_size + 1))
+    result["session_last_page_ms"] = timed(
+        conn, "SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (sid, page_size + 1))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="chat_history_bench_")
+    path = os.path.join(workdir, "chat_history.db")
+    try:
+        start = time.perf_counter()
+        session_ids = build_database(path, args.sessions, args.messages)
+        build_s = round(time.perf_counter() - start, 1)
+
+        conn = db.connect(path)
+        before = measure(conn, session_ids, args.pages, args.page_size)
+        start = time.perf_counter()
+        db.migrate(conn)
+        migrate_s = round(time.perf_counter() - start, 1)
+        after = measure(conn, session_ids, args.pages, args.page_size)
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id, summary, updated_at FROM chat_sessions WHERE (updated_at, id) < (?, ?) "
+            "ORDER BY updated_at DESC, id DESC LIMIT 51", ("2025-03-01 00:00:00", "x")).fetchall()
+        conn.close()
+        print(json.dumps({
+            "sessions": args.sessions, "messages": args.messages,
+            "build_s": build_s, "migrate_s": migrate_s,
+            "before_indexes": before, "after_indexes": after,
+            "history_page_plan": [row[3] for row in plan],
+        }, ensure_ascii=False, indent=2))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
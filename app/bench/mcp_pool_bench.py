@@ -0,0 +1,143 @@
+# MCP 会话池基准：在本地启动 order_service 和 weather_service（订单库使用 chat_history.db 的临时副本），
+# 对比每次调用新建 Client(SSETransport(url)) 与会话池复用长连接会话的延迟，
+# 并演示并发调用、服务器重启后的自动重连
+# weather_service 的工具需要访问外部天气接口，这里只对它做 list_tools
+# 用法（在 app 目录下）：python -m bench.mcp_pool_bench --calls 50 --concurrency 20
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from fastmcp import Client
+from fastmcp.client.transports import SSETransport
+
+from bench.es_client_standin import summarize
+from bench.harness import APP_DIR
+from bench.mock_llm import free_port
+
+
+class MCPServerProcess:
+    """用 uvicorn 子进程运行 mcp_server 下的某个服务，端口随机"""
+
+    def __init__(self, module: str, env: dict = None, port: int = None):
+        self.module = module
+        self.env = env or {}
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}/sse"
+        self.proc = None
+
+    def start(self, timeout: float = 20):
+        code = (f"import uvicorn; from {self.module} import mcp; "
+                f"uvicorn.run(mcp.sse_app(), host='127.0.0.1', port={self.port}, log_level='warning')")
+        self.proc = subprocess.Popen([sys.executable, "-c", code], cwd=APP_DIR, env={**os.environ, **self.env},
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                with httpx.stream("GET", self.url, timeout=1) as response:
+                    if response.status_code == 200:
+                        return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"{self.module} 启动超时")
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                # 还有 SSE 长连接时 uvicorn 会一直等待，超时直接结束进程
+                self.proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+
+async def timed(fn, calls: int) -> list:
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run(args, order: MCPServerProcess, weather: MCPServerProcess) -> dict:
+    from mcp_pool import MCPPool
+
+    async def legacy_call():
+        async with Client(SSETransport(order.url)) as client:
+            return await client.call_tool("get_monthly_sales_total", {"month": 7})
+
+    async def legacy_list():
+        async with Client(SSETransport(weather.url)) as client:
+            return await client.list_tools()
+
+    pool = MCPPool(size=args.pool_size, max_concurrent=args.concurrency)
+    report = {
+        "order_service call_tool": {
+            "connect_per_call": summarize(await timed(legacy_call, args.calls)),
+            "session_pool": summarize(await timed(
+                lambda: pool.call_tool(order.url, "get_monthly_sales_total", {"month": 7}), args.calls)),
+        },
+        "weather_service list_tools": {
+            "connect_per_call": summarize(await timed(legacy_list, args.calls)),
+            "session_pool": summarize(await timed(lambda: pool.list_tools(weather.url), args.calls)),
+        },
+    }
+
+    start = time.perf_counter()
+    await asyncio.gather(*(legacy_call() for _ in range(args.concurrency)))
+    legacy_burst = time.perf_counter() - start
+    start = time.perf_counter()
+    await asyncio.gather(*(pool.call_tool(order.url, "get_salesperson_ranking", {"limit": 3})
+                           for _ in range(args.concurrency)))
+    report["concurrent_burst"] = {"calls": args.concurrency, "connect_per_call_seconds": round(legacy_burst, 3),
+                                  "session_pool_seconds": round(time.perf_counter() - start, 3)}
+
+    # 重启 order_service：旧会话断开，下一次调用自动重连
+    order.stop()
+    order.start()
+    await asyncio.sleep(0.2)
+    start = time.perf_counter()
+    try:
+        result = await pool.call_tool(order.url, "get_highest_spending_customer")
+        outcome = result[0].text
+    except Exception as e:
+        outcome = f"{type(e).__name__}: {str(e)}"
+    report["after_restart"] = {"outcome": outcome, "seconds": round(time.perf_counter() - start, 3)}
+    report["pool_metrics"] = pool.metrics()
+    await pool.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mcp_bench_")
+    order_db = os.path.join(workdir, "orders.db")
+    shutil.copy(os.path.join(APP_DIR, "chat_history.db"), order_db)
+    order = MCPServerProcess("mcp_server.order_service", {"ORDER_DB_PATH": order_db}).start()
+    weather = MCPServerProcess("mcp_server.weather_service").start()
+    try:
+        report = asyncio.run(run(args, order, weather))
+        print(json.dumps({"calls": args.calls, **report}, ensure_ascii=False, indent=2))
+    finally:
+        order.stop()
+        weather.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# 后写消息日志的吞吐基准：多个并发请求持续写入对话轮次，对比"每轮一个事务"与不同刷新窗口下的组提交
+# 默认使用 synchronous=FULL（每次提交都 fsync），更接近 fsync 受限的真实磁盘场景
+# 用法（在 app 目录下）：python -m bench.message_log_throughput --producers 200 --turns 20 --windows 0,2,10,50
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import db
+from bench.db_write_concurrency import SCHEMA
+from message_log import MessageLog, _write_turns
+
+
+def new_database(directory: str) -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix="chat_log_bench_", dir=directory), "chat_history.db")
+    conn = db.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+    return path
+
+
+async def produce(producers: int, turns: int, write_turn) -> float:
+    async def producer():
+        session_id = str(uuid.uuid4())
+        for i in range(turns):
+            await write_turn(session_id, i == 0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(producers)))
+    return time.perf_counter() - start
+
+
+async def bench_per_turn(producers: int, turns: int, text: str) -> dict:
+    async def write_turn(session_id, new_session):
+        await db.transaction(_write_turns, [(session_id, text, text, new_session, "bench", "2026-01-01 00:00:00", None)])
+
+    elapsed = await produce(producers, turns, write_turn)
+    return {"turns_per_s": round(producers * turns / elapsed, 1), "transactions": producers * turns}
+
+
+async def bench_window(producers: int, turns: int, text: str, window_ms: float) -> dict:
+    log = MessageLog(flush_interval=window_ms / 1000)
+    latencies = []
+
+    async def write_turn(session_id, new_session):
+        start = time.perf_counter()
+        # 等待落库：衡量的是"持久化后的"吞吐，同时记录每轮的落库延迟
+        await log.append_turn(session_id, text, text, new_session=new_session, summary="bench")
+        latencies.append(time.perf_counter() - start)
+
+    elapsed = await produce(producers, turns, write_turn)
+    await log.stop()
+    latencies.sort()
+    return {
+        "turns_per_s": round(producers * turns / elapsed, 1),
+        "transactions": log.batches,
+        "persist_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "persist_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--producers", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--windows", default="0,2,10,50", help="刷新窗口（毫秒），逗号分隔")
+    parser.add_argument("--synchronous", default="FULL")
+    parser.add_argument("--dir", default=None, help="数据库所在目录，建议放在真实磁盘上")
+    args = parser.parse_args()
+    db.DB_SYNCHRONOUS = args.synchronous
+    text = "字" * 200
+
+    def run(name, coro_factory):
+        path = new_database(args.dir)
+        db.configure(path=path)
+        try:
+            results[name] = asyncio.run(coro_factory())
+        finally:
+            db.close()
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    results = {}
+    run("per_turn_transaction", lambda: bench_per_turn(args.producers, args.turns, text))
+    for window in args.windows.split(","):
+        run(f"window_{window}ms", lambda: bench_window(args.producers, args.turns, text, float(window)))
+    print(json.dumps({"producers": args.producers, "turns_per_producer": args.turns,
+                      "synchronous": args.synchronous, **results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
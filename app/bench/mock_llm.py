@@ -0,0 +1,117 @@
+# 本地模拟的 OpenAI 兼容大模型服务，用于压测和基准测试，不依赖真实的大模型 API
+# 支持流式(SSE)和非流式两种 /v1/chat/completions 响应，每个token之间可以设置固定延迟，模拟上游逐字生成
+# 传入 tool_plan 时模拟 function calling：请求带 tools 时，第 i 轮（已有 i 轮工具结果）返回 tool_plan[i] 中的工具调用，
+# 计划用完（或 tool_choice 为 none）后返回普通文本。decision_delay 模拟带 tools 的请求额外的决策耗时（直接回答时同样生效）
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_mock_llm_app(tokens: int = 50, token_delay: float = 0.02, token_text: str = "字", tool_plan: list = None,
+                        decision_delay: float = 0.0):
+    stats = {"requests": 0, "active_streams": 0, "max_active_streams": 0, "tool_call_turns": 0, "cancelled_streams": 0}
+
+    def chunk(content=None, finish_reason=None):
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{"index": 0, "delta": {"content": content} if content is not None else {}, "finish_reason": finish_reason}],
+        }
+
+    def tool_call_chunks(calls: list):
+        # 和真实接口一样分两段发送：先发 id 和函数名，再发参数
+        for i, call in enumerate(calls):
+            head = {"index": i, "id": f"call_mock_{i}", "type": "function", "function": {"name": call["name"], "arguments": ""}}
+            body = {"index": i, "function": {"arguments": json.dumps(call.get("arguments", {}), ensure_ascii=False)}}
+            for delta in (head, body):
+                yield {**chunk(), "choices": [{"index": 0, "delta": {"tool_calls": [delta]}, "finish_reason": None}]}
+        yield chunk(finish_reason="tool_calls")
+
+    async def completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        step = sum(1 for message in body.get("messages", []) if message.get("role") == "assistant" and message.get("tool_calls"))
+        if tool_plan and body.get("tools") and body.get("tool_choice") != "none" and step < len(tool_plan):
+            stats["tool_call_turns"] += 1
+
+            async def tool_stream():
+                await asyncio.sleep(decision_delay)
+                for item in tool_call_chunks(tool_plan[step]):
+                    yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(tool_stream(), media_type="text/event-stream")
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay * tokens)
+            return JSONResponse({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": token_text * tokens}, "finish_reason": "stop"}],
+            })
+
+        async def stream():
+            stats["active_streams"] += 1
+            stats["max_active_streams"] = max(stats["max_active_streams"], stats["active_streams"])
+            try:
+                if body.get("tools") and body.get("tool_choice") != "none":
+                    await asyncio.sleep(decision_delay)
+                for _ in range(tokens):
+                    await asyncio.sleep(token_delay)
+                    yield f"data: {json.dumps(chunk(token_text))}\n\n"
+                yield f"data: {json.dumps(chunk(finish_reason='stop'))}\n\n"
+                yield "data: [DONE]\n\n"
+            except (asyncio.CancelledError, GeneratorExit):
+                stats["cancelled_streams"] += 1
+                raise
+            finally:
+                stats["active_streams"] -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+    app.state.stats = stats
+    return app
+
+
+def create_mock_llm_app_from_env():
+    """uvicorn --factory 用：参数从环境变量读取，便于用多个工作进程运行，避免模拟服务本身成为瓶颈"""
+    return create_mock_llm_app(int(os.getenv("MOCK_LLM_TOKENS", "50")), float(os.getenv("MOCK_LLM_TOKEN_DELAY", "0.02")))
+
+
+class BackgroundServer:
+    """在后台线程里运行一个 uvicorn 服务，用完调用 stop()"""
+
+    def __init__(self, app, port: int = None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
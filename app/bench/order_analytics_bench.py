@@ -0,0 +1,147 @@
+# 订单分析基准：生成合成订单数据，对比 order_service 原来的全表扫描查询和分析层（索引 + 增量汇总表）
+# - 原来的查询：strftime 过滤月份、按客户/产品/销售员 GROUP BY
+# - 分析层：汇总表查询；另外测量触发器维护汇总带来的写入开销，并校验汇总结果与 GROUP BY 一致
+# 用法（在 app 目录下）：python -m bench.order_analytics_bench --orders 1000000
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from mcp_server import order_analytics
+
+ORDERS_DDL = """
+CREATE TABLE orders (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  customer_id INTEGER NOT NULL,
+  customer_name TEXT NOT NULL,
+  product_id TEXT NOT NULL,
+  product_name TEXT NOT NULL,
+  price REAL NOT NULL,
+  sales_id INTEGER NOT NULL,
+  sales_name TEXT NOT NULL,
+  create_time INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+  pay_time INTEGER,
+  status INTEGER NOT NULL
+)
+"""
+
+LEGACY_QUERIES = {
+    "monthly_sales_total": ("SELECT SUM(price) FROM orders WHERE strftime('%m', datetime(create_time, 'unixepoch')) = ?", ("07",)),
+    "highest_spending_customer": ("SELECT customer_name, SUM(price) AS t FROM orders GROUP BY customer_name ORDER BY t DESC LIMIT 1", ()),
+    "most_popular_product": ("SELECT product_name, COUNT(*) AS c FROM orders GROUP BY product_name ORDER BY c DESC LIMIT 1", ()),
+    "salesperson_ranking": ("SELECT sales_name, SUM(price) AS t FROM orders GROUP BY sales_name ORDER BY t DESC LIMIT 10", ()),
+}
+
+ANALYTICS_QUERIES = {
+    "monthly_sales_total": lambda conn: order_analytics.monthly_sales(conn, order_analytics.latest_year_for_month(conn, 7), 7),
+    "highest_spending_customer": lambda conn: order_analytics.top(conn, "order_rollup_customer", "total_sales"),
+    "most_popular_product": lambda conn: order_analytics.top(conn, "order_rollup_product", "order_count"),
+    "salesperson_ranking": lambda conn: order_analytics.top(conn, "order_rollup_sales", "total_sales", 10),
+}
+
+
+def synthetic_orders(count: int, customers: int, products: int, sales: int, years: int, seed: int = 42):
+    rng = random.Random(seed)
+    now = int(time.time())
+    span = years * 365 * 86400
+    for _ in range(count):
+        customer = rng.randrange(customers)
+        product = rng.randrange(products)
+        salesperson = rng.randrange(sales)
+        yield (customer, f"客户{customer}", f"P{product:05d}", f"产品{product}", round(rng.uniform(10, 5000), 2),
+               salesperson, f"销售{salesperson}", now - rng.randrange(span), None, rng.randrange(2))
+
+
+def insert_orders(conn: sqlite3.Connection, rows, batch: int = 50000) -> float:
+    started = time.perf_counter()
+    sql = "INSERT INTO orders (customer_id, customer_name, product_id, product_name, price, sales_id, sales_name, " \
+          "create_time, pay_time, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            conn.executemany(sql, chunk)
+            conn.commit()
+            chunk = []
+    if chunk:
+        conn.executemany(sql, chunk)
+        conn.commit()
+    return time.perf_counter() - started
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - started) / repeat * 1000, 3)
+
+
+def verify(conn: sqlite3.Connection) -> bool:
+    """汇总表与直接 GROUP BY 的结果一致（金额允许浮点误差）"""
+    for table, column in order_analytics.ROLLUPS.items():
+        expected = dict((name, (total, n)) for name, total, n in conn.execute(
+            f"SELECT {column}, SUM(price), COUNT(*) FROM orders GROUP BY {column}"))
+        actual = dict((name, (total, n)) for name, total, n in conn.execute(
+            f"SELECT {column}, total_sales, order_count FROM {table}"))
+        if expected.keys() != actual.keys():
+            return False
+        if any(abs(expected[k][0] - actual[k][0]) > 0.01 or expected[k][1] != actual[k][1] for k in expected):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--sales", type=int, default=200)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--incremental", type=int, default=100000, help="建立汇总后再写入的订单数")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="order_bench_"), "orders.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(ORDERS_DDL)
+    load_seconds = insert_orders(conn, synthetic_orders(args.orders, args.customers, args.products, args.sales, args.years))
+
+    legacy = {name: timed(lambda: conn.execute(sql, params).fetchall(), args.repeat)
+              for name, (sql, params) in LEGACY_QUERIES.items()}
+
+    started = time.perf_counter()
+    order_analytics.prepare(conn)
+    prepare_seconds = time.perf_counter() - started
+
+    analytics = {name: timed(lambda: fn(conn), max(args.repeat, 100)) for name, fn in ANALYTICS_QUERIES.items()}
+
+    # 增量维护：建立汇总后继续写入，比较有无触发器时的写入速度
+    extra = list(synthetic_orders(args.incremental, args.customers, args.products, args.sales, args.years, seed=7))
+    with_triggers = insert_orders(conn, extra)
+    consistent = verify(conn)
+    conn.execute("DROP TRIGGER trg_orders_rollup_insert")
+    without_triggers = insert_orders(conn, extra)
+
+    print(json.dumps({
+        "orders": args.orders,
+        "load_seconds": round(load_seconds, 2),
+        "legacy_ms": legacy,
+        "rollup_build_seconds": round(prepare_seconds, 2),
+        "analytics_ms": analytics,
+        "incremental_orders": args.incremental,
+        "insert_rows_per_second": {
+            "with_rollup_triggers": round(args.incremental / with_triggers),
+            "without_triggers": round(args.incremental / without_triggers),
+        },
+        "rollups_consistent": consistent,
+    }, ensure_ascii=False, indent=2))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
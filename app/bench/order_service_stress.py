@@ -0,0 +1,149 @@
+# order_service 并发压测：合成订单库上启动 order_service，通过 MCP 会话池同时发起大量工具调用，
+# 同时另一个线程不停写入新订单（模拟聊天服务和订单系统对同一个文件的写入）
+# - 检查：所有调用成功、写入端没有 "database is locked"，停止写入后工具结果与直接 GROUP BY 一致
+# - --replica：先用 sqlite3 backup 复制出分析副本，工具只读副本（ORDER_REPLICA_PATH），写入只落在主库
+# 用法（在 app 目录下）：python -m bench.order_service_stress --orders 200000 --calls 2000 --concurrency 100
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from bench.es_client_standin import summarize
+from bench.mcp_pool_bench import MCPServerProcess
+from bench.order_analytics_bench import ORDERS_DDL, insert_orders, synthetic_orders
+
+TOOLS = [
+    ("get_monthly_sales_total", lambda: {"month": random.randint(1, 12)}),
+    ("get_highest_spending_customer", lambda: {}),
+    ("get_most_popular_product", lambda: {}),
+    ("get_salesperson_ranking", lambda: {"limit": random.randint(1, 20)}),
+]
+
+
+class Writer(threading.Thread):
+    """不停地小批量写入订单，每批一个事务"""
+
+    def __init__(self, path: str, args):
+        super().__init__(daemon=True)
+        self.path = path
+        self.args = args
+        self.stop_event = threading.Event()
+        self.stats = {"batches": 0, "orders": 0, "errors": 0}
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        seed = 1000
+        while not self.stop_event.is_set():
+            seed += 1
+            rows = synthetic_orders(self.args.write_batch, self.args.customers, self.args.products,
+                                    self.args.sales, self.args.years, seed=seed)
+            try:
+                insert_orders(conn, rows)
+                self.stats["batches"] += 1
+                self.stats["orders"] += self.args.write_batch
+            except sqlite3.OperationalError:
+                self.stats["errors"] += 1
+                conn.rollback()
+            time.sleep(self.args.write_pause)
+        conn.close()
+
+
+async def call_all(url: str, args) -> dict:
+    from mcp_pool import MCPPool
+
+    pool = MCPPool(size=args.pool_size, max_concurrent=args.concurrency)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], []
+
+    async def one():
+        name, arguments = random.choice(TOOLS)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await pool.call_tool(url, name, arguments())
+                if not result or "失败" in result[0].text or "Error" in result[0].text:
+                    errors.append(result[0].text if result else "empty")
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {str(e)}")
+            latencies.append(time.perf_counter() - start)
+
+    # 先建好会话，计时不包含建连
+    await pool.call_tool(url, "get_highest_spending_customer")
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.calls)))
+    elapsed = time.perf_counter() - start
+    ranking = (await pool.call_tool(url, "get_salesperson_ranking", {"limit": 5}))[0].text
+    await pool.close()
+    return {"seconds": round(elapsed, 2), "calls_per_second": round(args.calls / elapsed),
+            "latency": summarize(latencies), "errors": len(errors), "error_samples": errors[:3], "ranking": ranking}
+
+
+def expected_ranking(path: str) -> str:
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT sales_name, SUM(price) AS t FROM orders GROUP BY sales_name ORDER BY t DESC LIMIT 5").fetchall()
+    conn.close()
+    return "销售员排行榜：\n" + "\n".join(f"{name}: {total:.2f}" for name, total in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--sales", type=int, default=50)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--write-batch", type=int, default=50)
+    parser.add_argument("--write-pause", type=float, default=0.01)
+    parser.add_argument("--replica", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="order_stress_")
+    primary = os.path.join(workdir, "orders.db")
+    conn = sqlite3.connect(primary)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(ORDERS_DDL)
+    insert_orders(conn, synthetic_orders(args.orders, args.customers, args.products, args.sales, args.years))
+    env = {"ORDER_DB_PATH": primary}
+    replica = None
+    if args.replica:
+        # 副本需要带上汇总表：先在主库上建立汇总，再复制
+        from mcp_server import order_analytics
+        order_analytics.prepare(conn)
+        replica = os.path.join(workdir, "orders_replica.db")
+        target = sqlite3.connect(replica)
+        conn.backup(target)
+        target.close()
+        env["ORDER_REPLICA_PATH"] = replica
+    conn.close()
+
+    server = MCPServerProcess("mcp_server.order_service", env).start()
+    writer = Writer(primary, args)
+    try:
+        writer.start()
+        report = asyncio.run(call_all(server.url, args))
+        writer.stop_event.set()
+        writer.join()
+        # 写入停止后再查一次，应与直接聚合的结果一致
+        final = asyncio.run(call_all(server.url, argparse.Namespace(**{**vars(args), "calls": 1})))
+        report["consistent_after_writes"] = final["ranking"] == expected_ranking(replica or primary)
+        report.pop("ranking")
+        print(json.dumps({"orders": args.orders, "calls": args.calls, "concurrency": args.concurrency,
+                          "replica": args.replica, **report, "writer": writer.stats}, ensure_ascii=False, indent=2))
+    finally:
+        writer.stop_event.set()
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# SSE 合并刷新的微基准：对比旧实现（每个token一帧 + 固定 sleep(0.01)）与 SSEWriter 的刷新策略
+# 统计每个回答的帧数、字节数和最后一个字节的输出时间（time-to-last-byte）
+# 用法（在 app 目录下）：python -m bench.sse_flush --tokens 500
+import argparse
+import asyncio
+import json
+import time
+
+from sse import SSEWriter
+
+
+async def token_source(tokens: int, gap: float, text: str = "字"):
+    for _ in range(tokens):
+        if gap:
+            await asyncio.sleep(gap)
+        yield text
+
+
+async def legacy_generate(deltas, session_id):
+    # 与改造前 generate() 中的循环保持一致
+    async for content in deltas:
+        yield f"data: {json.dumps({'content': content, 'session_id': session_id})}\n\n"
+        await asyncio.sleep(0.01)
+    yield f"data: {json.dumps({'content': '', 'session_id': session_id, 'done': True})}\n\n"
+
+
+async def writer_generate(deltas, session_id, flush_bytes, flush_interval):
+    writer = SSEWriter(session_id, flush_bytes, flush_interval)
+    async for frame in writer.stream(deltas):
+        yield frame
+    yield writer.done()
+
+
+async def measure(frames) -> dict:
+    start = time.perf_counter()
+    count = 0
+    size = 0
+    first = None
+    async for frame in frames:
+        if first is None:
+            first = time.perf_counter() - start
+        count += frame.count("data: ")
+        size += len(frame.encode("utf-8"))
+    return {
+        "ttfb_ms": round(first * 1000, 2),
+        "ttlb_ms": round((time.perf_counter() - start) * 1000, 2),
+        "frames": count,
+        "bytes": size,
+    }
+
+
+async def run(tokens: int, gaps, flush_bytes: int, flush_interval: float):
+    session_id = "00000000-0000-0000-0000-000000000000"
+    for gap in gaps:
+        legacy = await measure(legacy_generate(token_source(tokens, gap), session_id))
+        writer = await measure(writer_generate(token_source(tokens, gap), session_id, flush_bytes, flush_interval))
+        print(json.dumps({"tokens": tokens, "upstream_gap_ms": gap * 1000, "legacy": legacy, "writer": writer}, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--gaps-ms", default="0,2,20", help="上游相邻token的间隔，逗号分隔")
+    parser.add_argument("--flush-bytes", type=int, default=48)
+    parser.add_argument("--flush-ms", type=float, default=40)
+    args = parser.parse_args()
+    gaps = [float(g) / 1000 for g in args.gaps_ms.split(",")]
+    asyncio.run(run(args.tokens, gaps, args.flush_bytes, args.flush_ms / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# /api/stream 并发压测：N 个流同时请求，验证每个流独立推进、互不阻塞，且健康检查在负载下仍然及时响应
+# 用法（在 app 目录下）：python -m bench.stream_load --streams 20 --tokens 50 --token-delay 0.02
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from bench.harness import AppProcess
+from bench.mock_llm import BackgroundServer, create_mock_llm_app
+
+
+async def run_stream(client: httpx.AsyncClient, url: str, index: int, t0: float) -> dict:
+    result = {"index": index, "first": None, "last": None, "frames": 0, "chars": 0}
+    async with client.stream("GET", f"{url}/api/stream", params={"query": f"压测问题{index}"}) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = json.loads(line[6:])
+            now = time.perf_counter() - t0
+            if data.get("content"):
+                result["frames"] += 1
+                result["chars"] += len(data["content"])
+                if result["first"] is None:
+                    result["first"] = now
+            if data.get("done"):
+                result["last"] = now
+                break
+    return result
+
+
+async def poll_health(client: httpx.AsyncClient, url: str, stop: asyncio.Event) -> list:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"{url}/api/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+    return latencies
+
+
+async def load_test(url: str, streams: int) -> dict:
+    limits = httpx.Limits(max_connections=streams + 5)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        t0 = time.perf_counter()
+        single = await run_stream(client, url, -1, t0)
+        single_time = single["last"]
+
+        stop = asyncio.Event()
+        health_task = asyncio.create_task(poll_health(client, url, stop))
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(run_stream(client, url, i, t0) for i in range(streams)))
+        wall = time.perf_counter() - t0
+        stop.set()
+        health = await health_task
+
+    first_finish = min(r["last"] for r in results)
+    # 在第一个流结束之前就已经开始输出的流数量：串行执行时只有1个，独立推进时应接近N
+    overlapping = sum(1 for r in results if r["first"] is not None and r["first"] < first_finish)
+    return {
+        "single_stream_s": round(single_time, 3),
+        "streams": streams,
+        "wall_s": round(wall, 3),
+        "serial_estimate_s": round(single_time * streams, 3),
+        "ttft_max_s": round(max(r["first"] for r in results), 3),
+        "streams_started_before_first_finished": overlapping,
+        "health_checks": len(health),
+        "health_p_max_ms": round(max(health) * 1000, 1) if health else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    llm = BackgroundServer(create_mock_llm_app(args.tokens, args.token_delay)).start()
+    app = AppProcess({"API_KEY": "bench", "BASE_URL": f"{llm.url}/v1", "MODEL_NAME": "mock"}).start()
+    try:
+        report = asyncio.run(load_test(app.url, args.streams))
+        report["upstream_max_active_streams"] = llm.server.config.app.state.stats["max_active_streams"]
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        app.stop()
+        llm.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# 工具预筛选基准：生成 N 个合成工具（加上 order_service 的真实工具描述），
+# 对比把全部工具放进决策调用的 tools 参数与只放前 k 个工具时的大小，以及索引更新、检索的耗时
+# 用法（在 app 目录下）：python -m bench.tool_selection --tools 10 100 500 --top-k 8
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from tool_catalog import _to_tool
+from tool_index import ToolIndex
+
+ORDER_TOOLS = [
+    ("get_monthly_sales_total", "获取指定月份的销售总额", {"month": {"type": "integer"}}),
+    ("get_highest_spending_customer", "获取消费最高的用户", {}),
+    ("get_most_popular_product", "获取最受欢迎的产品（基于订单数量）", {}),
+    ("get_salesperson_ranking", "获取销售员排行榜（基于总销售额）", {"limit": {"type": "integer"}}),
+]
+SUBJECTS = ["库存", "物流", "发票", "会员", "优惠券", "工单", "合同", "审批", "考勤", "报销", "航班", "酒店", "汇率", "股票", "新闻"]
+ACTIONS = ["查询", "统计", "创建", "取消", "导出", "同步", "更新"]
+# (问题, 排在第一位的工具名或描述里应包含的内容)
+QUERIES = [("7月的销售总额是多少", "get_monthly_sales_total"), ("哪个产品最受欢迎", "get_most_popular_product"),
+           ("销售员排行榜前三名", "get_salesperson_ranking"), ("帮我查询一下库存", "库存"), ("统计本月的报销", "报销")]
+
+
+def make_rows(count: int, server_id: str, rng: random.Random) -> list:
+    rows = []
+    for name, description, props in ORDER_TOOLS:
+        rows.append((name, description, props))
+    while len(rows) < count:
+        subject, action = rng.choice(SUBJECTS), rng.choice(ACTIONS)
+        rows.append((f"{action}_{len(rows)}", f"{action}{subject}信息，返回{subject}的详细记录",
+                     {"keyword": {"type": "string", "description": f"{subject}关键字"}}))
+    return [
+        {"id": str(uuid.uuid4()), "server_id": f"{server_id}-{i % 10}", "name": name, "description": description,
+         "url": f"http://mcp-{i % 10}/sse", "input_schema": json.dumps({"type": "object", "properties": props}, ensure_ascii=False),
+         "cache_ttl": None}
+        for i, (name, description, props) in enumerate(rows[:count])
+    ]
+
+
+async def run(count: int, top_k: int) -> dict:
+    rows = make_rows(count, "server", random.Random(count))
+    tools = [_to_tool(row) for row in rows]
+    by_server = {}
+    for tool in tools:
+        by_server.setdefault(tool.server_id, []).append(tool)
+
+    index = ToolIndex()
+    start = time.perf_counter()
+    for server_id, server_tools in by_server.items():
+        index.replace(server_id, server_tools)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # 只刷新一个服务器
+    start = time.perf_counter()
+    index.replace("server-0", by_server["server-0"])
+    refresh_ms = (time.perf_counter() - start) * 1000
+
+    full_prompt = len(json.dumps([tool.function for tool in tools], ensure_ascii=False))
+    sizes, latencies, hits = [], [], 0
+    for query, expected in QUERIES:
+        start = time.perf_counter()
+        selected = await index.select(query, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(json.dumps([tool.function for tool in selected], ensure_ascii=False)))
+        hits += bool(selected) and (expected == selected[0].name or expected in selected[0].description)
+    return {
+        "tools": count,
+        "all_tools_prompt_chars": full_prompt,
+        "top_k_prompt_chars_avg": round(sum(sizes) / len(sizes)),
+        "index_build_ms": round(build_ms, 2),
+        "refresh_one_server_ms": round(refresh_ms, 2),
+        "select_ms_avg": round(sum(latencies) / len(latencies), 3),
+        "queries_with_expected_top1": f"{hits}/{len(QUERIES)}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tools", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--top-k", type=int, default=8)
+    args = parser.parse_args()
+    results = [asyncio.run(run(count, args.top_k)) for count in args.tools]
+    print(json.dumps({"top_k": args.top_k, "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
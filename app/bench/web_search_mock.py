@@ -0,0 +1,145 @@
+# 网络搜索客户端测试：用本地的博查替身服务（只实现 /v1/web-search）验证
+# - 结果解析：返回结构化的 title/url/summary 列表，而不是整个响应的 str()
+# - 重试：替身按比例返回 503，客户端有限次重试后成功
+# - 超时：替身挂起时按读取超时失败，而不是一直等待
+# - 并发限制：同时打到替身的请求数不超过 WEB_SEARCH_CONCURRENCY
+# 并对比改造前同步 requests.post 在事件循环里串行执行的耗时
+# 用法（在 app 目录下）：python -m bench.web_search_mock --queries 40 --delay-ms 50 --fail-rate 0.3
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import requests
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from bench.mock_llm import BackgroundServer
+
+
+def create_bocha_app(delay: float, fail_rate: float, seed: int = 0):
+    state = {"requests": 0, "failures": 0, "active": 0, "max_active": 0, "hang": False}
+    rng = random.Random(seed)
+
+    async def web_search(request: Request):
+        body = await request.json()
+        state["requests"] += 1
+        state["active"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+        try:
+            if state["hang"]:
+                await asyncio.sleep(3600)
+            await asyncio.sleep(delay)
+            if rng.random() < fail_rate:
+                state["failures"] += 1
+                return JSONResponse({"code": 503, "msg": "busy"}, status_code=503)
+            pages = [{"name": f"{body['query']} 结果{i}", "url": f"https://example.com/{i}", "siteName": "example",
+                      "datePublished": "2025-01-01T00:00:00+08:00", "snippet": "片段", "summary": f"摘要{i}"}
+                     for i in range(body.get("count", 10))]
+            return JSONResponse({"code": 200, "data": {"webPages": {"value": pages}}})
+        finally:
+            state["active"] -= 1
+
+    app = Starlette(routes=[Route("/v1/web-search", web_search, methods=["POST"])])
+    app.state.bocha = state
+    return app
+
+
+async def legacy_queries(url: str, queries: int) -> float:
+    # 改造前 perform_web_search 的做法：在协程里直接调用同步 requests.post，整个事件循环被阻塞，只能串行
+    async def one(i):
+        response = requests.post(url, json={"query": f"问题{i}", "count": 10})
+        return str(response.json()) if response.status_code == 200 else None
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(queries)))
+    return time.perf_counter() - start
+
+
+async def client_queries(queries: int) -> dict:
+    import web_search
+    start = time.perf_counter()
+    results = await asyncio.gather(*(web_search.search(f"问题{i}") for i in range(queries)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [r for r in results if isinstance(r, Exception)]
+    sample = next((r for r in results if not isinstance(r, Exception)), [])
+    return {"seconds": round(elapsed, 3), "ok": len(results) - len(errors), "errors": len(errors),
+            "parsed_sample": sample[:1], "context_preview": web_search.format_results(sample[:1])}
+
+
+async def timeout_demo(state: dict) -> dict:
+    import web_search
+    state["hang"] = True
+    start = time.perf_counter()
+    try:
+        await web_search.search("挂起")
+        outcome = "ok"
+    except web_search.WebSearchError as e:
+        outcome = str(e)
+    state["hang"] = False
+    return {"outcome": outcome, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--delay-ms", type=float, default=50)
+    parser.add_argument("--fail-rate", type=float, default=0.3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--read-timeout", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server = BackgroundServer(create_bocha_app(args.delay_ms / 1000, 0)).start()
+    state = server.server.config.app.state.bocha
+    try:
+        url = f"{server.url}/v1/web-search"
+        legacy_seconds = asyncio.run(legacy_queries(url, args.queries))
+
+        import web_search
+        web_search.BOCHAAI_SEARCH_URL = url
+        web_search.WEB_SEARCH_CONCURRENCY = args.concurrency
+        web_search.WEB_SEARCH_READ_TIMEOUT = args.read_timeout
+        web_search.WEB_SEARCH_BACKOFF = 0.05
+        state.update(requests=0, max_active=0)
+
+        async def run_client():
+            report = {"healthy": await client_queries(args.queries)}
+            report["healthy"]["max_concurrent_upstream"] = state["max_active"]
+            await web_search.close()
+            return report
+
+        report = asyncio.run(run_client())
+    finally:
+        server.stop()
+
+    # 换一个会随机返回 503 的替身，验证重试和超时
+    server = BackgroundServer(create_bocha_app(args.delay_ms / 1000, args.fail_rate)).start()
+    state = server.server.config.app.state.bocha
+    try:
+        web_search.BOCHAAI_SEARCH_URL = f"{server.url}/v1/web-search"
+        web_search._semaphore = None
+
+        async def run_flaky():
+            flaky = await client_queries(args.queries)
+            flaky.update({"upstream_requests": state["requests"], "upstream_503": state["failures"],
+                          "max_concurrent_upstream": state["max_active"]})
+            flaky.pop("parsed_sample")
+            flaky.pop("context_preview")
+            result = {"flaky": flaky, "hanging_upstream": await timeout_demo(state)}
+            await web_search.close()
+            return result
+
+        report.update(asyncio.run(run_flaky()))
+    finally:
+        server.stop()
+
+    print(json.dumps({"queries": args.queries, "concurrency_limit": args.concurrency,
+                      "legacy_blocking_requests_seconds": round(legacy_seconds, 3), **report},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# 多进程部署的扩展性基准：分别用 1、2、4… 个 uvicorn 工作进程启动应用，保持固定数量的并发 /api/stream 会话（闭环压测），
+# 统计每秒完成的会话数，看是否随工作进程数接近线性增长
+# - 模拟大模型用多个工作进程单独运行，token 之间不等待，让应用本身的 CPU（SSE 组帧、请求处理、落库）成为瓶颈；
+#   压测客户端也分散到多个进程，避免压测端先到瓶颈。工作进程数超过 CPU 核数时不会再有提升
+# - 每个会话都会新建会话并写入两条消息：结束后核对数据库里的会话数和消息数，确认多进程写入没有丢失、没有 "database is locked"
+# 用法（在 app 目录下）：python -m bench.worker_scaling --workers 1,2,4 --concurrency 64 --duration 20
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.es_client_standin import summarize
+from bench.harness import APP_DIR, AppProcess
+from bench.mock_llm import free_port
+
+
+class MockLLMProcess:
+    def __init__(self, workers: int, tokens: int, token_delay: float):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self.env = {"MOCK_LLM_TOKENS": str(tokens), "MOCK_LLM_TOKEN_DELAY": str(token_delay)}
+        self.proc = None
+
+    def start(self, timeout: float = 20):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "bench.mock_llm:create_mock_llm_app_from_env", "--factory",
+             "--host", "127.0.0.1", "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=APP_DIR, env={**os.environ, **self.env}, stdout=subprocess.DEVNULL,
+        )
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("模拟大模型启动超时")
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait(timeout=10)
+
+
+async def run_stream(client: httpx.AsyncClient, url: str, index: int) -> bool:
+    async with client.stream("GET", f"{url}/api/stream", params={"query": f"扩展性压测问题{index}"}) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = json.loads(line[6:])
+            if data.get("error"):
+                return False
+            if data.get("done"):
+                return True
+    return False
+
+
+async def closed_loop(url: str, concurrency: int, duration: float) -> dict:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        async def session_loop(slot: int):
+            nonlocal errors
+            index = 0
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    ok = await run_stream(client, url, slot * 100000 + index)
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+                index += 1
+
+        await asyncio.gather(*(session_loop(slot) for slot in range(concurrency)))
+    return {"latencies": latencies, "errors": errors}
+
+
+def client_process(url: str, concurrency: int, duration: float, results):
+    results.put(asyncio.run(closed_loop(url, concurrency, duration)))
+
+
+def measure(url: str, args) -> dict:
+    # 预热：建立连接、加载工具目录等
+    asyncio.run(closed_loop(url, min(args.concurrency, 8), 1))
+    results = multiprocessing.Queue()
+    per_client = max(1, args.concurrency // args.clients)
+    clients = [multiprocessing.Process(target=client_process, args=(url, per_client, args.duration, results))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for process in clients:
+        process.start()
+    collected = [results.get() for _ in clients]
+    elapsed = time.perf_counter() - start
+    for process in clients:
+        process.join()
+    latencies = [value for result in collected for value in result["latencies"]]
+    return {
+        "sessions": len(latencies),
+        "sessions_per_second": round(len(latencies) / elapsed, 1),
+        "latency": summarize(latencies) if latencies else None,
+        "errors": sum(result["errors"] for result in collected),
+    }
+
+
+def count_rows(workdir: str) -> dict:
+    # 等后写日志刷新到数据库
+    time.sleep(1)
+    conn = sqlite3.connect(os.path.join(workdir, "chat_history.db"))
+    counts = {
+        "sessions": conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0],
+        "messages": conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+    }
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4", help="逗号分隔的工作进程数")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--clients", type=int, default=max(2, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--llm-workers", type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    args = parser.parse_args()
+
+    llm = MockLLMProcess(args.llm_workers, args.tokens, args.token_delay).start()
+    report = {"cpu_count": os.cpu_count(), "concurrency": args.concurrency, "tokens": args.tokens, "runs": []}
+    try:
+        for workers in [int(value) for value in args.workers.split(",")]:
+            app = AppProcess({"API_KEY": "bench", "BASE_URL": f"{llm.url}/v1", "MODEL_NAME": "mock"},
+                             ["--workers", str(workers)]).start()
+            try:
+                run = {"workers": workers, **measure(app.url, args)}
+                counts = count_rows(app.workdir)
+                # 预热的会话也会落库，所以只检查消息数是会话数的两倍、且不少于压测完成的会话数
+                run["db"] = {**counts, "consistent": counts["messages"] == 2 * counts["sessions"]
+                             and counts["sessions"] >= run["sessions"]}
+                report["runs"].append(run)
+            finally:
+                app.stop()
+    finally:
+        llm.stop()
+
+    baseline = report["runs"][0]["sessions_per_second"] if report["runs"] else 0
+    for run in report["runs"]:
+        run["speedup"] = round(run["sessions_per_second"] / baseline, 2) if baseline else None
+        run["efficiency"] = round(run["speedup"] / run["workers"], 2) if baseline else None
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
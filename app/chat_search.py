@@ -0,0 +1,136 @@
+# 聊天记录全文检索：SQLite FTS5 虚拟表 messages_fts，rowid 与 messages.id 相同
+# - unicode61 分词器会把连续的中文当成一个词，所以写入时在汉字和相邻的字之间插入零宽空格，让每个汉字单独成词；
+#   查询时中文按短语匹配（相邻的字），"销售" 能匹配 "销售额"。零宽空格不影响显示，返回前也会去掉
+# - 同步走写入路径：message_log 写消息的同一个事务里写索引，删除会话时一起删除（不用触发器，
+#   触发器依赖自定义分词函数，其他连接写 messages 时会失败）
+# - 迁移前已有的消息由后台任务分批补建索引，每批是一个短事务，批次之间让出写线程，不长时间占用数据库；
+#   进度保存在 search_backfill 表里，重启后从断点继续
+import asyncio
+import os
+import re
+
+import db
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_BACKFILL_BATCH = int(os.getenv("SEARCH_BACKFILL_BATCH", "500"))
+SEARCH_BACKFILL_PAUSE = float(os.getenv("SEARCH_BACKFILL_PAUSE_MS", "50")) / 1000
+# 每条结果的摘录长度（词数）
+SEARCH_SNIPPET_TOKENS = int(os.getenv("SEARCH_SNIPPET_TOKENS", "24"))
+
+ZWSP = "\u200b"
+# 汉字与相邻的汉字、字母、数字之间都要断开
+_CJK_BOUNDARY = re.compile(r"(?<=[一-鿿])(?=\w)|(?<=\w)(?=[一-鿿])")
+_TERM = re.compile(r"[一-鿿]+|[^\W一-鿿]+")
+
+
+def segment(text: str) -> str:
+    return _CJK_BOUNDARY.sub(ZWSP, text or "")
+
+
+def build_match(query: str):
+    """把用户输入转换成 FTS5 查询：每个词都要出现（AND），中文词按短语匹配，英文和数字按前缀匹配。没有可查的词时返回 None"""
+    terms = []
+    for term in _TERM.findall(query or ""):
+        if "一" <= term[0] <= "鿿":
+            terms.append('"' + " ".join(term) + '"')
+        else:
+            terms.append('"' + term + '"*')
+    return " ".join(terms) or None
+
+
+def index_messages(conn, rows):
+    """rows: [(id, session_id, role, content)]，在调用方的写事务里执行"""
+    conn.executemany(
+        "INSERT OR REPLACE INTO messages_fts (rowid, content, session_id, role) VALUES (?, ?, ?, ?)",
+        [(message_id, segment(content), session_id, role) for message_id, session_id, role, content in rows]
+    )
+
+
+def remove_session(conn, session_id: str):
+    """在删除 messages 之前调用"""
+    conn.execute("DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE session_id = ?)", (session_id,))
+
+
+def _clean_snippet(snippet: str) -> str:
+    # 去掉零宽空格，合并逐字高亮的相邻标记
+    return snippet.replace(ZWSP, "").replace("</mark><mark>", "")
+
+
+async def search(query: str, limit: int = None, offset: int = 0) -> tuple:
+    """按相关度（bm25）排序返回 (结果, 是否还有下一页)"""
+    match = build_match(query)
+    if match is None:
+        return [], False
+    limit = limit or SEARCH_PAGE_SIZE
+    rows = await db.fetchall(
+        f"""
+        SELECT f.rowid AS message_id, f.session_id, f.role,
+               snippet(messages_fts, 0, '<mark>', '</mark>', '…', {SEARCH_SNIPPET_TOKENS}) AS snippet,
+               bm25(messages_fts) AS score, m.created_at, s.summary
+        FROM messages_fts f
+        JOIN messages m ON m.id = f.rowid
+        LEFT JOIN chat_sessions s ON s.id = f.session_id
+        WHERE messages_fts MATCH ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+        """,
+        (match, limit + 1, offset)
+    )
+    has_more = len(rows) > limit
+    results = []
+    for row in rows[:limit]:
+        row["snippet"] = _clean_snippet(row["snippet"])
+        # bm25 越小越相关，对外给出越大越相关的分数
+        row["score"] = round(-row["score"], 4)
+        results.append(row)
+    return results, has_more
+
+
+class SearchBackfill:
+    def __init__(self, batch: int = None, pause: float = None):
+        self.batch = batch or SEARCH_BACKFILL_BATCH
+        self.pause = SEARCH_BACKFILL_PAUSE if pause is None else pause
+        self._task = None
+        self.stats = {"indexed": 0, "batches": 0, "done": False}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while not await db.transaction(self._step):
+                self.stats["batches"] += 1
+                await asyncio.sleep(self.pause)
+            self.stats["done"] = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"补建聊天记录索引失败，下次启动时继续: {str(e)}")
+
+    def _step(self, conn) -> bool:
+        """补建一批，返回是否已全部完成"""
+        state = conn.execute("SELECT last_id, target_id FROM search_backfill").fetchone()
+        if state is None or state["last_id"] >= state["target_id"]:
+            return True
+        rows = conn.execute(
+            "SELECT id, session_id, role, content FROM messages WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (state["last_id"], state["target_id"], self.batch)
+        ).fetchall()
+        last_id = rows[-1]["id"] if rows else state["target_id"]
+        index_messages(conn, [tuple(row) for row in rows])
+        conn.execute("UPDATE search_backfill SET last_id = ?", (last_id,))
+        self.stats["indexed"] += len(rows)
+        return last_id >= state["target_id"]
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def metrics(self) -> dict:
+        return dict(self.stats)
+
+
+search_backfill = SearchBackfill()
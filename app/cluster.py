@@ -0,0 +1,124 @@
+# 多进程部署（uvicorn --workers N）时的进程间协调，单进程部署时同样适用
+# - 缓存失效通知：修改 MCP 服务器/工具后，本进程立即失效，同时把通知写进 cache_invalidations 表；
+#   其他进程每 CLUSTER_POLL_INTERVAL 秒按 id 增量读取并执行同样的失效（一次主键范围查询，开销可以忽略）
+# - 主进程选举：数据库旁边的文件锁，拿到锁的进程负责只需要执行一次的后台任务（补建全文索引、启动时检查会话摘要、
+#   清理过期的通知）；主进程退出时锁由内核释放，其他进程下一轮轮询时接手
+# - 写事务的跨进程互斥在 db.py（文件写锁），各进程内存里的检索/工具结果/回答缓存按 TTL 过期，不需要通知
+import asyncio
+import inspect
+import os
+import time
+import uuid
+
+import db
+
+CLUSTER_POLL_INTERVAL = float(os.getenv("CLUSTER_POLL_INTERVAL", "1"))
+# 失效通知保留时间（秒），超过后由主进程删除
+CLUSTER_INVALIDATION_RETENTION = float(os.getenv("CLUSTER_INVALIDATION_RETENTION", "3600"))
+
+
+class Cluster:
+    def __init__(self, poll_interval: float = None):
+        self.poll_interval = CLUSTER_POLL_INTERVAL if poll_interval is None else poll_interval
+        # 区分通知来自哪个进程，自己发布的通知已经在本地执行过
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # scope -> handler(key)，handler 可以是普通函数或协程函数
+        self._handlers = {}
+        self._leader_callbacks = []
+        self._leader_lock = None
+        self.is_leader = False
+        self._last_id = 0
+        self._last_prune = 0.0
+        self._task = None
+        self.stats = {"published": 0, "received": 0, "polls": 0, "poll_errors": 0, "pruned": 0}
+
+    def subscribe(self, scope: str, handler):
+        self._handlers[scope] = handler
+
+    def on_leader(self, callback):
+        """成为主进程时执行一次"""
+        self._leader_callbacks.append(callback)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        row = await db.fetchone("SELECT COALESCE(MAX(id), 0) AS last_id FROM cache_invalidations")
+        self._last_id = row["last_id"]
+        self._leader_lock = db.FileLock(db.DB_PATH + ".leader")
+        await self._try_lead()
+        self._task = asyncio.create_task(self._run())
+
+    async def publish(self, scope: str, key: str = None):
+        """本地立即失效，并通知其他进程"""
+        await self._apply(scope, key)
+        await db.execute(
+            "INSERT INTO cache_invalidations (scope, key, origin, created_at) VALUES (?, ?, ?, ?)",
+            (scope, key, self.origin, time.time())
+        )
+        self.stats["published"] += 1
+
+    async def _apply(self, scope: str, key):
+        handler = self._handlers.get(scope)
+        if handler is None:
+            return
+        result = handler(key)
+        if inspect.isawaitable(result):
+            await result
+
+    async def _try_lead(self):
+        if self.is_leader or not self._leader_lock.acquire(blocking=False):
+            return
+        self.is_leader = True
+        print(f"进程 {os.getpid()} 负责执行后台任务")
+        for callback in self._leader_callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"启动后台任务失败: {type(e).__name__} {str(e)}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+                await self._try_lead()
+                if self.is_leader and time.monotonic() - self._last_prune > CLUSTER_INVALIDATION_RETENTION / 10:
+                    self._last_prune = time.monotonic()
+                    self.stats["pruned"] += await db.execute(
+                        "DELETE FROM cache_invalidations WHERE created_at < ?",
+                        (time.time() - CLUSTER_INVALIDATION_RETENTION,)
+                    )
+            except Exception as e:
+                self.stats["poll_errors"] += 1
+                print(f"读取缓存失效通知失败: {str(e)}")
+
+    async def poll(self):
+        """执行其他进程发布的失效通知"""
+        self.stats["polls"] += 1
+        rows = await db.fetchall(
+            "SELECT id, scope, key, origin FROM cache_invalidations WHERE id > ? ORDER BY id", (self._last_id,)
+        )
+        for row in rows:
+            self._last_id = row["id"]
+            if row["origin"] == self.origin:
+                continue
+            self.stats["received"] += 1
+            await self._apply(row["scope"], row["key"])
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._leader_lock is not None:
+            self._leader_lock.close()
+            self._leader_lock = None
+        self.is_leader = False
+
+    def metrics(self) -> dict:
+        return {**self.stats, "origin": self.origin, "leader": self.is_leader, "last_id": self._last_id}
+
+
+cluster = Cluster()
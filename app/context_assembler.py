@@ -0,0 +1,167 @@
+# 对话上下文组装：把会话历史、检索到的上下文和工具结果放进一个可配置的 token 预算里
+# - 通过 (session_id, id) 索引只读取最近的若干条消息，不加载整段会话
+# - 用本地分词器计算 token：安装了 tiktoken 时使用 CONTEXT_TOKENIZER 指定的编码，否则用近似估算（中文按字、英文按词长）
+# - 优先级：系统提示词和当前问题 > 检索上下文（最多占预算的 CONTEXT_RETRIEVAL_SHARE）> 最近的对话 > 更早的对话
+# - 早期对话的摘要由后台任务（summary_worker）生成并缓存在 conversation_summaries 表里，记录覆盖到的最后一条消息 id；
+#   这里只读取摘要和它之后的消息，不在请求路径上调用大模型。历史仍然放不下时丢弃最早的对话，并通知后台任务推进摘要
+import os
+import re
+from dataclasses import dataclass, field
+
+import db
+from message_log import message_log
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_RETRIEVAL_SHARE = float(os.getenv("CONTEXT_RETRIEVAL_SHARE", "0.5"))
+CONTEXT_HISTORY_MAX_MESSAGES = int(os.getenv("CONTEXT_HISTORY_MAX_MESSAGES", "40"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+
+# 每条消息在对话格式里的额外开销，以及提示词模板里固定说明文字的预留
+MESSAGE_OVERHEAD = 4
+PROMPT_OVERHEAD = 64
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(CONTEXT_TOKENIZER)
+except Exception:
+    # 没有安装 tiktoken（或编码文件不可用）时使用近似估算
+    _encoding = None
+
+_PIECE = re.compile(r"[一-鿿]|[A-Za-z]+|\d+|\S")
+
+
+def _piece_tokens(piece: str) -> int:
+    if len(piece) == 1:
+        return 1
+    if piece.isdigit():
+        return (len(piece) + 2) // 3
+    return (len(piece) + 3) // 4
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return sum(_piece_tokens(m.group()) for m in _PIECE.finditer(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, marker: str = "…（已截断）") -> str:
+    """截断到不超过 max_tokens，保留开头部分"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens - count_tokens(marker))
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:limit]) + marker
+    used = 0
+    end = 0
+    for m in _PIECE.finditer(text):
+        used += _piece_tokens(m.group())
+        if used > limit:
+            break
+        end = m.end()
+    return text[:end] + marker
+
+
+SUMMARY_PREFIX = "以下是之前对话的摘要：\n"
+
+
+def summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"{SUMMARY_PREFIX}{summary}"}
+
+
+@dataclass
+class AssembledContext:
+    # 放在系统提示词之后、当前问题之前的消息：可能有一条摘要，然后是按时间顺序的最近对话
+    history: list = field(default_factory=list)
+    # 截断后的检索上下文
+    context: str = ""
+    tokens: int = 0
+    # 预算里剩下的 token，可用于工具结果
+    remaining: int = 0
+
+
+class ContextAssembler:
+    def __init__(self, budget: int = None, request_summary=None):
+        self.budget = budget or CONTEXT_TOKEN_BUDGET
+        # def request_summary(session_id)：历史放不下时调用，只通知后台任务，不等待
+        self.request_summary = request_summary
+        self.stats = {"assembled": 0, "history_messages": 0, "dropped_messages": 0, "truncated_messages": 0,
+                      "context_truncated": 0, "summary_hits": 0, "summary_requests": 0,
+                      "summary_truncated": 0}
+
+    async def assemble(self, session_id: str, query: str, context: str = "", system_prompt: str = "",
+                       reserved: int = 0) -> AssembledContext:
+        """
+        session_id 为空（新会话）时不读取历史。reserved 是调用方另外占用的 token，比如 Agent 的工具说明。
+        """
+        self.stats["assembled"] += 1
+        fixed = count_tokens(system_prompt) + count_tokens(query) + 2 * MESSAGE_OVERHEAD + PROMPT_OVERHEAD + reserved
+        context_limit = min(int(self.budget * CONTEXT_RETRIEVAL_SHARE), self.budget - fixed)
+        if count_tokens(context) > context_limit:
+            self.stats["context_truncated"] += 1
+            context = truncate_tokens(context, context_limit)
+        available = self.budget - fixed - count_tokens(context)
+        history, used = await self._history(session_id, available) if session_id and available > 0 else ([], 0)
+        remaining = max(0, available - used)
+        return AssembledContext(history, context, self.budget - remaining, remaining)
+
+    async def _history(self, session_id: str, available: int) -> tuple:
+        # 还在后写队列里的轮次先落库，保证读到上一轮对话
+        await message_log.wait_persisted(session_id)
+        cached = await db.fetchone(
+            "SELECT upto_message_id, summary, tokens FROM conversation_summaries WHERE session_id = ?", (session_id,)
+        )
+        upto = cached["upto_message_id"] if cached else 0
+        rows = await db.fetchall(
+            "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (session_id, upto, CONTEXT_HISTORY_MAX_MESSAGES)
+        )
+        # 摘要消息的开销：消息格式 + 摘要前面的说明文字
+        summary_overhead = MESSAGE_OVERHEAD + count_tokens(SUMMARY_PREFIX)
+        summary = cached["summary"] if cached else None
+        summary_tokens = cached["tokens"] + summary_overhead if cached else 0
+        if cached:
+            self.stats["summary_hits"] += 1
+        if summary_tokens > available:
+            # 摘要本身就超出剩余预算：截断到刚好放下，连说明文字都放不下时不带摘要
+            self.stats["summary_truncated"] += 1
+            summary = truncate_tokens(summary, available - summary_overhead) or None
+            summary_tokens = count_tokens(summary) + summary_overhead if summary else 0
+        kept = self._fit(rows, available - summary_tokens)
+        # 读满了上限说明更早还有消息，同样算放不下
+        overflow = len(kept) < len(rows) or len(rows) == CONTEXT_HISTORY_MAX_MESSAGES
+        if overflow and self.request_summary is not None:
+            self.stats["summary_requests"] += 1
+            self.request_summary(session_id)
+        self.stats["dropped_messages"] += len(rows) - len(kept)
+        self.stats["history_messages"] += len(kept)
+        history = [summary_message(summary)] if summary else []
+        history.extend({"role": row["role"], "content": row["content"]} for row in reversed(kept))
+        return history, summary_tokens + sum(row["tokens"] for row in kept)
+
+    def _fit(self, rows: list, room: int) -> list:
+        """从最新的消息往前放，放不下为止；最新一条单独就超出时截断它。返回的消息按从新到旧排列"""
+        kept = []
+        for row in rows:
+            tokens = count_tokens(row["content"]) + MESSAGE_OVERHEAD
+            if tokens > room:
+                if not kept and room > MESSAGE_OVERHEAD:
+                    self.stats["truncated_messages"] += 1
+                    content = truncate_tokens(row["content"], room - MESSAGE_OVERHEAD)
+                    kept.append({**row, "content": content, "tokens": count_tokens(content) + MESSAGE_OVERHEAD})
+                break
+            kept.append({**row, "tokens": tokens})
+            room -= tokens
+        # 保持对话以用户消息开头
+        if kept and kept[-1]["role"] == "assistant":
+            kept.pop()
+        return kept
+
+    def metrics(self) -> dict:
+        return {**self.stats, "budget": self.budget, "tokenizer": CONTEXT_TOKENIZER if _encoding else "approximate"}
+
+
+context_assembler = ContextAssembler()
@@ -0,0 +1,328 @@
+# SQLite 持久化层：所有 chat_history.db 的读写都经过这里
+# - 读：有上限的连接池 + 专用读线程池，WAL 模式下读不会被写阻塞
+# - 写：单独的一个写线程和一条写连接，进程内所有写操作串行执行，不再出现 "database is locked"
+# - 所有阻塞的 SQLite 调用都在线程池里执行，不占用事件循环
+# - 多进程部署（uvicorn --workers）时，各进程的写线程再用数据库旁边的文件锁排队，同一时刻整个部署只有一个写事务，
+#   不依赖 SQLite 忙等重试（busy_timeout 是轮询等待，竞争时延迟抖动大，超时后报 "database is locked"）
+import asyncio
+import base64
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，只支持单进程部署
+    fcntl = None
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+DB_PATH = os.getenv("CHAT_DB_PATH", "chat_history.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+# 负数表示以KB为单位，-16000 约为 16MB 页缓存
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# WAL 模式下 NORMAL 只在检查点时 fsync，崩溃时不会损坏数据库，最多丢失最后几个事务；FULL 每次提交都 fsync
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+# 跨进程写锁；只有一个进程访问数据库时也可以关闭
+DB_WRITE_LOCK = os.getenv("DB_WRITE_LOCK", "true").lower() in ("1", "true", "yes")
+
+
+def connect(path: str = None, read_only: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    if read_only:
+        # 连接池里的连接只用于查询，误写会直接报错
+        conn.execute("PRAGMA query_only=ON")
+    else:
+        # WAL 是数据库文件级别的持久设置，写连接设置一次即可
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+# 数据库结构迁移：按顺序执行，已执行到的版本记录在 PRAGMA user_version 中
+# 新的迁移只能追加到末尾，不能修改已经发布的迁移
+MIGRATIONS = [
+    # 1: 会话消息按 (session_id, id) 读取；侧边栏按 updated_at 倒序分页（包含 summary，成为覆盖索引）
+    [
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON chat_sessions (updated_at, id, summary)",
+        "CREATE INDEX IF NOT EXISTS idx_mcp_tools_server_id ON mcp_tools (server_id)",
+    ],
+    # 2: 工具结果缓存有效期（秒）：NULL 使用默认值，0 表示不缓存（有副作用的工具）
+    [
+        "ALTER TABLE mcp_tools ADD COLUMN cache_ttl REAL",
+    ],
+    # 3: 会话早期对话的摘要缓存，覆盖到 upto_message_id 为止的消息
+    [
+        """CREATE TABLE IF NOT EXISTS conversation_summaries (
+            session_id TEXT PRIMARY KEY,
+            upto_message_id INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ],
+    # 4: 聊天记录全文索引（rowid = messages.id），以及已有消息的补建进度：补建到 target_id 为止，之后的消息由写入路径建索引
+    [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, session_id UNINDEXED, role UNINDEXED, tokenize='unicode61')",
+        "CREATE TABLE IF NOT EXISTS search_backfill (last_id INTEGER NOT NULL, target_id INTEGER NOT NULL)",
+        "INSERT INTO search_backfill (last_id, target_id) SELECT 0, COALESCE(MAX(id), 0) FROM messages",
+    ],
+    # 5: 多进程部署时的缓存失效通知，各进程按 id 增量读取其他进程发布的通知
+    [
+        """CREATE TABLE IF NOT EXISTS cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT NOT NULL,
+            key TEXT,
+            origin TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )""",
+    ],
+]
+
+
+def migrate(conn: sqlite3.Connection):
+    """
+    每个迁移连同 user_version 在一个显式事务里执行（SQLite 的 DDL 支持事务）：中途出错或进程崩溃时整体回滚，
+    下次启动从同一个版本重新执行，不会出现执行了一半、又不能重复执行的语句（ALTER TABLE ADD COLUMN、INSERT）
+    """
+    conn.commit()
+    isolation_level = conn.isolation_level
+    # sqlite3 模块在 DDL 前会隐式提交，改为手动管理事务
+    conn.isolation_level = None
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version={target}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"数据库迁移到版本 {target}")
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def encode_cursor(*values) -> str:
+    """把排序键编码成不透明的分页游标"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    """解析分页游标，格式不对时抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return values
+
+
+class FileLock:
+    """
+    跨进程互斥锁：对锁文件加 fcntl.flock，持有锁的进程退出时由内核自动释放。
+    同一个对象不能在多个线程里同时使用；没有 fcntl 的平台上 acquire 总是成功
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if fcntl is None:
+            return True
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def write_lock(path: str = None) -> FileLock:
+    """数据库文件对应的跨进程写锁，初始化建表和迁移时也要持有"""
+    return FileLock((path or DB_PATH) + ".write-lock")
+
+
+class ConnectionPool:
+    """有上限的只读连接池，连接按需创建，最多 size 条；factory(path) 用来创建连接，默认是 query_only 的 connect"""
+
+    def __init__(self, path: str, size: int, factory=None):
+        self.path = path
+        self.size = size
+        self.factory = factory or partial(connect, read_only=True)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self.factory(self.path)
+        return self._idle.get()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+_read_pool = None
+_read_executor = None
+_write_executor = None
+_write_conn = None
+_write_lock = None
+
+
+def configure(path: str = None, pool_size: int = None):
+    """切换数据库文件或连接池大小（压测和初始化时使用），会关闭已有的连接"""
+    global DB_PATH, DB_POOL_SIZE
+    close()
+    if path:
+        DB_PATH = path
+    if pool_size:
+        DB_POOL_SIZE = pool_size
+
+
+def _executors():
+    global _read_pool, _read_executor, _write_executor
+    if _write_executor is None:
+        _read_pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+        _read_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sqlite-read")
+        _write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+    return _read_executor, _write_executor
+
+
+def _get_write_conn() -> sqlite3.Connection:
+    # 只会在唯一的写线程里调用
+    global _write_conn, _write_lock
+    if _write_conn is None:
+        _write_conn = connect(DB_PATH)
+        if DB_WRITE_LOCK:
+            _write_lock = write_lock()
+    return _write_conn
+
+
+def _run_read(fn, args):
+    with _read_pool.connection() as conn:
+        return fn(conn, *args)
+
+
+def _run_write(fn, args):
+    conn = _get_write_conn()
+    if _write_lock is not None:
+        _write_lock.acquire()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        result = fn(conn, *args)
+        conn.commit()
+        return result
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if _write_lock is not None:
+            _write_lock.release()
+
+
+async def read(fn, *args):
+    """在读线程里用连接池中的连接执行 fn(conn, *args)"""
+    read_executor, _ = _executors()
+    return await asyncio.get_running_loop().run_in_executor(read_executor, partial(_run_read, fn, args))
+
+
+async def transaction(fn, *args):
+    """在写线程里以一个事务执行 fn(conn, *args)，成功提交，异常回滚"""
+    _, write_executor = _executors()
+    return await asyncio.get_running_loop().run_in_executor(write_executor, partial(_run_write, fn, args))
+
+
+async def checkpoint():
+    """把 WAL 中的内容写回主库并 fsync，关闭前调用，保证已提交的数据落盘"""
+    def _checkpoint():
+        conn = _get_write_conn()
+        with _write_lock or nullcontext():
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    _, write_executor = _executors()
+    await asyncio.get_running_loop().run_in_executor(write_executor, _checkpoint)
+
+
+async def fetchone(sql: str, params=()):
+    def _fetchone(conn):
+        row = conn.execute(sql, params).fetchone()
+        return dict(row) if row else None
+    return await read(_fetchone)
+
+
+async def fetchall(sql: str, params=()) -> list:
+    def _fetchall(conn):
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+    return await read(_fetchall)
+
+
+async def execute(sql: str, params=()) -> int:
+    """执行单条写语句并提交，返回影响的行数"""
+    return await transaction(lambda conn: conn.execute(sql, params).rowcount)
+
+
+def close():
+    global _read_pool, _read_executor, _write_executor, _write_conn, _write_lock
+    if _write_executor is not None:
+        # 写连接只能在写线程里关闭
+        if _write_conn is not None:
+            _write_executor.submit(_write_conn.close).result()
+        _write_executor.shutdown(wait=True)
+        _read_executor.shutdown(wait=True)
+        _read_pool.close()
+    if _write_lock is not None:
+        _write_lock.close()
+    _read_pool = _read_executor = _write_executor = _write_conn = _write_lock = None
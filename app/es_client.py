@@ -0,0 +1,129 @@
+# 进程内共享的 Elasticsearch 异步客户端
+# - 整个进程只创建一个 AsyncElasticsearch，连接池 + keep-alive，不再每次查询都新建客户端
+# - 每个请求有超时；连续失败达到阈值后熔断，熔断期间直接快速失败，不会拖住对话
+# - 启动时预热一次（建立连接、完成产品校验），查询前不再 ping
+# - 准入控制限制同时进行的查询数，超出时有限排队；被拒绝的查询不计入熔断（ES 本身没有出错）
+import os
+import time
+
+from elasticsearch import AsyncElasticsearch
+
+from admission import admission
+
+ES_URL = os.getenv("ES_URL")
+ES_INDEX = os.getenv("ES_INDEX", "news_index")
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "5"))
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "10"))
+# 使用 httpx 作为底层 HTTP 实现，与大模型客户端一致，不需要额外安装 aiohttp
+ES_NODE_CLASS = os.getenv("ES_NODE_CLASS", "httpxasync")
+# 熔断：连续失败 ES_BREAKER_FAILURES 次后打开，ES_BREAKER_RESET_SECONDS 秒后放行一个探测请求
+ES_BREAKER_FAILURES = int(os.getenv("ES_BREAKER_FAILURES", "3"))
+ES_BREAKER_RESET_SECONDS = float(os.getenv("ES_BREAKER_RESET_SECONDS", "30"))
+ES_CONCURRENCY = int(os.getenv("ES_CONCURRENCY", str(ES_CONNECTIONS_PER_NODE)))
+ES_QUEUE_SIZE = int(os.getenv("ES_QUEUE_SIZE", str(ES_CONCURRENCY * 2)))
+ES_MAX_WAIT = float(os.getenv("ES_MAX_WAIT", "2"))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """简单的三态熔断器：closed -> open -> half_open -> closed/open"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            # 冷却时间已过，放行一个探测请求
+            self.state = "half_open"
+            return True
+        if self.state == "half_open":
+            # 探测请求还没返回时，其他请求继续快速失败
+            return False
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_cancelled(self):
+        """请求被取消（客户端断开、截止时间到），结果未知：不计失败；探测请求被取消时放行下一个探测请求"""
+        if self.state == "half_open":
+            self.state = "open"
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(ES_BREAKER_FAILURES, ES_BREAKER_RESET_SECONDS)
+_admission = admission.resource("es", ES_CONCURRENCY, ES_QUEUE_SIZE, ES_MAX_WAIT)
+_client = None
+
+
+def get_client() -> AsyncElasticsearch:
+    global _client
+    if _client is None:
+        if not ES_URL:
+            raise ValueError("未配置 ES_URL")
+        _client = AsyncElasticsearch(
+            [ES_URL],
+            verify_certs=False,
+            node_class=ES_NODE_CLASS,
+            connections_per_node=ES_CONNECTIONS_PER_NODE,
+            request_timeout=ES_REQUEST_TIMEOUT,
+            # 失败由熔断器处理，不在单次请求里重试，避免把超时放大
+            max_retries=0,
+            retry_on_timeout=False,
+        )
+    return _client
+
+
+async def _call(method, **kwargs):
+    if not breaker.allow():
+        raise CircuitOpenError("Elasticsearch 熔断中，暂时跳过ES搜索")
+    try:
+        response = await method(**kwargs)
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # 不能停留在 half_open，否则 allow() 一直返回 False，ES 搜索直到重启都不会恢复
+        breaker.record_cancelled()
+        raise
+    breaker.record_success()
+    return response
+
+
+async def warm_up():
+    """启动时调用：建立连接并完成一次请求，失败只记录到熔断器，不影响应用启动"""
+    if not ES_URL:
+        return
+    try:
+        info = await _call(get_client().info)
+        print(f"Elasticsearch 预热完成: {info['version']['number']}")
+    except Exception as e:
+        print(f"Elasticsearch 预热失败: {str(e)}")
+
+
+async def search(body: dict, index: str = None) -> dict:
+    async with admission.slot(_admission):
+        response = await _call(get_client().search, index=index or ES_INDEX, body=body)
+    return response.body
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,150 @@
+# 会话导出：按批从数据库游标读取消息，边读边生成 Markdown / JSONL 片段，内存占用与会话长度无关
+# 支持 gzip 压缩，以及把多个会话打包成一个 zip 流式下载
+import json
+import os
+import zipfile
+import zlib
+
+import db
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+# 输出缓冲攒到这么大再交给 StreamingResponse，避免每条消息一个网络写
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+
+EXPORT_FORMATS = {
+    "md": {"media_type": "text/markdown", "suffix": "md"},
+    "jsonl": {"media_type": "application/x-ndjson", "suffix": "jsonl"},
+}
+
+
+async def iter_messages(session_id: str, batch_size: int = None):
+    """按 id 游标分批读取一个会话的消息，每次只在内存里保留一批"""
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    last_id = 0
+    while True:
+        rows = await db.fetchall(
+            "SELECT id, role, content, created_at FROM messages WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (session_id, last_id, batch_size)
+        )
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1]["id"]
+
+
+async def iter_session_ids(batch_size: int = None):
+    """按 id 游标分批遍历所有会话"""
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    last_id = ""
+    while True:
+        rows = await db.fetchall("SELECT id FROM chat_sessions WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size))
+        for row in rows:
+            yield row["id"]
+        if len(rows) < batch_size:
+            break
+        last_id = rows[-1]["id"]
+
+
+async def render_markdown(session: dict):
+    yield f"# 会话历史记录\n\n## 会话ID: {session['id']}\n\n## 会话总结: {session['summary']}\n\n"
+    async for message in iter_messages(session["id"]):
+        yield f"### {message['role']}\n\n{message['content']}\n\n"
+
+
+async def render_jsonl(session: dict):
+    # 第一行是会话信息，之后每行一条消息
+    yield json.dumps({"session_id": session["id"], "summary": session["summary"]}, ensure_ascii=False) + "\n"
+    async for message in iter_messages(session["id"]):
+        yield json.dumps({
+            "role": message["role"],
+            "content": message["content"],
+            "created_at": message["created_at"],
+        }, ensure_ascii=False) + "\n"
+
+
+RENDERERS = {"md": render_markdown, "jsonl": render_jsonl}
+
+
+async def encode_chunks(fragments, chunk_bytes: int = None):
+    """把文本片段编码成 UTF-8，并合并成较大的块输出"""
+    chunk_bytes = chunk_bytes or EXPORT_CHUNK_BYTES
+    buffer = []
+    size = 0
+    async for fragment in fragments:
+        data = fragment.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+async def gzip_chunks(chunks):
+    """增量 gzip 压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def export_session_stream(session: dict, fmt: str = "md", compress: bool = False):
+    chunks = encode_chunks(RENDERERS[fmt](session))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    async for chunk in chunks:
+        yield chunk
+
+
+class _ZipSink:
+    """zipfile 的只写输出目标：写入的数据先攒在内存里，由异步生成器取走后清空"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def export_archive_stream(session_ids=None, fmt: str = "md"):
+    """
+    把多个会话（session_ids 为 None 时为全部会话，空列表得到空的 zip 包）打包成 zip 流。
+    zip 写到不可 seek 的输出时使用数据描述符，不需要预先知道每个文件的大小。
+    """
+    sink = _ZipSink()
+    suffix = EXPORT_FORMATS[fmt]["suffix"]
+    ids = iter_session_ids() if session_ids is None else _iter_list(session_ids)
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        async for session_id in ids:
+            session = await db.fetchone("SELECT id, summary FROM chat_sessions WHERE id = ?", (session_id,))
+            if not session:
+                continue
+            with archive.open(f"session_{session_id}.{suffix}", mode="w", force_zip64=True) as entry:
+                async for chunk in encode_chunks(RENDERERS[fmt](session)):
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+async def _iter_list(values):
+    for value in values:
+        yield value
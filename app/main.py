@@ -1,20 +1,19 @@
 from fastapi import FastAPI, Request, HTTPException, Query
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from openai import OpenAI
+from contextlib import asynccontextmanager
+from openai import AsyncOpenAI
+import anyio
+import httpx
 import os
 import json
+import math
 import uuid
 import urllib.parse
 from datetime import datetime
 import asyncio
-import sqlite3
-from mcp_api import router as mcp_router, get_mcp_server_details  # Import MCP router and helper
-from fastmcp import Client
-from fastmcp.client.transports import SSETransport
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
 
 
 # 检查 .env文件是否存在
@@ -23,19 +22,135 @@ if not os.path.exists(".env"):
 
 load_dotenv()
 
+# 本项目的模块在导入时读取环境变量，必须放在 load_dotenv() 之后导入
+import agent
+import chat_search
+import db
+import es_client
+import web_search
+from admission import AdmittedStreamingResponse, Overloaded, admission
+from agent import AgentRun, completion_text
+from answer_cache import answer_cache, fingerprint
+from chat_search import search_backfill
+from cluster import cluster
+from context_assembler import context_assembler
+from message_log import message_log
+from export import EXPORT_FORMATS, export_session_stream, export_archive_stream
+from mcp_api import router as mcp_router, get_mcp_server_details  # Import MCP router and helper
+from mcp_pool import mcp_pool
+from retrieval_cache import retrieval_cache
+from retrievers import retrievers
+from sse import SSEWriter
+from summary_worker import summary_worker
+from tool_catalog import tool_catalog
+from tool_index import TOOL_EMBEDDING_MODEL
+from tool_cache import tool_result_cache
+
 # 从env中获取配置
 API_KEY = os.getenv("API_KEY")
 BASE_URL= os.getenv("BASE_URL")
 MODEL_NAME = os.getenv("MODEL_NAME")
  
-BOCHAAI_SEARCH_API_KEY = os.getenv("BOCHAAI_SEARCH_API_KEY")
-
 #检查配置是否正确
 if not API_KEY or not BASE_URL or not MODEL_NAME :
     raise ValueError("API_KEY配置错误，请检查环境变量 .env文件")
 
+# 大模型HTTP连接池配置：所有请求共享一个连接池，限制最大连接数，避免高并发时无限制地向上游建连
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# 会话列表和会话消息分页时的默认每页条数
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "100"))
+# 流式输出时检测客户端是否已断开的最小间隔（秒）
+DISCONNECT_CHECK_INTERVAL = float(os.getenv("DISCONNECT_CHECK_INTERVAL", "0.5"))
+# 上下文检索的单来源截止时间（秒），超时的来源跳过，不拖慢首个token
+WEB_SEARCH_DEADLINE = float(os.getenv("WEB_SEARCH_DEADLINE", "8"))
+ES_SEARCH_DEADLINE = float(os.getenv("ES_SEARCH_DEADLINE", "3"))
+# 准入控制：同时进行的大模型回答数上限、排队上限和最长排队时间（秒）；拿不到名额时返回 429，
+# ADMISSION_REJECT_MODE=sse 时改为返回一帧 SSE 错误（状态码 200）
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", str(LLM_CONCURRENCY * 2)))
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", "10"))
+ADMISSION_REJECT_MODE = os.getenv("ADMISSION_REJECT_MODE", "429")
+
+SYSTEM_PROMPT = "你是一个专业的问答助手。"
+
+# 初始化AI客户端：使用异步客户端，流式读取token时不再阻塞事件循环
+ai_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+    ),
+    timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0)
+)
+ai_client = AsyncOpenAI(
+    api_key = API_KEY,
+    base_url = BASE_URL,
+    http_client = ai_http_client
+)
+
+# 配置了向量模型时，工具预筛选改用向量相似度（否则使用本地 BM25）
+async def embed_texts(texts: list) -> list:
+    response = await ai_client.embeddings.create(model=TOOL_EMBEDDING_MODEL, input=texts)
+    return [item.embedding for item in response.data]
+
+if TOOL_EMBEDDING_MODEL:
+    tool_catalog.index.embed = embed_texts
+
+# 会话历史变长后，后台任务用大模型把较早的对话压缩成摘要（结果缓存在数据库里），不占用请求路径
+async def summarize_text(prompt: str) -> str:
+    response = await ai_client.chat.completions.create(model=MODEL_NAME, messages=[{"role": "user", "content": prompt}])
+    return response.choices[0].message.content or ""
+
+summary_worker.summarize = summarize_text
+context_assembler.request_summary = summary_worker.enqueue
+
+# 每个 /api/stream 回答（包括 Agent 的多轮调用）占用一个大模型名额，直到流式响应结束；
+# Agent 推测执行的直接回答另外占用一个名额，没有空闲名额时不做推测执行
+llm_admission = admission.resource("llm", LLM_CONCURRENCY, LLM_QUEUE_SIZE, LLM_MAX_WAIT)
+
+def overloaded_response(session_id: str, error: Overloaded):
+    print(f"-----请求被拒绝: {str(error)}")
+    if ADMISSION_REJECT_MODE == "sse":
+        async def reject():
+            yield SSEWriter(session_id).error(f"错误：{str(error)}")
+        return StreamingResponse(reject(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"})
+    return JSONResponse(
+        status_code=429, content={"detail": str(error)}, headers={"Retry-After": str(math.ceil(error.retry_after))}
+    )
+
+# 多进程部署：修改 MCP 服务器/工具后通知所有进程失效工具目录、关闭旧地址的会话；只需执行一次的后台任务由主进程执行
+cluster.subscribe("tool_catalog", tool_catalog.invalidate)
+cluster.subscribe("mcp_pool", mcp_pool.evict)
+cluster.on_leader(summary_worker.scan_recent)
+# 迁移前已有的消息在后台分批补建全文索引
+cluster.on_leader(search_backfill.start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    message_log.start()
+    # ES 预热放到后台，ES 不可用时不拖慢应用启动
+    es_warm_up = asyncio.create_task(es_client.warm_up())
+    mcp_pool.start()
+    summary_worker.start()
+    await cluster.start()
+    yield
+    es_warm_up.cancel()
+    await cluster.stop()
+    await summary_worker.stop()
+    await search_backfill.stop()
+    # 关闭共享的大模型连接池和ES客户端；把尚未落库的消息写完后再关闭数据库连接
+    await ai_client.close()
+    await es_client.close()
+    await web_search.close()
+    await mcp_pool.close()
+    await message_log.stop()
+    db.close()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Include MCP router
 app.include_router(mcp_router)
@@ -47,21 +162,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-
- # 初始化AI客户端
-ai_client = OpenAI(
-    api_key = API_KEY,
-    base_url = BASE_URL
-)
-
 # Initialize SQLite database
 def init_db():
-    conn = sqlite3.connect('chat_history.db')
+    # uvicorn --workers 部署时每个进程启动都会执行：持有跨进程写锁，建表和迁移不会同时执行
+    lock = db.write_lock()
+    lock.acquire()
+    try:
+        _create_tables()
+    finally:
+        # 关闭锁文件即释放锁
+        lock.close()
+    print("数据库初始化完成")
+
+def _create_tables():
+    conn = db.connect()
     cursor = conn.cursor()
     
     # Create chat sessions table
@@ -114,55 +234,27 @@ def init_db():
     ''')
     
     conn.commit()
+    # 执行尚未执行的结构迁移（索引等）
+    db.migrate(conn)
     conn.close()
-    print("数据库初始化完成")
 
 # Perform web search (optional, retained for flexibility)
 # https://open.bochaai.com/overview
 async def perform_web_search(query: str):
     try:
-        import requests
-        
-        headers = {
-            'Content-Type': 'application/json',  # Remove space
-            'Authorization': f'Bearer {BOCHAAI_SEARCH_API_KEY}'  # 我加的注释：原来是把查询key放在header里面啊
-        }
-     
-        payload = json.dumps({
-            "query": query,
-            "freshness": "noLimit",
-            "summary": True, 
-            "count": 10
-        })
-
-        # 使用搜索API, 参考文档 https://bocha-ai.feishu.cn/wiki/RXEOw02rFiwzGSkd9mUcqoeAnNK
-        response = requests.post("https://api.bochaai.com/v1/web-search", headers=headers, data=payload)
-        
-        # Check status code before parsing JSON
-        if response.status_code != 200:
-            return f"搜索失败，状态码: {response.status_code}"
-            
-        # Only parse JSON if status code is 200
-        try:
-            json_data = response.json()
-            #print(f"bbbbbbbbbbbbbb bochaai search response: {json_data}")
-            return str(json_data)
-        except json.JSONDecodeError as e:
-            return f"搜索结果JSON解析失败: {str(e)}"
-            
+        # 异步客户端 + 连接池 + 超时重试；相同（归一化后）的问题在有效期内直接复用搜索结果
+        results = await retrieval_cache.get_or_load(
+            "web", query, {"freshness": "noLimit", "count": web_search.WEB_SEARCH_COUNT},
+            lambda: web_search.search(query)
+        )
+        return web_search.format_results(results)
+    except web_search.WebSearchError as e:
+        return str(e)
     except Exception as e:
         return f"执行网络搜索时出错: {str(e)}"
 
 async def perform_es_search(query: str):
     try:
-        #es_url = os.getenv("ES_URL","http://172.26.219.10:9200")
-        es_url = os.getenv("ES_URL")
-
-        es = Elasticsearch([es_url],verify_certs=False)
-
-        if not es.ping():
-            return "无法连接到Elasticsearch服务器，请检查服务是否正常运行！"
-        
         if not query:
             print("-----ERROR: query parameter is required for ES search!----")
             raise HTTPException(status_code=400, detail="query parameter is required for ES search!")
@@ -187,246 +279,194 @@ async def perform_es_search(query: str):
             "_source": ["title", "content"]
         }
         
-        response = es.search(index="news_index", body=search_body).body
+        # 使用进程内共享的异步客户端，连接复用；ES 不可用时熔断器直接快速失败
+        # 相同（归一化后）的问题在有效期内直接复用检索结果
+        cache_params = {"index": es_client.ES_INDEX, "size": 10, "fields": ["title", "content"]}
+        response = await retrieval_cache.get_or_load("es", query, cache_params, lambda: es_client.search(search_body))
         response_content = json.dumps(response, ensure_ascii=False)
         print(f"-----perform_es_search结果: {response_content}")
         return response_content
+    except es_client.CircuitOpenError as e:
+        print(f"ES搜索跳过: {str(e)}")
+        return "无法连接到Elasticsearch服务器，请检查服务是否正常运行！"
     except Exception as e:
         print(f"ES搜索时出错: {str(e)}")
         #raise HTTPException(status_code=500, detail=f"ES搜索时出错: {str(e)}")
+        return f"ES搜索时出错: {str(e)}"
+
+# 注册上下文检索器：名字即 /api/stream 上对应的开关参数
+retrievers.register("web_search", perform_web_search, deadline=WEB_SEARCH_DEADLINE)
+retrievers.register("es_search", perform_es_search, deadline=ES_SEARCH_DEADLINE)
 
 # Save new chat session
-async def create_new_chat_session(session_id: str, query: str, response: str):
-    conn = sqlite3.connect('chat_history.db')
-    cursor = conn.cursor()
+# 对话轮次交给后写日志批量落库，返回的句柄可用于等待落库完成
+def create_new_chat_session(session_id: str, query: str, response: str):
     summary = query[:50] + ("..." if len(query) > 50 else "")
-    cursor.execute(
-        '''
-        INSERT INTO chat_sessions (id, summary, created_at, updated_at)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (session_id, summary, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    cursor.execute(
-        '''
-        INSERT INTO messages (session_id, role, content, created_at)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (session_id, "user", query, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    cursor.execute(
-        '''
-        INSERT INTO messages (session_id, role, content, created_at)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (session_id, "assistant", response, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    conn.commit()
-    conn.close()
+    return message_log.append_turn(session_id, query, response, new_session=True, summary=summary)
 
 # Add message to existing session
-async def add_message_to_session(session_id: str, query: str, response: str):
-    conn = sqlite3.connect('chat_history.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        INSERT INTO messages (session_id, role, content, created_at)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (session_id, "user", query, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    cursor.execute(
-        '''
-        INSERT INTO messages (session_id, role, content, created_at)
-        VALUES (?, ?, ?, ?)
-        ''',
-        (session_id, "assistant", response, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    cursor.execute(
-        '''
-        UPDATE chat_sessions
-        SET updated_at = ?
-        WHERE id = ?
-        ''',
-        (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session_id)
-    )
-    conn.commit()
-    conn.close()
+def add_message_to_session(session_id: str, query: str, response: str):
+    return message_log.append_turn(session_id, query, response)
 
 # Process stream request (updated to use openai for GLM, requests for tools)
-async def process_stream_request(query: str, session_id: str = None, web_search: bool = False, agent_mode: bool = False, es_search: bool = False):
+async def process_stream_request(query: str, session_id: str = None, web_search: bool = False, agent_mode: bool = False, es_search: bool = False, request: Request = None, bypass_cache: bool = False):
     print(f"-----query: {query}, session_id: {session_id}, web_search: {web_search}, agent_mode: {agent_mode},es_search: {es_search}")
     
-    # Initialize database connection
-    conn = sqlite3.connect('chat_history.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM chat_sessions WHERE id = ?", (session_id,))
-    has_session = cursor.fetchone()
+    # Build context：所有启用的检索器并发执行，和下面的会话查询同时进行
+    context_task = asyncio.ensure_future(retrievers.gather(query, {"web_search": web_search, "es_search": es_search}))
+
+    try:
+        # 刚创建、还在后写队列里的会话也算已存在，保证连续两轮对话落在同一个会话里；
+        # 多进程部署时上一轮可能由其他进程处理，查不到时等它落库后再查
+        has_session = await message_log.session_exists(session_id)
+    except BaseException:
+        context_task.cancel()
+        raise
     if not has_session:
         session_id = str(uuid.uuid4())
 
-    # Build context (only web search if enabled)
-    context_parts = []
-    if web_search:
-        web_results = await perform_web_search(query)
-        context_parts.append(web_results)
-    if es_search:
-        es_results = await perform_es_search(query)
-        context_parts.append(es_results)
-    context = "\n".join(context_parts) if context_parts else ""
-
-    # Common response generator function,公用的生成函数，在第340等行被多个StreamingResponse函数调用
-    async def generate(content_stream=None, initial_content=""):
+    context, _ = await context_task
+
+    # Common response generator function,公用的生成函数，被多个StreamingResponse函数调用
+    # content_stream 是产出增量文本的异步生成器（completion_text 包装的大模型流式响应，或 Agent 引擎）
+    # on_complete(full_response) 在回答完整输出并保存后调用（出错或客户端断开时不调用），用于写回答缓存
+    async def generate(content_stream=None, initial_content="", on_complete=None):
         full_response = initial_content
+        writer = SSEWriter(session_id)
         
         # Handle streaming content if provided
         if content_stream:
+            loop = asyncio.get_running_loop()
+            disconnected = False
+
+            # 从上游读取增量文本，合并成帧的工作交给 SSEWriter
+            async def deltas():
+                nonlocal full_response, disconnected
+                last_check = loop.time()
+                async for content in content_stream:
+                    full_response += content
+                    yield content
+                    # 客户端断开后立即停止读取上游，不再为无人接收的回答消耗token
+                    if request is not None and loop.time() - last_check >= DISCONNECT_CHECK_INTERVAL:
+                        last_check = loop.time()
+                        if await request.is_disconnected():
+                            print(f"-----客户端已断开，取消上游生成, session_id: {session_id}")
+                            disconnected = True
+                            return
+
             try:
-                for chunk in content_stream:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_response += content
-                        yield f"data: {json.dumps({'content': content, 'session_id': session_id})}\n\n"
-                        await asyncio.sleep(0.01)
-                    if chunk.choices[0].finish_reason is not None:
-                        yield f"data: {json.dumps({'content': '', 'session_id': session_id, 'done': True})}\n\n"
-                        break
+                async for frame in writer.stream(deltas()):
+                    yield frame
+                if disconnected:
+                    return
+                yield writer.done()
             except Exception as e:
-                yield f"data: {json.dumps({'content': f'错误：GLM API 请求失败 - {str(e)}', 'session_id': session_id, 'done': True})}\n\n"
+                yield writer.error(f'错误：GLM API 请求失败 - {str(e)}')
                 return
+            finally:
+                # 无论正常结束、出错还是被取消，都关闭上游响应，把连接还给连接池
+                with anyio.CancelScope(shield=True):
+                    await content_stream.aclose()
         else:
             # For direct response (non-streaming)
-            yield f"data: {json.dumps({'content': full_response, 'session_id': session_id})}\n\n"
-            yield f"data: {json.dumps({'content': '', 'session_id': session_id, 'done': True})}\n\n"
+            yield writer.message(full_response)
+            yield writer.done()
         
         # Save to database
         if has_session:
-            await add_message_to_session(session_id, query, full_response)
+            add_message_to_session(session_id, query, full_response)
         else:
-            await create_new_chat_session(session_id, query, full_response)
+            create_new_chat_session(session_id, query, full_response)
+        # 后台检查是否需要推进会话摘要，不等待
+        summary_worker.enqueue(session_id)
+        if on_complete is not None:
+            on_complete(full_response)
+
+    # 回答缓存：同样的问题、上下文和开关下直接回放之前的回答，仍然作为一轮对话保存
+    def cached_answer(scope: str):
+        answer = answer_cache.get(query, scope, bypass=bypass_cache)
+        if answer is None:
+            return None
+        print(f"-----回答缓存命中, session_id: {session_id}")
+        return StreamingResponse(
+            generate(answer_cache.replay(answer)),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
+        )
+
+    def store_answer(scope: str):
+        if bypass_cache:
+            return None
+        return lambda answer, ttl=None: answer_cache.put(query, scope, answer, ttl)
+
+    flags = {"web_search": web_search, "es_search": es_search, "agent_mode": agent_mode}
+
+    # 已有会话时带上之前的对话：按 token 预算组装历史、检索上下文（以及 Agent 的工具结果），放不下的早期对话压缩成摘要
+    history_session = session_id if has_session else None
 
     # Agent mode: Decide whether to invoke a tool  #我加的：Agent开关就是使用mcp tool的意思
     if agent_mode:  #如果使用mcp工具，则：
-        # Fetch available tools
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        #这个简单的联合查询很好理解：
-        cursor.execute(" SELECT t.*, s.url FROM mcp_tools t LEFT JOIN mcp_servers s ON t.server_id = s.id ")
-        #原来cursor.fetchall0本来也是个数组，它是个二进制，原来通过dict(它)就可以把这个数组里的内容转为字典
-        tools = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-
-        # Construct tool descriptions for the LLM
-        tool_descriptions = "\n".join([
-            f"server_url: {tool['url']}\n\ntool_name: {tool['name']}\nDescription: {tool['description']}\ninput_schema: {tool['input_schema']}"
-            for tool in tools
-        ]) if tools else "无可用工具"
-
-        # Prompt to decide tool invocation。如果联网搜索和使用mcp的按钮同时打开了，则会把联网搜索和mcp的结果一起作为上下文信息，--感觉有点不太对？？
-        agent_prompt = f"""
-        上下文信息:\n{context}\n
-        问题: {query}\n
-        可用工具:\n{tool_descriptions}\n
-        你是一个智能助手，可以根据用户问题选择合适的工具执行操作。
-        如果需要使用工具，请返回以下格式的JSON：
-        ```json
-        {{
-          "server_url": "server_url",
-          "tool_name": "tool_name",
-          "parameters":{{"param_name1": "param_value1", "param_name2": "param_value2"}}
-        }}
-        ```
-        如果不需要工具，直接返回回答内容的字符串。
-        """
-
-        # Call GLM API using openai (non-streaming)
-        try:
-            response = ai_client.chat.completions.create(
-                model = MODEL_NAME,
-                messages= [
-                    {"role": "system", "content": "你是一个智能助手，擅长选择合适的工具或直接回答问题。"},
-                    {"role": "user", "content": agent_prompt}
-                ],
-                stream=False,
-                response_format={"type": "json_object"} 
-            )
-            decision = response.choices[0].message.content.strip()
-            print("*****decision:*****",decision)  # 我加的，预测是一个json的工具列表
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"GLM API request failed: {str(e)}")
-
+        # Fetch available tools：从进程内的工具目录取与问题最相关的前 k 个工具，不访问数据库
+        tools = await tool_catalog.select(query)
+        assembled = await context_assembler.assemble(
+            history_session, query, context, agent.AGENT_SYSTEM_PROMPT, reserved=agent.tools_tokens(tools)
+        )
+        scope = fingerprint(assembled.context, assembled.history, flags, [tool.id for tool in tools])
+        cached = cached_answer(scope)
+        if cached is not None:
+            return cached
+        # 通过 tools（function calling）接口流式决策，多个工具并发执行，可以多步调用
+        # 如果联网搜索和使用mcp的按钮同时打开了，则会把联网搜索的结果一起作为上下文信息
         try:
-            # Check if the response is a tool invocation
-            decision_json = json.loads(decision)
-            if "server_url" in decision_json and "tool_name" in decision_json:
-                server_url = decision_json["server_url"]
-                tool_name = decision_json["tool_name"]
-                parameters = decision_json["parameters"]
-                print("*****decision_json:*****",decision_json)
-                
-                try:
-                    async with Client(SSETransport(server_url)) as client:    ##我加的，原来是在这里调用的mcp tool ！！发这个课件的时候，下一节课才讲这里怎么调用mcp tool的细节
-                        try:
-                            tool_result = await client.call_tool(tool_name, parameters)
-                        except Exception as tool_error:
-                            print(f"@@@@@@Error in call_tool:{tool_error}")  #我加的，找到了是因为db的表不存在的问题，哈哈
-                        tool_response = f"工具 {tool_name} 的执行结果：{tool_result}"
-                        print(f"#################工具 {tool_name} 的执行结果：{tool_result}")
-                        
-                        # 继续调用大模型
-                        prompt = f"上下文信息:\n{tool_result}\n\n问题: {query}\n请基于上下文信息回答问题:"
-                        stream = ai_client.chat.completions.create(
-                            model=MODEL_NAME,
-                            ####model="gpt-4o",
-                            messages=[{"role": "user", "content": prompt}],
-                            stream=True
-                        )
-                        # Use the common generator with the stream and initial content
-                        return StreamingResponse(
-                            generate(stream, tool_response),
-                            media_type="text/event-stream",
-                            headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
-                        )
-                except Exception as e:
-                    return StreamingResponse(
-                        generate(initial_content=f"工具 {tool_name} 执行失败：{str(e)}"),
-                        media_type="text/event-stream",
-                        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
-                    )
-            else:
-                # Direct response from decision
-                return StreamingResponse(
-                    generate(initial_content=decision),
-                    media_type="text/event-stream",
-                    headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
-                )
-        except json.JSONDecodeError:
-            # If not JSON, treat as direct response
-            return StreamingResponse(
-                generate(initial_content=decision),
-                media_type="text/event-stream",
-                headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
-            )
+            slot = await llm_admission.acquire()
+        except Overloaded as e:
+            return overloaded_response(session_id, e)
+        agent_run = AgentRun(ai_client, MODEL_NAME, tools, query, assembled.context, assembled.history, assembled.remaining,
+                             llm_resource=llm_admission)
+        store = store_answer(scope)
+
+        def store_agent_answer(answer: str):
+            # 有工具调用失败的回答不缓存；有效期不超过用到的工具的结果有效期，调用过不缓存的工具时不缓存
+            if store is not None and not agent_run.tool_errors:
+                store(answer, agent_run.tool_ttl)
+
+        return AdmittedStreamingResponse(
+            generate(agent_run.stream(), on_complete=store_agent_answer),
+            slot=slot,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
+        )
     
     # Non-agent mode: Streaming response
-    prompt = f"上下文信息:\n{context}\n\n问题: {query}\n请基于上下文信息回答问题，如果上下文中没有相关信息，请回答我们的资源库中没有相关信息，不要编造答案。"
+    assembled = await context_assembler.assemble(history_session, query, context, SYSTEM_PROMPT)
+    scope = fingerprint(assembled.context, assembled.history, flags)
+    cached = cached_answer(scope)
+    if cached is not None:
+        return cached
+    prompt = f"上下文信息:\n{assembled.context}\n\n问题: {query}\n请基于上下文信息回答问题，如果上下文中没有相关信息，请回答我们的资源库中没有相关信息，不要编造答案。"
     print(f"pppppppppppp prompt: {prompt}")
     print(f"-----------------------:,{MODEL_NAME}")
     
     try:
-        stream = ai_client.chat.completions.create(
+        slot = await llm_admission.acquire()
+    except Overloaded as e:
+        return overloaded_response(session_id, e)
+    try:
+        stream = await ai_client.chat.completions.create(
             model=MODEL_NAME,
             #model="gpt-4o",
             messages=[
-                {"role": "system", "content": "你是一个专业的问答助手。"},
+                {"role": "system", "content": SYSTEM_PROMPT},
+                *assembled.history,
                 {"role": "user", "content": prompt}
             ],
             stream=True
         )
     except Exception as e:
+        slot.release()
+        error_message = str(e)
         async def generate_error():
-            global e
-            yield f"data: {json.dumps({'content': f'错误：大模型 API 请求失败 - {e}', 'session_id': session_id, 'done': True})}\n\n"
+            yield SSEWriter(session_id).error(f'错误：大模型 API 请求失败 - {error_message}')
         return StreamingResponse(
             generate_error(),
             media_type="text/event-stream",
@@ -434,8 +474,9 @@ async def process_stream_request(query: str, session_id: str = None, web_search:
         )
     
     # Use the common generator with the stream
-    return StreamingResponse(
-        generate(stream),
+    return AdmittedStreamingResponse(
+        generate(completion_text(stream), on_complete=store_answer(scope)),
+        slot=slot,
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "Transfer-Encoding": "chunked"}
     )
@@ -444,86 +485,145 @@ async def process_stream_request(query: str, session_id: str = None, web_search:
 # Stream endpoint
 @app.get("/api/stream")
 async def stream(
+    request: Request,
     query: str,
     session_id: str = Query(None),  # 我加的：可以是空的，因为可能是新的对话，
     web_search: bool = Query(False),
     agent_mode: bool = Query(False),
     es_search: bool = Query(False),
+    bypass_cache: bool = Query(False),  # 为 true 时不读也不写回答缓存
 ):
-    return await process_stream_request(query, session_id, web_search, agent_mode, es_search)
+    return await process_stream_request(query, session_id, web_search, agent_mode, es_search, request, bypass_cache)
 
 
 # 会话历史记录 API
+# 传入 limit 时按 (updated_at, id) 做游标分页，下一页的游标放在响应头 X-Next-Cursor 里；不传则返回全部（兼容旧前端）
 @app.get("/api/chat/history")
-async def get_chat_history():
+async def get_chat_history(
+    response: Response,
+    limit: int = Query(None, ge=1, le=500),
+    cursor: str = Query(None),
+):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row  # 启用行工厂，使结果可以通过列名访问
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, summary, updated_at  FROM chat_sessions ORDER BY updated_at DESC")
-        rows = cursor.fetchall()
-        
-        # 将行转换为字典
-        sessions = [dict(row) for row in rows]
-        
-        conn.close()
+        await message_log.wait_persisted()
+        if limit is None and cursor is None:
+            return await db.fetchall("SELECT id, summary, updated_at  FROM chat_sessions ORDER BY updated_at DESC, id DESC")
+
+        limit = limit or HISTORY_PAGE_SIZE
+        if cursor:
+            updated_at, last_id = db.decode_cursor(cursor)
+            sessions = await db.fetchall(
+                "SELECT id, summary, updated_at FROM chat_sessions WHERE (updated_at, id) < (?, ?) ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (updated_at, last_id, limit + 1)
+            )
+        else:
+            sessions = await db.fetchall(
+                "SELECT id, summary, updated_at FROM chat_sessions ORDER BY updated_at DESC, id DESC LIMIT ?",
+                (limit + 1,)
+            )
+        # 多取一条用来判断是否还有下一页
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            response.headers["X-Next-Cursor"] = db.encode_cursor(sessions[-1]["updated_at"], sessions[-1]["id"])
         return sessions
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"获取聊天历史失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取聊天历史失败: {str(e)}")
 
+# 传入 limit 时从最新的消息开始倒着分页（长对话先加载最近的部分），next_cursor 指向更早的一页
 @app.get("/api/chat/session/{session_id}")
-async def get_session(session_id: str):
+async def get_session(
+    session_id: str,
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = Query(None),
+):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # 查询会话是否存在
-        cursor.execute("SELECT id FROM chat_sessions WHERE id = ?", (session_id,))
-        session = cursor.fetchone()
+        await message_log.wait_persisted(session_id)
+        session = await db.fetchone("SELECT id FROM chat_sessions WHERE id = ?", (session_id,))
         
         if not session:
-            conn.close()
             raise HTTPException(status_code=404, detail="会话不存在")
         
-        # 获取会话中的所有消息
-        cursor.execute(
-            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id asc",
-            (session_id,)
-        )
-        messages = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        return {"messages": messages}
+        if limit is None and cursor is None:
+            # 获取会话中的所有消息
+            messages = await db.fetchall(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id asc",
+                (session_id,)
+            )
+            return {"messages": messages}
+
+        limit = limit or SESSION_PAGE_SIZE
+        before_id = db.decode_cursor(cursor)[0] if cursor else None
+        if before_id is not None:
+            rows = await db.fetchall(
+                "SELECT id, role, content FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before_id, limit + 1)
+            )
+        else:
+            rows = await db.fetchall(
+                "SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                (session_id, limit + 1)
+            )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = db.encode_cursor(rows[-1]["id"])
+        # 页内仍按时间正序返回
+        messages = [{"role": row["role"], "content": row["content"]} for row in reversed(rows)]
+        return {"messages": messages, "next_cursor": next_cursor}
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"获取会话详情失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取会话详情失败: {str(e)}")
 
+# 全文检索聊天记录：按相关度排序，摘录中命中的词用 <mark> 标出；next_cursor 指向下一页
+@app.get("/api/chat/search")
+async def search_chat(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(None, ge=1, le=100),
+    cursor: str = Query(None),
+):
+    try:
+        await message_log.wait_persisted()
+        offset = db.decode_cursor(cursor)[0] if cursor else 0
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError(f"无效的分页游标: {cursor}")
+        limit = limit or chat_search.SEARCH_PAGE_SIZE
+        results, has_more = await chat_search.search(q, limit, offset)
+        return {"results": results, "next_cursor": db.encode_cursor(offset + limit) if has_more else None}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"搜索聊天记录失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"搜索聊天记录失败: {str(e)}")
+
 # 删除会话
 @app.delete("/api/chat/session/{session_id}")
 async def delete_session(session_id: str):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        cursor = conn.cursor()
-        
-        # 首先删除会话关联的所有消息
-        cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-        
-        # 然后删除会话本身
-        cursor.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
-        
-        if cursor.rowcount == 0:
-            conn.close()
-            raise HTTPException(status_code=404, detail="会话不存在")
+        await message_log.wait_persisted(session_id)
+
+        def _delete(conn):
+            # 首先删除会话关联的所有消息（及其全文索引）和对话摘要
+            chat_search.remove_session(conn, session_id)
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM conversation_summaries WHERE session_id = ?", (session_id,))
+            
+            # 然后删除会话本身
+            cursor = conn.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+            
+            if cursor.rowcount == 0:
+                raise HTTPException(status_code=404, detail="会话不存在")
         
-        conn.commit()
-        conn.close()
+        await db.transaction(_delete)
         
         return {"message": "会话已删除"}
         
@@ -535,56 +635,94 @@ async def delete_session(session_id: str):
 
 
 
-# 导出会话为markdown格式下载
+# 导出会话下载：format 支持 md（默认）和 jsonl，compress=true 时输出 gzip
+# 消息按批从数据库读取、边读边输出，导出超长会话时内存占用保持平稳
 @app.get("/api/chat/export/{session_id}")
-async def export_session(session_id: str):
+async def export_session(
+    session_id: str,
+    format: str = Query("md"),
+    compress: bool = Query(False),
+):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row  # Set row factory to enable dictionary access
-        cursor = conn.cursor()
-        
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+
         # 查询会话是否存在
-        cursor.execute("SELECT id, summary FROM chat_sessions WHERE id = ?", (session_id,))
-        session = cursor.fetchone()
+        await message_log.wait_persisted(session_id)
+        session = await db.fetchone("SELECT id, summary FROM chat_sessions WHERE id = ?", (session_id,))
         
         if not session:
-            conn.close()
             raise HTTPException(status_code=404, detail="会话不存在")
         
-        # 获取会话中的所有消息
-        cursor.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id asc", (session_id,))
-        messages = cursor.fetchall()
-        
-        # 构建markdown内容
-        markdown_content = f"# 会话历史记录\n\n"
-        markdown_content += f"## 会话ID: {session_id}\n\n"
-        markdown_content += f"## 会话总结: {session['summary']}\n\n"
-        
-        for message in messages:
-            role = message['role']
-            content = message['content']
-            markdown_content += f"### {role}\n\n{content}\n\n"
-        
-        conn.close()
+        filename = f"session_{session_id}.{EXPORT_FORMATS[format]['suffix']}"
+        media_type = EXPORT_FORMATS[format]["media_type"]
+        if compress:
+            filename += ".gz"
+            media_type = "application/gzip"
         
         return StreamingResponse(
-            iter([markdown_content]), 
-            media_type="text/markdown", 
-            headers={"Content-Disposition": f"attachment; filename=session_{session_id}.md"}
+            export_session_stream(session, format, compress), 
+            media_type=media_type, 
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"导出会话失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"导出会话失败: {str(e)}")
 
 
+# 批量导出多个会话为一个 zip 包，请求体：{"session_ids": [...], "format": "md"}，不传 session_ids 则导出全部会话，空列表得到空的 zip 包
+@app.post("/api/chat/export")
+async def export_sessions(body: dict):
+    try:
+        session_ids = body.get("session_ids")
+        fmt = body.get("format", "md")
+        if fmt not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"不支持的导出格式: {fmt}")
+        if session_ids is not None and not isinstance(session_ids, list):
+            raise HTTPException(status_code=400, detail="session_ids 必须是列表")
+
+        await message_log.wait_persisted()
+        return StreamingResponse(
+            export_archive_stream(session_ids, fmt),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=sessions_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"批量导出会话失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"批量导出会话失败: {str(e)}")
+
+
 # 健康检查接口
 @app.get("/api/health")
 def health_check():
     return {"status": "healthy"}
 
 
+# 运行指标：各类缓存的命中率等
+@app.get("/api/metrics")
+def get_metrics():
+    return {
+        "retrieval_cache": retrieval_cache.metrics(),
+        "retrievers": retrievers.metrics(),
+        "mcp_pool": mcp_pool.metrics(),
+        "tool_catalog": tool_catalog.metrics(),
+        "tool_result_cache": tool_result_cache.metrics(),
+        "agent": agent.metrics(),
+        "context_assembler": context_assembler.metrics(),
+        "summary_worker": summary_worker.metrics(),
+        "answer_cache": answer_cache.metrics(),
+        "search_backfill": search_backfill.metrics(),
+        "cluster": cluster.metrics(),
+        "admission": admission.metrics(),
+    }
+
+
 if __name__ == "__main__":
-    init_db()
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
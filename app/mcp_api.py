@@ -1,11 +1,11 @@
 from fastapi import APIRouter, HTTPException
-import sqlite3
+import db
 import requests
 import uuid
 import json
 from datetime import datetime
-from fastmcp import Client
-from fastmcp.client.transports import (PythonStdioTransport, SSETransport)
+from cluster import cluster
+from mcp_pool import mcp_pool
 
 router = APIRouter(prefix="/api/mcp", tags=["mcp"])
 
@@ -15,16 +15,17 @@ router = APIRouter(prefix="/api/mcp", tags=["mcp"])
 async def fetch_mcp_tools(server_url: str, auth_type: str, auth_value: str) -> list:
     try:
         #为什么能够从server_url拿到tools？因为url里面有端口，通过这个端口去找的mcp server拿的啊，哈哈！
-        async with Client(SSETransport(server_url)) as client: 
-            tools = await client.list_tools()
-            print("----------TOOLS:--------",tools)
+        # 通过会话池拉取，已有的长连接会话直接复用
+        tools = await mcp_pool.list_tools(server_url)
+        print("----------TOOLS:--------",tools)
         # Ensure tools have required fields
         return [
             {
                 "id": str(uuid.uuid4()),
                 "name": tool.name,
                 "description": tool.description,
-                "input_schema": json.dumps(tool.inputSchema)
+                "input_schema": json.dumps(tool.inputSchema),
+                "cache_ttl": _default_cache_ttl(tool)
             }
             for tool in tools
         ]
@@ -32,14 +33,52 @@ async def fetch_mcp_tools(server_url: str, auth_type: str, auth_value: str) -> l
         print(f"Error fetching tools from {server_url}: {str(e)}")
         return []
 
+# 服务器声明为有副作用（非只读或破坏性）的工具默认不缓存结果，其余使用默认有效期（NULL）
+def _default_cache_ttl(tool):
+    annotations = getattr(tool, "annotations", None)
+    if annotations is not None and (annotations.readOnlyHint is False or annotations.destructiveHint):
+        return 0
+    return None
+
+# 把拉取到的工具写入 mcp_tools，在 db.transaction 里调用
+def _insert_tools(conn, server_id: str, tools: list, cache_ttls: dict = None):
+    cache_ttls = cache_ttls or {}
+    conn.executemany(
+        '''
+        INSERT INTO mcp_tools (id, server_id, name, description, input_schema, cache_ttl, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''',
+        [
+            (
+                tool["id"],
+                server_id,
+                tool["name"],
+                tool["description"],
+                tool["input_schema"],
+                cache_ttls.get(tool["name"], tool.get("cache_ttl")),
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            )
+            for tool in tools
+        ]
+    )
+
+# 重新拉取工具后替换该服务器的工具列表，保留按工具名手动配置过的缓存有效期
+def _replace_tools(conn, server_id: str, tools: list):
+    cache_ttls = {
+        name: cache_ttl
+        for name, cache_ttl in conn.execute(
+            "SELECT name, cache_ttl FROM mcp_tools WHERE server_id = ? AND cache_ttl IS NOT NULL", (server_id,)
+        )
+    }
+    conn.execute("DELETE FROM mcp_tools WHERE server_id = ?", (server_id,))
+    _insert_tools(conn, server_id, tools, cache_ttls)
+
 # Create MCP server
 @router.post("/servers")
 async def create_mcp_server(server: dict):
     try:
         server_id = str(uuid.uuid4())
-        conn = sqlite3.connect('chat_history.db')
-        cursor = conn.cursor()
-        cursor.execute(
+        await db.execute(
             '''
             INSERT INTO mcp_servers (id, name, url, description, auth_type, auth_value, created_at, updated_at)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -55,27 +94,11 @@ async def create_mcp_server(server: dict):
                 datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             )
         )
-        conn.commit()
         
         # Fetch and store tools
         tools = await fetch_mcp_tools(server["url"], server.get("auth_type", "none"), server.get("auth_value", ""))
-        for tool in tools:
-            cursor.execute(
-                '''
-                INSERT INTO mcp_tools (id, server_id, name, description, input_schema, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''',
-                (
-                    tool["id"],
-                    server_id,
-                    tool["name"],
-                    tool["description"],
-                    tool["input_schema"],
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                )
-            )
-        conn.commit()
-        conn.close()
+        await db.transaction(_insert_tools, server_id, tools)
+        await cluster.publish("tool_catalog", server_id)
         return {"id": server_id, "message": "MCP server created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create MCP server: {str(e)}")
@@ -84,13 +107,7 @@ async def create_mcp_server(server: dict):
 @router.get("/servers")
 async def list_mcp_servers():
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, url, description, auth_type, auth_value, created_at, updated_at FROM mcp_servers")
-        servers = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return servers
+        return await db.fetchall("SELECT id, name, url, description, auth_type, auth_value, created_at, updated_at FROM mcp_servers")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list MCP servers: {str(e)}")
 
@@ -98,15 +115,12 @@ async def list_mcp_servers():
 @router.get("/servers/{server_id}")
 async def get_mcp_server(server_id: str):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, url, description, auth_type, auth_value, created_at, updated_at FROM mcp_servers WHERE id = ?", (server_id,))
-        server = cursor.fetchone()
-        conn.close()
+        server = await db.fetchone("SELECT id, name, url, description, auth_type, auth_value, created_at, updated_at FROM mcp_servers WHERE id = ?", (server_id,))
         if not server:
             raise HTTPException(status_code=404, detail="MCP server not found")
-        return dict(server)
+        return server
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get MCP server: {str(e)}")
 
@@ -114,55 +128,48 @@ async def get_mcp_server(server_id: str):
 @router.put("/servers/{server_id}")
 async def update_mcp_server(server_id: str, server: dict):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-            UPDATE mcp_servers
-            SET name = ?, url = ?, description = ?, auth_type = ?, auth_value = ?, updated_at = ?
-            WHERE id = ?
-            ''',
-            (
-                server["name"],
-                server["url"],
-                server.get("description", ""),
-                server.get("auth_type", "none"),
-                server.get("auth_value", ""),
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                server_id
-            )
-        )
-        if cursor.rowcount == 0:  #意思是没有查询到一条结果，而不是修改到了一条结果？
-            conn.close()
-            raise HTTPException(status_code=404, detail="MCP server not found")
-        
-        # Delete existing tools for this server # 如果更新到了mcp server,就把它下面的所有tool删除掉，然后重新拉取它下面的tool?? --对的，没错！
-        cursor.execute("DELETE FROM mcp_tools WHERE server_id = ?", (server_id,))
-        
-        # Fetch and store new tools
+        # 先拉取工具（网络请求），再在一个写事务里完成更新，避免拉取期间占着数据库写锁
+        old = await db.fetchone("SELECT url FROM mcp_servers WHERE id = ?", (server_id,))
         tools = await fetch_mcp_tools(server["url"], server.get("auth_type", "none"), server.get("auth_value", ""))
-        if len(tools) > 0 :
-            for tool in tools:
-                cursor.execute(
-                    '''
-                    INSERT INTO mcp_tools (id, server_id, name, description, input_schema,created_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ''',
-                    (
-                        tool["id"],
-                        server_id,
-                        tool["name"],
-                        tool["description"],
-                        tool["input_schema"],
-                        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    )
+
+        def _update(conn):
+            cursor = conn.execute(
+                '''
+                UPDATE mcp_servers
+                SET name = ?, url = ?, description = ?, auth_type = ?, auth_value = ?, updated_at = ?
+                WHERE id = ?
+                ''',
+                (
+                    server["name"],
+                    server["url"],
+                    server.get("description", ""),
+                    server.get("auth_type", "none"),
+                    server.get("auth_value", ""),
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    server_id
                 )
-            conn.commit()
-            conn.close()
+            )
+            if cursor.rowcount == 0:  #意思是没有查询到一条结果，而不是修改到了一条结果？
+                raise HTTPException(status_code=404, detail="MCP server not found")
+            if len(tools) == 0:
+                # 与原来的行为保持一致：拉取不到工具时不提交本次修改
+                conn.rollback()
+                return False
+            # Delete existing tools for this server and store new tools # 如果更新到了mcp server,就把它下面的所有tool删除掉，然后重新拉取它下面的tool?? --对的，没错！
+            _replace_tools(conn, server_id, tools)
+            return True
+
+        updated = await db.transaction(_update)
+        await cluster.publish("tool_catalog", server_id)
+        if updated and old and old["url"] != server["url"]:
+            # 地址变了，关闭指向旧地址的会话
+            await cluster.publish("mcp_pool", old["url"])
+        if updated:
             return {"message": "MCP server updated successfully"}
         else:
-            conn.close()
             return {"message": "MCP server updated, but no tools found"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update MCP server: {str(e)}")
 
@@ -170,17 +177,23 @@ async def update_mcp_server(server_id: str, server: dict):
 @router.delete("/servers/{server_id}")
 async def delete_mcp_server(server_id: str):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        cursor = conn.cursor()
-        # Delete associated tools
-        cursor.execute("DELETE FROM mcp_tools WHERE server_id = ?", (server_id,))
-        # Delete server
-        cursor.execute("DELETE FROM mcp_servers WHERE id = ?", (server_id,))
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="MCP server not found")
-        conn.commit()
-        conn.close()
+        server = await db.fetchone("SELECT url FROM mcp_servers WHERE id = ?", (server_id,))
+
+        def _delete(conn):
+            # Delete associated tools
+            conn.execute("DELETE FROM mcp_tools WHERE server_id = ?", (server_id,))
+            # Delete server
+            cursor = conn.execute("DELETE FROM mcp_servers WHERE id = ?", (server_id,))
+            if cursor.rowcount == 0:
+                raise HTTPException(status_code=404, detail="MCP server not found")
+
+        await db.transaction(_delete)
+        await cluster.publish("tool_catalog", server_id)
+        if server:
+            await cluster.publish("mcp_pool", server["url"])
         return {"message": "MCP server deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete MCP server: {str(e)}")
 
@@ -188,38 +201,18 @@ async def delete_mcp_server(server_id: str):
 @router.post("/servers/{server_id}/refresh-tools")
 async def refresh_mcp_server_tools(server_id: str):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT url, auth_type, auth_value FROM mcp_servers WHERE id = ?", (server_id,))
-        server = cursor.fetchone()
+        server = await db.fetchone("SELECT url, auth_type, auth_value FROM mcp_servers WHERE id = ?", (server_id,))
         if not server:
-            conn.close()
             raise HTTPException(status_code=404, detail="MCP server not found")
         
-        # Delete existing tools for this server
-        cursor.execute("DELETE FROM mcp_tools WHERE server_id = ?", (server_id,))
-        
-        # Fetch and store new tools
+        # Fetch new tools
         tools = await fetch_mcp_tools(server["url"], server["auth_type"], server["auth_value"])
-        for tool in tools:
-            cursor.execute(
-                '''
-                INSERT INTO mcp_tools (id, server_id, name, description, input_schema,created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''',
-                (
-                    tool["id"],
-                    server_id,
-                    tool["name"],
-                    tool["description"],
-                    tool["input_schema"],
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                )
-            )
-        conn.commit()
-        conn.close()
+
+        await db.transaction(_replace_tools, server_id, tools)
+        await cluster.publish("tool_catalog", server_id)
         return {"message": "Tools refreshed successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to refresh tools: {str(e)}")
 
@@ -227,34 +220,41 @@ async def refresh_mcp_server_tools(server_id: str):
 @router.get("/tools")
 async def list_tools(server_id: str = None):
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
         if server_id:
-            cursor.execute("SELECT * FROM mcp_tools WHERE server_id = ?", (server_id,))
+            tools = await db.fetchall("SELECT * FROM mcp_tools WHERE server_id = ?", (server_id,))
         else:
-            cursor.execute("SELECT * FROM mcp_tools")
-        # print("----------cursor.fetchall:-------",cursor)  #我加的，我就想看看cursor.fetchall()是什么？--要改成直接打印cursor,qq文档笔记里有解释
-        tools = [dict(row) for row in cursor.fetchall()]
-        # for row in cursor:
-        #     print("ddddddddddddd",dict(row))
-        conn.close()
+            tools = await db.fetchall("SELECT * FROM mcp_tools")
         #print("----------tools:-------",tools) #我加的，看看从db里面取出来是什么样的
         return tools
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to list tools: {str(e)}")
 
+# Set result cache TTL for a tool：cache_ttl 为秒数，0 表示不缓存（有副作用的工具），null 恢复默认值
+@router.put("/tools/{tool_id}/cache")
+async def update_tool_cache_policy(tool_id: str, policy: dict):
+    try:
+        cache_ttl = policy.get("cache_ttl")
+        if cache_ttl is not None and (not isinstance(cache_ttl, (int, float)) or cache_ttl < 0):
+            raise HTTPException(status_code=400, detail="cache_ttl must be a non-negative number or null")
+        tool = await db.fetchone("SELECT server_id FROM mcp_tools WHERE id = ?", (tool_id,))
+        if not tool:
+            raise HTTPException(status_code=404, detail="Tool not found")
+        await db.execute("UPDATE mcp_tools SET cache_ttl = ? WHERE id = ?", (cache_ttl, tool_id))
+        await cluster.publish("tool_catalog", tool["server_id"])
+        return {"message": "Tool cache policy updated successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update tool cache policy: {str(e)}")
+
 # Helper function to get MCP server details (used by process_stream_request)
 async def get_mcp_server_details(server_id: str) -> dict:
     try:
-        conn = sqlite3.connect('chat_history.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, url, auth_type, auth_value FROM mcp_servers WHERE id = ?", (server_id,))
-        server = cursor.fetchone()
-        conn.close()
+        server = await db.fetchone("SELECT id, name, url, auth_type, auth_value FROM mcp_servers WHERE id = ?", (server_id,))
         if not server:
             raise HTTPException(status_code=404, detail="MCP server not found")
-        return dict(server)
+        return server
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get MCP server: {str(e)}")
@@ -0,0 +1,280 @@
+# MCP 客户端会话池：每个 MCP 服务器保持长连接会话，工具调用复用已完成握手的会话
+# - 原来每次调用都新建 Client(SSETransport(url))，要付出一次 SSE 建连 + initialize 往返
+# - 每个服务器最多 MCP_POOL_SIZE 个会话（一个会话可以同时承载多个请求），并发调用数受 MCP_MAX_CONCURRENT_CALLS 限制，
+#   超出的调用按准入控制排队（最多 MCP_QUEUE_SIZE 个，最长等待 MCP_MAX_WAIT 秒），队列满或超时直接失败
+# - 后台定期 ping 空闲会话做健康检查，失败或空闲超过 MCP_IDLE_TIMEOUT 的会话被关闭
+# - 建连失败按指数退避（带随机抖动）重试；连续失败后在冷却期内快速失败，不拖住对话
+import asyncio
+import os
+import random
+import time
+
+import anyio
+from fastmcp import Client
+from fastmcp.client.transports import SSETransport
+
+from admission import admission
+
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "2"))
+MCP_MAX_CONCURRENT_CALLS = int(os.getenv("MCP_MAX_CONCURRENT_CALLS", "8"))
+MCP_QUEUE_SIZE = int(os.getenv("MCP_QUEUE_SIZE", str(MCP_MAX_CONCURRENT_CALLS * 4)))
+MCP_MAX_WAIT = float(os.getenv("MCP_MAX_WAIT", "5"))
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "5"))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "30"))
+MCP_IDLE_TIMEOUT = float(os.getenv("MCP_IDLE_TIMEOUT", "300"))
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+MCP_CONNECT_RETRIES = int(os.getenv("MCP_CONNECT_RETRIES", "2"))
+MCP_RECONNECT_BACKOFF = float(os.getenv("MCP_RECONNECT_BACKOFF", "0.2"))
+MCP_RECONNECT_MAX_BACKOFF = float(os.getenv("MCP_RECONNECT_MAX_BACKOFF", "30"))
+
+
+class MCPUnavailableError(Exception):
+    pass
+
+
+class PooledSession:
+    """
+    一个长连接的 MCP 会话。
+    SSE 客户端内部的任务组必须在同一个任务里进入和退出，所以会话由专门的后台任务持有，
+    调用方只通过 client 发请求，关闭时通知后台任务退出。
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = None
+        self.in_flight = 0
+        self.broken = False
+        self.last_used = time.monotonic()
+        self._ready = None
+        self._closing = None
+        self._task = None
+
+    @property
+    def alive(self) -> bool:
+        return self.client is not None and not self.broken and not self._task.done()
+
+    async def connect(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        self._ready = loop.create_future()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _run(self):
+        try:
+            async with Client(SSETransport(self.url)) as client:
+                self.client = client
+                self._ready.set_result(None)
+                await self._closing.wait()
+        except BaseException as e:
+            if not self._ready.done():
+                self._ready.set_exception(e if isinstance(e, Exception) else MCPUnavailableError("连接被取消"))
+                # 建连失败由 connect() 处理，这里标记异常已读取
+                self._ready.exception()
+            elif not isinstance(e, asyncio.CancelledError):
+                print(f"MCP 会话断开 {self.url}: {str(e)}")
+        finally:
+            self.client = None
+
+    async def close(self):
+        if self._task is None or self._task.done():
+            return
+        self._closing.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), 2)
+        except Exception:
+            self._task.cancel()
+
+
+class ServerPool:
+    def __init__(self, url: str, size: int, max_concurrent: int):
+        self.url = url
+        self.size = size
+        self.sessions = []
+        self.limit = admission.resource(f"mcp:{url}", max_concurrent, MCP_QUEUE_SIZE, MCP_MAX_WAIT)
+        self._connect_lock = asyncio.Lock()
+        self.failures = 0
+        self.retry_at = 0.0
+        # 后台关闭中的会话，保留引用直到关闭完成
+        self._closing = set()
+
+    def _backoff(self) -> float:
+        # full jitter，上限 MCP_RECONNECT_MAX_BACKOFF
+        return random.uniform(0, min(MCP_RECONNECT_MAX_BACKOFF, MCP_RECONNECT_BACKOFF * (2 ** self.failures)))
+
+    def _pick(self):
+        alive = [s for s in self.sessions if s.alive]
+        self.sessions = alive
+        if not alive:
+            return None
+        session = min(alive, key=lambda s: s.in_flight)
+        # 所有会话都在忙且还没到上限时再开一个
+        if session.in_flight > 0 and len(alive) < self.size:
+            return None
+        return session
+
+    async def acquire(self, stats: dict) -> PooledSession:
+        session = self._pick()
+        if session is not None:
+            stats["reuses"] += 1
+            return session
+        async with self._connect_lock:
+            session = self._pick()
+            if session is not None:
+                stats["reuses"] += 1
+                return session
+            if time.monotonic() < self.retry_at:
+                if self.sessions:
+                    return min(self.sessions, key=lambda s: s.in_flight)
+                raise MCPUnavailableError(f"MCP 服务器 {self.url} 暂时不可用，稍后重试")
+            # 已有会话、只是想扩容时只尝试一次，失败就继续用已有会话
+            retries = 0 if self.sessions else MCP_CONNECT_RETRIES
+            for attempt in range(retries + 1):
+                session = PooledSession(self.url)
+                try:
+                    await session.connect(MCP_CONNECT_TIMEOUT)
+                except Exception as e:
+                    self.failures += 1
+                    stats["connect_failures"] += 1
+                    print(f"连接 MCP 服务器失败 {self.url}（第{attempt + 1}次）: {type(e).__name__} {str(e)}")
+                    if attempt < retries:
+                        await asyncio.sleep(self._backoff())
+                    continue
+                self.failures = 0
+                self.retry_at = 0.0
+                self.sessions.append(session)
+                stats["connects"] += 1
+                return session
+            # 重试用完：进入冷却期，期间的调用直接失败或使用已有会话
+            self.retry_at = time.monotonic() + self._backoff()
+            if self.sessions:
+                return min(self.sessions, key=lambda s: s.in_flight)
+            raise MCPUnavailableError(f"无法连接 MCP 服务器 {self.url}")
+
+    def discard(self):
+        sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.broken = True
+            task = asyncio.create_task(session.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def close(self):
+        sessions, self.sessions = self.sessions, []
+        await asyncio.gather(*(s.close() for s in sessions))
+
+
+class MCPPool:
+    def __init__(self, size: int = None, max_concurrent: int = None):
+        self.size = size or MCP_POOL_SIZE
+        self.max_concurrent = max_concurrent or MCP_MAX_CONCURRENT_CALLS
+        self._servers = {}
+        self._janitor = None
+        self.stats = {"calls": 0, "errors": 0, "connects": 0, "reuses": 0, "reconnects": 0, "connect_failures": 0,
+                      "evicted_idle": 0, "evicted_unhealthy": 0}
+
+    def start(self):
+        if self._janitor is None:
+            self._janitor = asyncio.create_task(self._maintain())
+
+    def _server(self, url: str) -> ServerPool:
+        pool = self._servers.get(url)
+        if pool is None:
+            pool = self._servers[url] = ServerPool(url, self.size, self.max_concurrent)
+        return pool
+
+    async def _run(self, url: str, operation, timeout: float = None):
+        pool = self._server(url)
+        async with admission.slot(pool.limit):
+            self.stats["calls"] += 1
+            # 服务器重启后，旧会话要到写请求时才发现连接已断（请求没有发出去），换一个新会话重试一次
+            for attempt in range(2):
+                session = await pool.acquire(self.stats)
+                client = session.client
+                try:
+                    if client is None:
+                        raise anyio.ClosedResourceError()
+                    session.in_flight += 1
+                    try:
+                        return await asyncio.wait_for(operation(client), timeout or MCP_CALL_TIMEOUT)
+                    finally:
+                        session.in_flight -= 1
+                        session.last_used = time.monotonic()
+                except (anyio.ClosedResourceError, anyio.BrokenResourceError):
+                    # 一个会话断开通常意味着服务器重启过，同一服务器的其他会话也不再可用
+                    pool.discard()
+                    self.stats["reconnects"] += 1
+                    if attempt == 1:
+                        self.stats["errors"] += 1
+                        raise MCPUnavailableError(f"MCP 服务器 {url} 的会话已断开")
+                except Exception:
+                    self.stats["errors"] += 1
+                    raise
+
+    async def call_tool(self, url: str, name: str, arguments: dict = None, timeout: float = None):
+        return await self._run(url, lambda client: client.call_tool(name, arguments or {}), timeout)
+
+    async def list_tools(self, url: str, timeout: float = None):
+        return await self._run(url, lambda client: client.list_tools(), timeout)
+
+    async def evict(self, url: str):
+        """服务器被修改或删除时调用，关闭指向旧地址的会话"""
+        pool = self._servers.pop(url, None)
+        if pool is not None:
+            admission.forget(pool.limit.name)
+            await pool.close()
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(MCP_HEALTH_CHECK_INTERVAL)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"MCP 会话池巡检出错: {str(e)}")
+
+    async def check(self):
+        """关闭空闲太久的会话，ping 其余空闲会话，失败的关闭（下次调用时重连）"""
+        now = time.monotonic()
+        for pool in list(self._servers.values()):
+            for session in list(pool.sessions):
+                if session.in_flight:
+                    continue
+                if not session.alive:
+                    pool.sessions.remove(session)
+                elif now - session.last_used > MCP_IDLE_TIMEOUT:
+                    pool.sessions.remove(session)
+                    self.stats["evicted_idle"] += 1
+                    await session.close()
+                else:
+                    try:
+                        await asyncio.wait_for(session.client.ping(), MCP_CONNECT_TIMEOUT)
+                    except Exception as e:
+                        print(f"MCP 会话健康检查失败 {pool.url}: {type(e).__name__}")
+                        if session in pool.sessions:
+                            pool.sessions.remove(session)
+                        self.stats["evicted_unhealthy"] += 1
+                        await session.close()
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "servers": {
+                url: {"sessions": len(pool.sessions), "in_flight": sum(s.in_flight for s in pool.sessions),
+                      "connect_failures": pool.failures}
+                for url, pool in self._servers.items()
+            },
+        }
+
+    async def close(self):
+        if self._janitor is not None:
+            self._janitor.cancel()
+            self._janitor = None
+        pools, self._servers = list(self._servers.values()), {}
+        await asyncio.gather(*(pool.close() for pool in pools))
+
+
+mcp_pool = MCPPool()
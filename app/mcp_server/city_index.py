@@ -0,0 +1,112 @@
+# 天气服务的城市编码索引：city_codes.tsv 在导入时只加载一次
+# - 按省份和城市名建索引，另外保存按城市名排序的列表，用二分查找做前缀匹配（"浦东" -> "浦东新区"）
+# - 省份支持简称和带后缀的写法（"京"、"北京市"、"内蒙古自治区"），城市支持去掉 区/县/市/旗 后缀和常见全称别名
+# - 不指定省份或省份不对时在全部城市里查；同名城市有多个时返回全部候选，由调用方提示指定省份，不再默认回退到海淀
+import bisect
+import os
+
+CITY_CODES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "city_codes.tsv")
+
+PROVINCE_ALIASES = {
+    "京": "北京", "沪": "上海", "津": "天津", "渝": "重庆",
+    "吉": "吉林", "辽": "辽宁", "黑": "黑龙江", "蒙": "内蒙古", "内蒙": "内蒙古",
+}
+PROVINCE_SUFFIXES = ("自治区", "省", "市")
+
+# 全称或旧称 -> 编码表里的名称
+CITY_ALIASES = {
+    "蓟县": "蓟州", "大兴安岭地区": "大兴安岭", "延边朝鲜族自治州": "延边",
+    "察哈尔右翼前旗": "察右前旗", "察哈尔右翼中旗": "察右中旗", "察哈尔右翼后旗": "察右后旗",
+    "土默特右旗": "土右旗", "土默特左旗": "土左旗", "达尔罕茂明安联合旗": "达茂旗",
+    "和林格尔": "和林", "托克托": "托县", "喀喇沁左翼": "喀左", "前郭尔罗斯": "前郭",
+}
+CITY_SUFFIXES = ("自治县", "区", "县", "市", "旗")
+
+
+def _strip_suffix(name: str, suffixes: tuple) -> str:
+    for suffix in suffixes:
+        if name.endswith(suffix) and len(name) > len(suffix) + 1:
+            return name[:-len(suffix)]
+    return name
+
+
+class CityIndex:
+    def __init__(self, path: str = None):
+        # 省份 -> {城市: 编码}；编码表里同一省份的重名城市以后出现的为准
+        self.by_province = {}
+        with open(path or CITY_CODES_PATH, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                province, city, code = line.rstrip("\n").split("\t")
+                self.by_province.setdefault(province, {})[city] = code
+        # (城市, 省份)，按城市名排序，用于前缀匹配
+        self._sorted = sorted((city, province) for province, cities in self.by_province.items() for city in cities)
+        self._keys = [city for city, _ in self._sorted]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def province(self, name: str):
+        """省份的规范名称，不认识时返回 None"""
+        name = (name or "").strip()
+        if name in self.by_province:
+            return name
+        name = PROVINCE_ALIASES.get(name, name)
+        name = _strip_suffix(name, PROVINCE_SUFFIXES)
+        name = PROVINCE_ALIASES.get(name, name)
+        return name if name in self.by_province else None
+
+    def resolve(self, province: str, city: str) -> list:
+        """返回匹配的 [(省份, 城市, 编码)]：先精确匹配（包括别名和去后缀），再前缀匹配；没有匹配时返回空列表"""
+        canonical = self.province(province)
+        city = (city or "").strip()
+        if not city:
+            # 只给了省份（"北京"、"上海"）：取同名的城市
+            city = canonical or ""
+        names = []
+        for name in (city, CITY_ALIASES.get(city), _strip_suffix(city, CITY_SUFFIXES)):
+            if name and name not in names:
+                names.append(name)
+        if not names:
+            return []
+        scopes = [[canonical]] if canonical else []
+        # 省份不对时也在全部城市里查
+        scopes.append(list(self.by_province))
+        for provinces in scopes:
+            for name in names:
+                hits = [(p, name, self.by_province[p][name]) for p in provinces if name in self.by_province[p]]
+                if hits:
+                    return hits
+            for name in names:
+                hits = [(p, c, self.by_province[p][c]) for c, p in self._prefixed(name) if p in provinces]
+                if hits:
+                    return hits
+        return []
+
+    def resolve_text(self, text: str) -> list:
+        """不分开省份和城市的写法（"北京海淀"、"辽宁省大连市"、"哈尔滨"）"""
+        text = (text or "").strip()
+        for province in sorted(self.by_province, key=len, reverse=True):
+            if text.startswith(province) and text != province:
+                rest = text[len(province):]
+                for suffix in PROVINCE_SUFFIXES:
+                    if rest.startswith(suffix) and len(rest) > len(suffix):
+                        rest = rest[len(suffix):]
+                        break
+                hits = self.resolve(province, rest)
+                if hits:
+                    return hits
+        return self.resolve("", text)
+
+    def _prefixed(self, prefix: str) -> list:
+        start = bisect.bisect_left(self._keys, prefix)
+        hits = []
+        for city, province in self._sorted[start:]:
+            if not city.startswith(prefix):
+                break
+            hits.append((city, province))
+        return hits
+
+
+city_index = CityIndex()
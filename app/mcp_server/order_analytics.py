@@ -0,0 +1,174 @@
+# 订单分析层：order_service 的工具不再每次全表扫描 orders
+# - 按月、客户、产品、销售员四张汇总表，由 orders 上的触发器在写订单的同一个事务里增量维护，
+#   无论订单由哪个程序写入，汇总都保持一致；工具查询只读汇总表（按主键或汇总值索引），和订单总量无关
+# - 月份汇总按 (年, 月) 保存，不再把不同年份的同一个月混在一起；时间按 UTC 计算，与原来的 strftime 一致
+# - orders 上建 (create_time, price) 索引，汇总表尚未建立时，月销售额用 create_time 范围条件走索引查询
+# - 第一次启动时在一个写事务里创建触发器并全量生成汇总（只执行一次），之后完全增量
+import calendar
+import sqlite3
+from datetime import datetime, timezone
+
+# 汇总表：表名 -> 汇总维度（orders 的列）
+ROLLUPS = {
+    "order_rollup_customer": "customer_name",
+    "order_rollup_product": "product_name",
+    "order_rollup_sales": "sales_name",
+}
+
+_MONTH_KEY = "CAST(strftime('%Y', {row}.create_time, 'unixepoch') AS INTEGER), " \
+             "CAST(strftime('%m', {row}.create_time, 'unixepoch') AS INTEGER)"
+
+SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS idx_orders_create_time ON orders (create_time, price)",
+    """CREATE TABLE IF NOT EXISTS order_rollup_month (
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        total_sales REAL NOT NULL,
+        order_count INTEGER NOT NULL,
+        PRIMARY KEY (year, month)
+    )""",
+    "CREATE TABLE IF NOT EXISTS order_rollup_state (built_at TEXT NOT NULL)",
+]
+for _table, _column in ROLLUPS.items():
+    SCHEMA += [
+        f"""CREATE TABLE IF NOT EXISTS {_table} (
+            {_column} TEXT PRIMARY KEY,
+            total_sales REAL NOT NULL,
+            order_count INTEGER NOT NULL
+        )""",
+        f"CREATE INDEX IF NOT EXISTS idx_{_table}_total_sales ON {_table} (total_sales)",
+        f"CREATE INDEX IF NOT EXISTS idx_{_table}_order_count ON {_table} (order_count)",
+    ]
+
+
+def _apply(row: str, sign: str) -> list:
+    """把一行订单（NEW 或 OLD）按 sign（+ 或 -）计入所有汇总表的语句"""
+    statements = [
+        f"""INSERT INTO order_rollup_month (year, month, total_sales, order_count)
+            VALUES ({_MONTH_KEY.format(row=row)}, {sign}{row}.price, {sign}1)
+            ON CONFLICT (year, month) DO UPDATE SET
+                total_sales = total_sales + excluded.total_sales, order_count = order_count + excluded.order_count""",
+    ]
+    for table, column in ROLLUPS.items():
+        statements.append(
+            f"""INSERT INTO {table} ({column}, total_sales, order_count) VALUES ({row}.{column}, {sign}{row}.price, {sign}1)
+                ON CONFLICT ({column}) DO UPDATE SET
+                    total_sales = total_sales + excluded.total_sales, order_count = order_count + excluded.order_count"""
+        )
+    if sign == "-":
+        # 最后一笔订单被删掉（或改到别的维度）后删除汇总行，和直接 GROUP BY 的结果一致
+        statements.append(
+            f"DELETE FROM order_rollup_month WHERE (year, month) = ({_MONTH_KEY.format(row=row)}) AND order_count <= 0"
+        )
+        statements.extend(f"DELETE FROM {table} WHERE {column} = OLD.{column} AND order_count <= 0"
+                          for table, column in ROLLUPS.items())
+    return statements
+
+
+def _trigger(name: str, event: str, body: list) -> str:
+    return f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON orders BEGIN\n" + \
+        ";\n".join(body) + ";\nEND"
+
+
+TRIGGERS = [
+    _trigger("trg_orders_rollup_insert", "INSERT", _apply("NEW", "+")),
+    _trigger("trg_orders_rollup_delete", "DELETE", _apply("OLD", "-")),
+    _trigger("trg_orders_rollup_update",
+             "UPDATE OF price, create_time, " + ", ".join(ROLLUPS.values()),
+             _apply("OLD", "-") + _apply("NEW", "+")),
+]
+
+
+def rollups_ready(conn: sqlite3.Connection) -> bool:
+    try:
+        return conn.execute("SELECT 1 FROM order_rollup_state").fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+
+def prepare(conn: sqlite3.Connection):
+    """创建索引和汇总表；汇总还没建立时，在同一个写事务里创建触发器并全量生成，保证不漏算也不重复"""
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    if rollups_ready(conn):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM order_rollup_state").fetchone() is None:
+            for trigger in TRIGGERS:
+                conn.execute(trigger)
+            conn.execute("DELETE FROM order_rollup_month")
+            conn.execute(f"""
+                INSERT INTO order_rollup_month (year, month, total_sales, order_count)
+                SELECT {_MONTH_KEY.format(row="orders")}, SUM(price), COUNT(*)
+                FROM orders GROUP BY 1, 2
+            """)
+            for table, column in ROLLUPS.items():
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"""
+                    INSERT INTO {table} ({column}, total_sales, order_count)
+                    SELECT {column}, SUM(price), COUNT(*) FROM orders GROUP BY {column}
+                """)
+            conn.execute("INSERT INTO order_rollup_state (built_at) VALUES (?)",
+                         (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def month_range(year: int, month: int) -> tuple:
+    """某年某月（UTC）的 [开始, 结束) 时间戳，用于 create_time 上的范围条件"""
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = start.replace(day=calendar.monthrange(year, month)[1])
+    return int(start.timestamp()), int(end.timestamp()) + 86400
+
+
+def latest_year_for_month(conn: sqlite3.Connection, month: int):
+    """没有指定年份时，取有这个月份数据的最近一年"""
+    if rollups_ready(conn):
+        row = conn.execute(
+            "SELECT year FROM order_rollup_month WHERE month = ? ORDER BY year DESC LIMIT 1", (month,)
+        ).fetchone()
+        return row[0] if row else None
+    # 汇总未建立：从最新的订单往前按年检查，每次都是索引上的范围查询
+    row = conn.execute("SELECT MIN(create_time), MAX(create_time) FROM orders").fetchone()
+    if row[0] is None:
+        return None
+    first = datetime.fromtimestamp(row[0], timezone.utc).year
+    for year in range(datetime.fromtimestamp(row[1], timezone.utc).year, first - 1, -1):
+        start, end = month_range(year, month)
+        if conn.execute("SELECT 1 FROM orders WHERE create_time >= ? AND create_time < ? LIMIT 1",
+                        (start, end)).fetchone():
+            return year
+    return None
+
+
+def monthly_sales(conn: sqlite3.Connection, year: int, month: int):
+    """返回 (销售总额, 订单数)，没有订单时返回 None"""
+    if rollups_ready(conn):
+        row = conn.execute(
+            "SELECT total_sales, order_count FROM order_rollup_month WHERE year = ? AND month = ?", (year, month)
+        ).fetchone()
+        return tuple(row) if row else None
+    start, end = month_range(year, month)
+    row = conn.execute(
+        "SELECT SUM(price), COUNT(*) FROM orders WHERE create_time >= ? AND create_time < ?", (start, end)
+    ).fetchone()
+    return tuple(row) if row[1] else None
+
+
+def top(conn: sqlite3.Connection, table: str, order_by: str, limit: int = 1) -> list:
+    """汇总表里按 total_sales 或 order_count 排名的前 limit 项：[(名称, 销售总额, 订单数)]"""
+    column = ROLLUPS[table]
+    if order_by not in ("total_sales", "order_count"):
+        raise ValueError(f"不支持的排序: {order_by}")
+    if rollups_ready(conn):
+        return conn.execute(
+            f"SELECT {column}, total_sales, order_count FROM {table} ORDER BY {order_by} DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return conn.execute(
+        f"SELECT {column}, SUM(price) AS total_sales, COUNT(*) AS order_count FROM orders "
+        f"GROUP BY {column} ORDER BY {order_by} DESC LIMIT ?", (limit,)
+    ).fetchall()
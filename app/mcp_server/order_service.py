@@ -1,84 +1,90 @@
 from fastmcp import FastMCP
+import os
 import sqlite3
 
-# 数据库连接
-conn = sqlite3.connect('/app/chat_history.db')
-cursor = conn.cursor()
+from mcp_server import order_analytics
+from mcp_server.read_pool import ReadOnlyPool
+
+ORDER_DB_PATH = os.getenv("ORDER_DB_PATH", "/app/chat_history.db")
+# 分析副本：设置后工具只读这个文件（需要由外部定期从主库复制，例如 sqlite3 .backup），不设置时读主库
+ORDER_REPLICA_PATH = os.getenv("ORDER_REPLICA_PATH") or ORDER_DB_PATH
+ORDER_DB_POOL_SIZE = int(os.getenv("ORDER_DB_POOL_SIZE", "8"))
+
+
+def _prepare():
+    # 启动时用一条短暂的读写连接：切换到 WAL（读不阻塞写），建索引和汇总表（第一次启动时全量生成汇总，
+    # 之后由触发器增量维护）；之后工具只用只读连接
+    try:
+        conn = sqlite3.connect(ORDER_DB_PATH)
+    except sqlite3.Error as e:
+        print(f"打开订单库失败: {str(e)}")
+        return
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        order_analytics.prepare(conn)
+    except sqlite3.Error as e:
+        # 主库只读等情况：工具仍然可用，汇总未建立时退回索引上的聚合查询
+        print(f"建立订单汇总失败: {str(e)}")
+    finally:
+        conn.close()
+
+
+_prepare()
+pool = ReadOnlyPool(ORDER_REPLICA_PATH, ORDER_DB_POOL_SIZE)
 
 # 创建 FastMCP 服务器
 mcp = FastMCP("order service mcp", host="0.0.0.0", port=9002 )
 
 
-@mcp.tool(description="获取指定月份的销售总额")
-def get_monthly_sales_total(month: int) -> str:
+def _money(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def _monthly_sales_total(conn, month: int, year: int = None) -> str:
+    if year is None:
+        year = order_analytics.latest_year_for_month(conn, month)
+        if year is None:
+            return f"{month}月没有销售记录"
+
+    # 按 (年, 月) 读汇总表；汇总未建立时用 create_time 的范围条件走索引
+    result = order_analytics.monthly_sales(conn, year, month)
+
+    # 处理查询结果
+    if result is None:
+        return f"{year}年{month}月没有销售记录"
+    return f"{year}年{month}月的销售总额：{_money(result[0])}（{result[1]}笔订单）"
+
+
+@mcp.tool(description="获取指定月份的销售总额，year 为空时取有该月数据的最近一年")
+async def get_monthly_sales_total(month: int, year: int = None) -> str:
     # 验证月份参数
     if not (1 <= month <= 12):
         return "无效的月份"
-    
-    # 将整数月份转换为两位数字字符串（如 1 -> '01'）
-    month_str = f"{month:02d}"
-    
-    # 参数化查询
-    query = """
-    SELECT SUM(price) as total_sales
-    FROM orders
-    WHERE strftime('%m', datetime(create_time, 'unixepoch')) = ?
-    """
-    cursor.execute(query, (month_str,))
-    result = cursor.fetchone()
-    
-    # 处理查询结果
-    if result[0] is None:
-        return f"{month}月没有销售记录"
-    return f"{month}月的销售总额：{result[0]}"
+    return await pool.run(_monthly_sales_total, month, year)
  
 
 @mcp.tool(description="获取消费最高的用户")
-def get_highest_spending_customer() -> str:
-    query = """
-    SELECT customer_name, SUM(price) as total_consumption
-    FROM orders
-    GROUP BY customer_name
-    ORDER BY total_consumption DESC
-    LIMIT 1
-    """
-    cursor.execute(query)
-    result = cursor.fetchone()
-    if result is None:
+async def get_highest_spending_customer() -> str:
+    result = await pool.run(order_analytics.top, "order_rollup_customer", "total_sales")
+    if not result:
         return "未找到客户记录"
-    return f"消费最高的用户：{result[0]}，总消费额 {result[1]}"
+    return f"消费最高的用户：{result[0][0]}，总消费额 {_money(result[0][1])}"
 
 # 工具 3：获取最受欢迎的产品（基于订单数量）
 @mcp.tool(description="获取最受欢迎的产品（基于订单数量）")
-def get_most_popular_product() -> str:
-    query = """
-    SELECT product_name, COUNT(*) as order_count
-    FROM orders
-    GROUP BY product_name
-    ORDER BY order_count DESC
-    LIMIT 1
-    """
-    cursor.execute(query)
-    result = cursor.fetchone()
-    if result is None:
+async def get_most_popular_product() -> str:
+    result = await pool.run(order_analytics.top, "order_rollup_product", "order_count")
+    if not result:
         return "未找到产品记录"
-    return f"最受欢迎的产品：{result[0]}，订单数量 {result[1]}"
+    return f"最受欢迎的产品：{result[0][0]}，订单数量 {result[0][2]}"
 
 # 工具 4：获取销售员排行榜（基于总销售额）
 @mcp.tool(description="获取销售员排行榜（基于总销售额）")
-def get_salesperson_ranking(limit: int = 10) -> str:
-    query = f"""
-    SELECT sales_name, SUM(price) as total_sales
-    FROM orders
-    GROUP BY sales_name
-    ORDER BY total_sales DESC
-    LIMIT ?
-    """
-    cursor.execute(query, (limit,))
-    results = cursor.fetchall()
+async def get_salesperson_ranking(limit: int = 10) -> str:
+    results = await pool.run(order_analytics.top, "order_rollup_sales", "total_sales", limit)
     if not results:
         return "未找到销售员记录"
-    ranking = "销售员排行榜：\n" + "\n".join([f"{name}: {sales}" for name, sales in results])
+    ranking = "销售员排行榜：\n" + "\n".join([f"{name}: {_money(sales)}" for name, sales, _ in results])
     return ranking
 
 
@@ -0,0 +1,47 @@
+# MCP 服务的只读数据库访问：代替模块级的单个 sqlite3 连接 + 共享 cursor
+# - 连接以 URI mode=ro 打开，只能读；有上限的连接池 + 专用线程池，工具改成 async 后并发调用互不阻塞，也不会共用同一个连接
+# - 每次调用在一个读事务里执行，WAL 模式下看到的是开始时的一致快照，既不阻塞聊天服务的写入，也不会被写入阻塞
+# - 可以指向单独的分析副本文件（例如用 sqlite3 .backup 定期从主库复制），分析查询完全不碰主库
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
+
+from db import ConnectionPool
+
+MCP_DB_BUSY_TIMEOUT_MS = int(os.getenv("MCP_DB_BUSY_TIMEOUT_MS", "5000"))
+# 负数表示以KB为单位
+MCP_DB_CACHE_SIZE = int(os.getenv("MCP_DB_CACHE_SIZE", "-16000"))
+
+
+def connect_read_only(path: str) -> sqlite3.Connection:
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=MCP_DB_BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA cache_size={MCP_DB_CACHE_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={MCP_DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+class ReadOnlyPool:
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._pool = ConnectionPool(path, size, factory=connect_read_only)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="mcp-read")
+
+    def _snapshot(self, fn, args):
+        with self._pool.connection() as conn:
+            # 显式开启读事务：fn 里的多条查询读到同一个快照，结束时由连接池回滚
+            conn.execute("BEGIN")
+            return fn(conn, *args)
+
+    async def run(self, fn, *args):
+        """在读线程里用一条只读连接、在一个快照内执行 fn(conn, *args)"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(self._snapshot, fn, args))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._pool.close()
@@ -0,0 +1,194 @@
+# 对话消息的后写(write-behind)日志
+# 请求只把"对话轮次"放进内存队列就返回；唯一的写任务按刷新窗口把多个会话的轮次合并成一个事务提交（组提交），
+# 每个窗口只付出一次 fsync。调用方拿到的 future 可以用来等待数据真正落库（读己之写）。
+# 未落库的会话只在本进程内可见：多进程部署时，上一轮由另一个进程处理、还在它的队列里的会话，
+# session_exists 在数据库里查不到时等过刷新窗口再查，避免同一个会话被当成新会话
+import asyncio
+import os
+from datetime import datetime
+
+import chat_search
+import db
+
+# 刷新窗口：第一条轮次入队后最多再等待这么久，把这段时间内到达的轮次一起提交
+MESSAGE_LOG_FLUSH_MS = float(os.getenv("MESSAGE_LOG_FLUSH_MS", "10"))
+# 单个事务最多包含的轮次数
+MESSAGE_LOG_MAX_BATCH = int(os.getenv("MESSAGE_LOG_MAX_BATCH", "500"))
+# 带了会话 id 但查不到时继续等待其他进程落库的时间（毫秒）；单进程部署时本进程的队列就是全部，不需要等待
+MESSAGE_LOG_LOOKUP_GRACE_MS = float(os.getenv(
+    "MESSAGE_LOG_LOOKUP_GRACE_MS", "200" if int(os.getenv("APP_WORKERS", "1")) > 1 else "0"
+))
+
+
+class MessageLog:
+    def __init__(self, flush_interval: float = None, max_batch: int = None):
+        self.flush_interval = MESSAGE_LOG_FLUSH_MS / 1000 if flush_interval is None else flush_interval
+        self.max_batch = max_batch or MESSAGE_LOG_MAX_BATCH
+        self.batches = 0
+        self.turns = 0
+        self._queue = None
+        self._task = None
+        self._last_handle = None
+        # 尚未落库的会话 -> 该会话最后一个轮次的 future
+        self._pending = {}
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._writer())
+
+    def append_turn(self, session_id: str, query: str, response: str, new_session: bool = False, summary: str = None) -> asyncio.Future:
+        """入队一轮对话（用户问题 + 助手回答），返回"已落库"句柄"""
+        self.start()
+        handle = asyncio.get_running_loop().create_future()
+        # 每轮只格式化一次时间
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._queue.put_nowait((session_id, query, response, new_session, summary, now, handle))
+        self._last_handle = handle
+        self._pending[session_id] = handle
+        handle.add_done_callback(lambda _: self._forget(session_id, handle))
+        return handle
+
+    def _forget(self, session_id: str, handle: asyncio.Future):
+        # 写入失败时已经打印过错误，这里标记异常已读取，避免无人等待时的告警
+        handle.exception()
+        if self._pending.get(session_id) is handle:
+            del self._pending[session_id]
+
+    def has_pending_session(self, session_id: str) -> bool:
+        """会话已创建但还在队列里未落库"""
+        return session_id in self._pending
+
+    async def session_exists(self, session_id: str) -> bool:
+        """会话已落库，或者已创建还在本进程的队列里；查不到时在 MESSAGE_LOG_LOOKUP_GRACE_MS 内重试"""
+        if not session_id:
+            return False
+        if self.has_pending_session(session_id):
+            return True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + MESSAGE_LOG_LOOKUP_GRACE_MS / 1000
+        while True:
+            if await db.fetchone("SELECT id FROM chat_sessions WHERE id = ?", (session_id,)):
+                return True
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(self.flush_interval or 0.01, remaining))
+
+    async def wait_persisted(self, session_id: str = None):
+        """等待指定会话（不指定则为目前为止所有会话）已入队的轮次全部落库"""
+        handle = self._pending.get(session_id) if session_id else self._last_handle
+        if handle is not None and not handle.done():
+            await asyncio.shield(handle)
+
+    async def stop(self):
+        """关闭前调用：把队列里剩下的轮次全部写完并做一次检查点，保证落盘"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        await db.checkpoint()
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        try:
+            await db.transaction(_write_turns, batch)
+            error = None
+        except Exception as e:
+            print(f"批量写入消息失败，改为逐条写入: {str(e)}")
+            error = e
+        if error is not None:
+            # 一条坏数据不能拖垮整批：逐条重试，只让失败的那一轮报错
+            for turn in batch:
+                try:
+                    await db.transaction(_write_turns, [turn])
+                    _resolve(turn[-1])
+                except Exception as e:
+                    print(f"写入消息失败, session_id: {turn[0]}, 错误: {str(e)}")
+                    _resolve(turn[-1], e)
+        else:
+            for turn in batch:
+                _resolve(turn[-1])
+        self.batches += 1
+        self.turns += len(batch)
+
+
+def _resolve(handle: asyncio.Future, error: Exception = None):
+    if handle.done():
+        return
+    if error is None:
+        handle.set_result(None)
+    else:
+        handle.set_exception(error)
+
+
+def _write_turns(conn, batch: list):
+    sessions = []
+    messages = []
+    updates = []
+    for session_id, query, response, new_session, summary, now, _ in batch:
+        if new_session:
+            sessions.append((session_id, summary, now, now))
+        else:
+            updates.append((now, session_id))
+        messages.append((session_id, "user", query, now))
+        messages.append((session_id, "assistant", response, now))
+    if sessions:
+        conn.executemany(
+            '''
+            INSERT INTO chat_sessions (id, summary, created_at, updated_at)
+            VALUES (?, ?, ?, ?)
+            ''',
+            sessions
+        )
+    conn.executemany(
+        '''
+        INSERT INTO messages (session_id, role, content, created_at)
+        VALUES (?, ?, ?, ?)
+        ''',
+        messages
+    )
+    # 写连接是唯一的写入者，同一事务里插入的消息 id 连续，最后一条是 last_insert_rowid()
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    first_id = last_id - len(messages) + 1
+    chat_search.index_messages(conn, [
+        (first_id + i, session_id, role, content) for i, (session_id, role, content, _) in enumerate(messages)
+    ])
+    if updates:
+        conn.executemany(
+            '''
+            UPDATE chat_sessions
+            SET updated_at = ?
+            WHERE id = ?
+            ''',
+            updates
+        )
+
+
+message_log = MessageLog()
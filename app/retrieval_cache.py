@@ -0,0 +1,234 @@
+# 检索结果缓存：网络搜索、ES 搜索等检索后端共用
+# - 键：后端名 + 归一化后的查询 + 参数（索引、条数、字段等）
+# - 内存层：TTL + LRU 淘汰，总大小受内存预算限制
+# - singleflight：同一个键的并发请求只打一次后端，其他请求等待同一个结果
+# - 可插拔的持久层（如 SQLiteCacheTier），重启后仍能命中；SQLite 持久层定期清理过期条目，条目数有上限
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+RETRIEVAL_CACHE_MAX_BYTES = int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 为空时不启用持久层
+RETRIEVAL_CACHE_PERSIST_PATH = os.getenv("RETRIEVAL_CACHE_PERSIST_PATH", "")
+# 持久层的条目数上限，以及清理过期条目的间隔（秒）
+RETRIEVAL_CACHE_PERSIST_MAX_ROWS = int(os.getenv("RETRIEVAL_CACHE_PERSIST_MAX_ROWS", "100000"))
+RETRIEVAL_CACHE_PERSIST_PURGE_INTERVAL = float(os.getenv("RETRIEVAL_CACHE_PERSIST_PURGE_INTERVAL", "300"))
+
+
+def normalize_query(query: str) -> str:
+    """全角转半角、大小写统一、合并空白，让只差格式的问题落到同一个键上"""
+    query = unicodedata.normalize("NFKC", query or "")
+    return " ".join(query.lower().split())
+
+
+def make_key(backend: str, query: str, params: dict = None) -> str:
+    raw = json.dumps([backend, normalize_query(query), params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LoadCancelled(Exception):
+    """合并等待的加载任务被取消，而等待方自己没有被取消"""
+
+
+class CacheTier:
+    """持久层接口：实现 get/set 即可接入，比如本地文件、SQLite、Redis"""
+
+    async def get(self, key: str):
+        raise NotImplementedError
+
+    async def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+
+class SQLiteCacheTier(CacheTier):
+    """
+    把缓存条目存到独立的 SQLite 文件里，不和 chat_history.db 争写锁。
+    写入时每隔 purge_interval 秒删除一次过期条目，条目数超过 max_rows 时删除最早过期的，
+    删除后空出的页由后续写入复用，文件不会无限增长。
+    """
+
+    def __init__(self, path: str, max_rows: int = None, purge_interval: float = None):
+        self.path = path
+        self.max_rows = RETRIEVAL_CACHE_PERSIST_MAX_ROWS if max_rows is None else max_rows
+        self.purge_interval = RETRIEVAL_CACHE_PERSIST_PURGE_INTERVAL if purge_interval is None else purge_interval
+        self._last_purge = 0.0
+        self.stats = {"purged_expired": 0, "purged_over_limit": 0}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)")
+        self._conn.commit()
+        # 单条连接，串行访问
+        self._lock = asyncio.Lock()
+
+    def _get(self, key: str):
+        row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, value, ttl: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+        )
+        self._conn.commit()
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            self._purge()
+
+    def _purge(self):
+        self.stats["purged_expired"] += self._conn.execute(
+            "DELETE FROM cache WHERE expires_at < ?", (time.time(),)
+        ).rowcount
+        excess = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_rows
+        if excess > 0:
+            self.stats["purged_over_limit"] += self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)", (excess,)
+            ).rowcount
+        self._conn.commit()
+
+    async def get(self, key: str):
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value, ttl: float):
+        async with self._lock:
+            await asyncio.to_thread(self._set, key, value, ttl)
+
+
+class RetrievalCache:
+    def __init__(self, ttl: float = None, max_bytes: int = None, persistent: CacheTier = None):
+        self.ttl = RETRIEVAL_CACHE_TTL if ttl is None else ttl
+        self.max_bytes = RETRIEVAL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.persistent = persistent
+        # key -> (value, expires_at, size)，顺序即 LRU 顺序，最近使用的在末尾
+        self._entries = OrderedDict()
+        self._size = 0
+        self._inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "persistent_hits": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["persistent_hits"] + self.stats["misses"]
+        persistent = getattr(self.persistent, "stats", None)
+        return {
+            **self.stats,
+            **({"persistent": dict(persistent)} if persistent is not None else {}),
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hit_rate": round((self.stats["hits"] + self.stats["persistent_hits"]) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _get_memory(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_memory(self, key: str, value, ttl: float):
+        size = len(key) + len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    async def get_or_load(self, backend: str, query: str, params: dict, loader, ttl: float = None):
+        """
+        先查内存层，再查持久层，都没有时调用 loader() 访问后端。
+        加载在缓存自己创建的任务里执行，所有调用方通过 shield 等待同一个任务：某个调用方被取消（超时、客户端断开）
+        只影响它自己，加载继续完成并写入缓存，其他调用方照常拿到结果。
+        loader 抛出的异常不会被缓存，会传给所有等待同一个键的调用方。
+        """
+        ttl = self.ttl if ttl is None else ttl
+        key = make_key(backend, query, params)
+        entry = self._get_memory(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry[0]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = self._inflight[key] = asyncio.create_task(self._load(key, loader, ttl))
+            task.add_done_callback(lambda done: self._load_done(key, done))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                # 加载任务本身被取消（比如进程退出），调用方自己并没有被取消：转成普通异常，调用方可以重试
+                raise LoadCancelled(f"{backend} 加载被取消") from None
+            raise
+
+    async def _load(self, key: str, loader, ttl: float):
+        value = None
+        if self.persistent is not None:
+            try:
+                value = await self.persistent.get(key)
+            except Exception as e:
+                print(f"读取持久化检索缓存失败: {str(e)}")
+        if value is not None:
+            self.stats["persistent_hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            value = await loader()
+            if self.persistent is not None:
+                try:
+                    await self.persistent.set(key, value, ttl)
+                except Exception as e:
+                    print(f"写入持久化检索缓存失败: {str(e)}")
+        self._put_memory(key, value, ttl)
+        return value
+
+    def _load_done(self, key: str, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 等待的调用方都已经放弃时，避免 "exception was never retrieved" 告警
+        if not task.cancelled():
+            task.exception()
+
+    def peek(self, backend: str, query: str, params: dict = None):
+        """只查内存层，不访问后端；未命中返回 None"""
+        entry = self._get_memory(make_key(backend, query, params))
+        self.stats["hits" if entry is not None else "misses"] += 1
+        return entry[0] if entry is not None else None
+
+    def put(self, backend: str, query: str, params: dict, value, ttl: float = None):
+        """直接写入内存层"""
+        self._put_memory(make_key(backend, query, params), value, self.ttl if ttl is None else ttl)
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+
+retrieval_cache = RetrievalCache(
+    persistent=SQLiteCacheTier(RETRIEVAL_CACHE_PERSIST_PATH) if RETRIEVAL_CACHE_PERSIST_PATH else None
+)
@@ -0,0 +1,90 @@
+# 上下文检索阶段：所有启用的检索器（网络搜索、ES 等）并发执行
+# - 每个检索器有自己的截止时间，超时的来源直接跳过，用已经返回的结果继续回答
+# - 超时的检索不会被取消，而是在后台跑完，结果写进检索缓存，下次同样的问题可以直接命中
+# - 记录每个来源的耗时和结果状态，累计指标通过 /api/metrics 查看
+# 新的检索器调用 register() 注册即可，不需要修改 process_stream_request
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+RETRIEVER_DEFAULT_DEADLINE = float(os.getenv("RETRIEVER_DEFAULT_DEADLINE", "5"))
+
+
+@dataclass
+class Retriever:
+    # name 同时也是请求里开启该检索器的开关名，比如 web_search、es_search
+    name: str
+    fetch: object
+    deadline: float
+
+
+class RetrieverRegistry:
+    def __init__(self):
+        # 按注册顺序拼接上下文，保证结果顺序稳定
+        self._retrievers = {}
+        self._background = set()
+        self.stats = {}
+
+    def register(self, name: str, fetch, deadline: float = None):
+        """fetch 是 async def fetch(query) -> str"""
+        self._retrievers[name] = Retriever(name, fetch, RETRIEVER_DEFAULT_DEADLINE if deadline is None else deadline)
+        self.stats.setdefault(name, {"calls": 0, "ok": 0, "timeouts": 0, "errors": 0, "total_ms": 0.0})
+
+    async def gather(self, query: str, enabled: dict) -> tuple:
+        """
+        并发执行 enabled 中开关为真的检索器，返回 (上下文文本, 每个来源的耗时记录)。
+        整个阶段最长等待时间是启用的检索器中最大的截止时间。
+        """
+        selected = [r for name, r in self._retrievers.items() if enabled.get(name)]
+        if not selected:
+            return "", []
+        results = await asyncio.gather(*(self._run(retriever, query) for retriever in selected))
+        parts = [text for text, _ in results if text]
+        timings = [timing for _, timing in results]
+        print(f"-----上下文检索耗时: {timings}")
+        return "\n".join(parts), timings
+
+    async def _run(self, retriever: Retriever, query: str) -> tuple:
+        stats = self.stats[retriever.name]
+        stats["calls"] += 1
+        start = time.perf_counter()
+        task = asyncio.ensure_future(retriever.fetch(query))
+        text = None
+        try:
+            # shield：超时只是不再等待，检索本身继续在后台完成
+            text = await asyncio.wait_for(asyncio.shield(task), retriever.deadline)
+            status = "ok"
+        except asyncio.TimeoutError:
+            status = "timeout"
+            self._background.add(task)
+            task.add_done_callback(self._finish_background)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        except Exception as e:
+            print(f"检索器 {retriever.name} 出错: {str(e)}")
+            status = "error"
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        stats["ok" if status == "ok" else status + "s"] += 1
+        stats["total_ms"] += elapsed_ms
+        return text, {"source": retriever.name, "status": status, "ms": elapsed_ms}
+
+    def _finish_background(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"后台检索出错: {str(task.exception())}")
+
+    def metrics(self) -> dict:
+        return {
+            name: {
+                **stats,
+                "total_ms": round(stats["total_ms"], 1),
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 1) if stats["calls"] else 0.0,
+                "deadline_s": self._retrievers[name].deadline,
+            }
+            for name, stats in self.stats.items()
+        }
+
+
+retrievers = RetrieverRegistry()
@@ -0,0 +1,105 @@
+# SSE 输出工具：把大模型逐token的增量输出合并成更少的帧再发给浏览器
+# 帧格式保持不变：data: {"content": ..., "session_id": ..., "done": ...}\n\n，前端无需任何修改
+import asyncio
+import json
+import os
+import time
+
+# 刷新策略：缓冲区累计达到 SSE_FLUSH_BYTES 字节，或距上次刷新超过 SSE_FLUSH_INTERVAL_MS 毫秒，就输出一帧
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "48"))
+SSE_FLUSH_INTERVAL = float(os.getenv("SSE_FLUSH_INTERVAL_MS", "40")) / 1000
+
+
+def sse_frame(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class SSEWriter:
+    """按"字节数或时间间隔"合并增量内容的SSE写入器，第一段内容立即输出，保证首字延迟不变"""
+
+    def __init__(self, session_id: str, flush_bytes: int = None, flush_interval: float = None):
+        self.session_id = session_id
+        self.flush_bytes = SSE_FLUSH_BYTES if flush_bytes is None else flush_bytes
+        self.flush_interval = SSE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.frames = 0
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._last_flush = None
+
+    def add(self, content: str):
+        self._buffer.append(content)
+        self._buffered_bytes += len(content.encode("utf-8"))
+
+    def should_flush(self) -> bool:
+        if not self._buffer:
+            return False
+        if self._last_flush is None or self._buffered_bytes >= self.flush_bytes:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def time_until_flush(self):
+        """距离按时间刷新还剩多少秒，缓冲区为空时返回 None（无需定时）"""
+        if not self._buffer:
+            return None
+        if self._last_flush is None:
+            return 0
+        return max(0.0, self.flush_interval - (time.monotonic() - self._last_flush))
+
+    def flush(self) -> str:
+        if not self._buffer:
+            return ""
+        content = "".join(self._buffer)
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+        self.frames += 1
+        return sse_frame({"content": content, "session_id": self.session_id})
+
+    def message(self, content: str) -> str:
+        """一次性输出一段完整内容（非流式回答、工具结果等）"""
+        self.add(content)
+        return self.flush()
+
+    def done(self) -> str:
+        self.frames += 1
+        return self.flush() + sse_frame({"content": "", "session_id": self.session_id, "done": True})
+
+    def error(self, message: str) -> str:
+        self.frames += 1
+        return self.flush() + sse_frame({"content": message, "session_id": self.session_id, "done": True})
+
+    async def stream(self, deltas):
+        """
+        消费一个产出文本片段的异步迭代器，按刷新策略产出SSE帧（不包含结束帧）。
+        上游停顿时也会在 flush_interval 到期后把缓冲内容推出去，不会一直憋在缓冲区里。
+        """
+        iterator = deltas.__aiter__()
+        pending = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                wait = self.time_until_flush()
+                if wait is not None and not pending.done():
+                    finished, _ = await asyncio.wait({pending}, timeout=wait)
+                    if not finished:
+                        frame = self.flush()
+                        if frame:
+                            yield frame
+                        continue
+                try:
+                    content = await pending
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if pending.done():
+                        pending = None
+                self.add(content)
+                if self.should_flush():
+                    yield self.flush()
+            frame = self.flush()
+            if frame:
+                yield frame
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
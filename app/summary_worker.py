@@ -0,0 +1,190 @@
+# 会话滚动摘要的后台任务：生成摘要不再发生在 /api/stream 的请求路径上
+# - 每轮对话落库后、以及上下文组装发现历史放不下时，把会话放进有上限的队列（同一会话只排一次，队列满了直接丢弃，
+#   下一轮对话会再次入队），由 SUMMARY_CONCURRENCY 个后台任务处理
+# - 增量：摘要检查点是 conversation_summaries.upto_message_id，每次只读取检查点之后的消息；
+#   检查点之后的对话超过 SUMMARY_TRIGGER_TOKENS 时，把较早的部分连同旧摘要压缩成新摘要，最近的 SUMMARY_KEEP_TOKENS 保留原文
+# - 幂等：检查点和摘要在同一条语句里写入，只会向前推进；重复处理同一会话或重启后重新处理不会产生重复内容。
+#   启动时检查最近活跃的 SUMMARY_STARTUP_SCAN 个会话，补上重启前队列里没处理完的（多进程部署时只由主进程检查，见 cluster.py）
+import asyncio
+import os
+
+import db
+from context_assembler import CONTEXT_TOKEN_BUDGET, MESSAGE_OVERHEAD, count_tokens, truncate_tokens
+from message_log import message_log
+
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "2"))
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", str(CONTEXT_TOKEN_BUDGET // 2)))
+SUMMARY_KEEP_TOKENS = int(os.getenv("SUMMARY_KEEP_TOKENS", str(CONTEXT_TOKEN_BUDGET // 4)))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "500"))
+SUMMARY_MAX_MESSAGES = int(os.getenv("SUMMARY_MAX_MESSAGES", "200"))
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "30"))
+SUMMARY_STARTUP_SCAN = int(os.getenv("SUMMARY_STARTUP_SCAN", "100"))
+
+SUMMARY_PROMPT = (
+    "请把下面的对话压缩成一段简洁的摘要，保留用户的问题、关键事实、数字和结论，"
+    f"不超过{SUMMARY_MAX_TOKENS}字。\n\n"
+)
+
+
+async def load_summary(session_id: str):
+    return await db.fetchone(
+        "SELECT upto_message_id, summary, tokens FROM conversation_summaries WHERE session_id = ?", (session_id,)
+    )
+
+
+async def save_summary(session_id: str, summary: dict) -> bool:
+    """
+    写入会话摘要；检查点只向前推进，重复或过期的结果不会覆盖更新的摘要。
+    生成期间会话被删除时不写入。返回是否写入
+    """
+    return await db.execute(
+        "INSERT INTO conversation_summaries (session_id, upto_message_id, summary, tokens, updated_at) "
+        "SELECT ?, ?, ?, ?, CURRENT_TIMESTAMP WHERE EXISTS (SELECT 1 FROM chat_sessions WHERE id = ?) "
+        "ON CONFLICT(session_id) DO UPDATE SET upto_message_id = excluded.upto_message_id, summary = excluded.summary, "
+        "tokens = excluded.tokens, updated_at = excluded.updated_at "
+        "WHERE excluded.upto_message_id > conversation_summaries.upto_message_id",
+        (session_id, summary["upto_message_id"], summary["summary"], summary["tokens"], session_id)
+    ) > 0
+
+
+class SummaryWorker:
+    def __init__(self, concurrency: int = None, queue_size: int = None, summarize=None):
+        self.concurrency = concurrency or SUMMARY_CONCURRENCY
+        self.queue_size = queue_size or SUMMARY_QUEUE_SIZE
+        # async def summarize(prompt: str) -> str；为 None 时不生成摘要
+        self.summarize = summarize
+        self._queue = None
+        self._tasks = []
+        # 已在队列里的会话，避免重复排队
+        self._queued = set()
+        # 正在处理的会话；处理期间再次入队的，处理完后重新排队
+        self._running = set()
+        self._again = set()
+        self.stats = {"enqueued": 0, "deduplicated": 0, "dropped": 0, "processed": 0, "skipped": 0,
+                      "summaries": 0, "stale": 0, "failures": 0, "summarized_messages": 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    def enqueue(self, session_id: str):
+        """请求路径上调用：只入队，不等待"""
+        if self._queue is None or self.summarize is None or not session_id:
+            return
+        if session_id in self._running:
+            self._again.add(session_id)
+            return
+        if session_id in self._queued:
+            self.stats["deduplicated"] += 1
+            return
+        try:
+            self._queue.put_nowait(session_id)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return
+        self._queued.add(session_id)
+        self.stats["enqueued"] += 1
+
+    async def scan_recent(self):
+        """把最近活跃的会话放进队列，在 start() 之后调用"""
+        try:
+            rows = await db.fetchall(
+                "SELECT id FROM chat_sessions ORDER BY updated_at DESC LIMIT ?", (SUMMARY_STARTUP_SCAN,)
+            )
+        except Exception as e:
+            print(f"启动时检查会话摘要失败: {str(e)}")
+            return
+        for row in rows:
+            self.enqueue(row["id"])
+
+    async def _work(self):
+        while True:
+            session_id = await self._queue.get()
+            self._queued.discard(session_id)
+            self._running.add(session_id)
+            try:
+                await self.process(session_id)
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"生成会话摘要失败, session_id: {session_id}, 错误: {type(e).__name__} {str(e)}")
+            finally:
+                self._running.discard(session_id)
+            if session_id in self._again:
+                self._again.discard(session_id)
+                self.enqueue(session_id)
+
+    async def process(self, session_id: str) -> bool:
+        """检查点之后的对话超过阈值时推进摘要，返回是否生成了新摘要"""
+        self.stats["processed"] += 1
+        await message_log.wait_persisted(session_id)
+        cached = await load_summary(session_id)
+        upto = cached["upto_message_id"] if cached else 0
+        rows = await db.fetchall(
+            "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (session_id, upto, SUMMARY_MAX_MESSAGES)
+        )
+        tokens = [count_tokens(row["content"]) + MESSAGE_OVERHEAD for row in rows]
+        if sum(tokens) <= SUMMARY_TRIGGER_TOKENS:
+            self.stats["skipped"] += 1
+            return False
+        # 从最新的消息往前保留 SUMMARY_KEEP_TOKENS 原文，保留部分从用户消息开始
+        keep = 0
+        room = SUMMARY_KEEP_TOKENS
+        while keep < len(rows) and tokens[keep] <= room:
+            room -= tokens[keep]
+            keep += 1
+        while keep > 0 and rows[keep - 1]["role"] != "user":
+            keep -= 1
+        older = rows[keep:]
+        if not older:
+            self.stats["skipped"] += 1
+            return False
+        summary = await asyncio.wait_for(self.summarize(self._prompt(cached, older)), SUMMARY_TIMEOUT)
+        summary = truncate_tokens(summary.strip(), SUMMARY_MAX_TOKENS)
+        saved = await save_summary(
+            session_id, {"upto_message_id": older[0]["id"], "summary": summary, "tokens": count_tokens(summary)}
+        )
+        if not saved:
+            # 另一个进程或重复的任务已经推进了检查点
+            self.stats["stale"] += 1
+            return False
+        self.stats["summaries"] += 1
+        self.stats["summarized_messages"] += len(older)
+        return True
+
+    @staticmethod
+    def _prompt(cached, older: list) -> str:
+        """旧摘要 + 检查点之后需要压缩的消息（从新到旧排列），输入不超过上下文预算，放不下时舍弃最早的消息"""
+        lines = []
+        room = CONTEXT_TOKEN_BUDGET - (cached["tokens"] if cached else 0)
+        for row in older:
+            line = f"{'用户' if row['role'] == 'user' else '助手'}: {row['content']}"
+            line_tokens = count_tokens(line)
+            if line_tokens > room:
+                lines.append(truncate_tokens(line, room))
+                break
+            lines.append(line)
+            room -= line_tokens
+        if cached:
+            lines.append(f"之前的摘要: {cached['summary']}")
+        return SUMMARY_PROMPT + "\n".join(reversed(lines))
+
+    async def stop(self):
+        """关闭时直接取消：没处理完的会话检查点没有推进，之后会重新处理"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = None
+        self._queued.clear()
+        self._again.clear()
+
+    def metrics(self) -> dict:
+        return {**self.stats, "queued": len(self._queued), "running": len(self._running),
+                "concurrency": self.concurrency, "queue_size": self.queue_size}
+
+
+summary_worker = SummaryWorker()
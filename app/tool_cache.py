@@ -0,0 +1,71 @@
+# MCP 工具结果缓存：很多工具在短时间内结果不变（月销售额、热销产品、天气等），相同调用直接复用结果
+# - 键：服务器地址 + 工具 id + 有效期 + 规范化后的参数（键排序的 JSON）；刷新工具后 id 会变，旧结果自然失效
+# - 有效期按工具配置，保存在 mcp_tools.cache_ttl：NULL 使用默认值 MCP_TOOL_CACHE_DEFAULT_TTL，0 表示不缓存（有副作用的工具）
+# - 复用检索缓存的 TTL + LRU + singleflight 实现，另外按工具统计命中率；合并等待的请求里有一个超时，
+#   只放弃它自己的等待，工具调用继续完成并写入缓存，其他请求照常拿到结果
+import os
+
+from mcp_pool import mcp_pool
+from retrieval_cache import RetrievalCache
+
+MCP_TOOL_CACHE_DEFAULT_TTL = float(os.getenv("MCP_TOOL_CACHE_DEFAULT_TTL", "60"))
+MCP_TOOL_CACHE_MAX_BYTES = int(os.getenv("MCP_TOOL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+def result_text(contents) -> str:
+    """把工具返回的内容列表转成文本：文本内容直接拼接，其他类型（图片、资源）保留 JSON"""
+    parts = []
+    for content in contents:
+        text = getattr(content, "text", None)
+        parts.append(text if text is not None else content.model_dump_json())
+    return "\n".join(parts)
+
+
+def effective_ttl(cache_ttl) -> float:
+    return MCP_TOOL_CACHE_DEFAULT_TTL if cache_ttl is None else float(cache_ttl)
+
+
+class ToolResultCache:
+    def __init__(self):
+        self.cache = RetrievalCache(ttl=MCP_TOOL_CACHE_DEFAULT_TTL, max_bytes=MCP_TOOL_CACHE_MAX_BYTES)
+        self.tools = {}
+
+    async def call(self, server_url: str, tool_name: str, arguments: dict = None, tool=None) -> str:
+        """
+        tool 是工具目录里对应的 CatalogTool，返回工具结果文本。
+        目录里找不到的工具（比如大模型给出的名字有误）不缓存，直接调用。
+        """
+        arguments = arguments or {}
+        # 只统计目录里的工具，名字有误的调用不占用统计项
+        stats = self.tools.setdefault(tool_name, {"calls": 0, "hits": 0, "bypassed": 0}) if tool is not None \
+            else {"calls": 0, "hits": 0, "bypassed": 0}
+        stats["calls"] += 1
+        ttl = effective_ttl(tool.cache_ttl) if tool is not None else 0
+
+        async def load():
+            nonlocal loaded
+            loaded = True
+            return result_text(await mcp_pool.call_tool(server_url, tool_name, arguments))
+
+        loaded = False
+        if ttl <= 0:
+            stats["bypassed"] += 1
+            return await load()
+        # 有效期也放进键里，修改缓存策略后不会再命中按旧有效期缓存的结果
+        params = {"server": server_url, "tool_id": tool.id, "ttl": ttl, "arguments": arguments}
+        text = await self.cache.get_or_load("mcp_tool", tool_name, params, load, ttl=ttl)
+        if not loaded:
+            stats["hits"] += 1
+        return text
+
+    def metrics(self) -> dict:
+        return {
+            **self.cache.metrics(),
+            "tools": {
+                name: {**stats, "hit_rate": round(stats["hits"] / stats["calls"], 4) if stats["calls"] else 0.0}
+                for name, stats in self.tools.items()
+            },
+        }
+
+
+tool_result_cache = ToolResultCache()
@@ -0,0 +1,148 @@
+# 进程内的 MCP 工具目录：Agent 模式每次请求不再查询 mcp_tools 并重新拼接工具描述
+# - 第一次使用时从数据库加载一次，之后直接使用内存里的快照
+# - 快照里保存每个工具解析后的 input_schema，以及预先生成好的 tools（function calling）参数
+# - mcp_api 中创建/修改/删除服务器、刷新工具后按服务器精确失效，下次使用时只重新加载该服务器的工具
+# - 同时维护工具预筛选索引（tool_index），select() 只返回与问题相关的前 k 个工具
+import asyncio
+import json
+from dataclasses import dataclass
+
+import db
+from tool_index import ToolIndex
+
+
+@dataclass(frozen=True)
+class CatalogTool:
+    id: str
+    server_id: str
+    name: str
+    description: str
+    url: str
+    input_schema: dict
+    # 结果缓存有效期（秒），None 表示使用默认值，0 表示不缓存
+    cache_ttl: float
+    # 给大模型的函数说明：tools 参数里 function 的 name/description/parameters
+    function: dict
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    tools: tuple
+    # (server_url, tool_name) -> CatalogTool
+    by_key: dict
+
+    def find(self, server_url: str, tool_name: str):
+        return self.by_key.get((server_url, tool_name))
+
+
+def _parse_schema(raw: str) -> dict:
+    try:
+        return json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+
+
+def _to_tool(row: dict) -> CatalogTool:
+    input_schema = _parse_schema(row["input_schema"])
+    return CatalogTool(
+        id=row["id"],
+        server_id=row["server_id"],
+        name=row["name"],
+        description=row["description"],
+        url=row["url"],
+        input_schema=input_schema,
+        cache_ttl=row["cache_ttl"],
+        function={
+            "name": row["name"],
+            "description": row["description"] or "",
+            "parameters": input_schema or {"type": "object", "properties": {}},
+        },
+    )
+
+
+def _build_snapshot(tools_by_server: dict) -> CatalogSnapshot:
+    tools = tuple(tool for tools in tools_by_server.values() for tool in tools)
+    return CatalogSnapshot(tools, {(tool.url, tool.name): tool for tool in tools})
+
+
+class ToolCatalog:
+    def __init__(self):
+        # server_id -> [CatalogTool]；为 None 表示还没有加载过
+        self._tools_by_server = None
+        self._snapshot = None
+        # 需要重新加载的服务器
+        self._dirty = set()
+        # 每次失效加一；加载期间如果又发生了失效，加载结果不能当作最新
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self.index = ToolIndex()
+        self.stats = {"hits": 0, "full_loads": 0, "server_reloads": 0, "invalidations": 0}
+
+    def invalidate(self, server_id: str = None):
+        """server_id 为空时整个目录失效"""
+        self.stats["invalidations"] += 1
+        self._generation += 1
+        if server_id is None or self._tools_by_server is None:
+            self._tools_by_server = None
+            self._dirty.clear()
+        else:
+            self._dirty.add(server_id)
+        self._snapshot = None
+
+    async def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None:
+            self.stats["hits"] += 1
+            return snapshot
+        async with self._lock:
+            while self._snapshot is None:
+                await self._reload()
+            return self._snapshot
+
+    async def select(self, query: str, k: int = None) -> list:
+        """与问题最相关的前 k 个工具，提供给 Agent 的决策调用"""
+        await self.snapshot()
+        return await self.index.select(query, k)
+
+    async def _reload(self):
+        generation = self._generation
+        full = self._tools_by_server is None
+        if full:
+            rows = await db.fetchall("SELECT t.*, s.url FROM mcp_tools t LEFT JOIN mcp_servers s ON t.server_id = s.id")
+            tools_by_server = {}
+            for row in rows:
+                tools_by_server.setdefault(row["server_id"], []).append(_to_tool(row))
+            self.stats["full_loads"] += 1
+        else:
+            tools_by_server = dict(self._tools_by_server)
+            for server_id in set(self._dirty):
+                rows = await db.fetchall(
+                    "SELECT t.*, s.url FROM mcp_tools t LEFT JOIN mcp_servers s ON t.server_id = s.id WHERE t.server_id = ?",
+                    (server_id,)
+                )
+                if rows:
+                    tools_by_server[server_id] = [_to_tool(row) for row in rows]
+                else:
+                    tools_by_server.pop(server_id, None)
+                self.stats["server_reloads"] += 1
+        if generation != self._generation:
+            # 加载期间又有失效，丢弃结果重新加载
+            return
+        # 索引只更新变化的服务器
+        if full:
+            self.index.clear()
+            changed = tools_by_server.keys()
+        else:
+            changed = self._dirty
+        for server_id in changed:
+            self.index.replace(server_id, tools_by_server.get(server_id, []))
+        self._tools_by_server = tools_by_server
+        self._dirty.clear()
+        self._snapshot = _build_snapshot(tools_by_server)
+        await self.index.embed_pending()
+
+    def metrics(self) -> dict:
+        return {**self.stats, "tools": len(self._snapshot.tools) if self._snapshot else None, "index": self.index.metrics()}
+
+
+tool_catalog = ToolCatalog()
@@ -0,0 +1,160 @@
+# 工具预筛选索引：Agent 模式只把与问题最相关的前 k 个工具放进决策提示词，提示词大小不再随工具总数线性增长
+# - 默认使用本地 BM25：英文按单词（拆开 snake_case / camelCase），中文按字的二元组切分，不依赖外部服务
+# - 配置 TOOL_EMBEDDING_MODEL 后改用向量相似度（通过大模型服务的 embeddings 接口），可以跨语言匹配；
+#   向量不可用或请求失败时自动回退到 BM25
+# - 按服务器增量更新：刷新某个服务器的工具时只重新切分、计算该服务器的工具，文档频率增量维护
+import asyncio
+import math
+import os
+import re
+from collections import Counter
+
+TOOL_SELECT_TOP_K = int(os.getenv("TOOL_SELECT_TOP_K", "8"))
+TOOL_EMBEDDING_MODEL = os.getenv("TOOL_EMBEDDING_MODEL", "")
+TOOL_EMBEDDING_TIMEOUT = float(os.getenv("TOOL_EMBEDDING_TIMEOUT", "2"))
+
+_WORD = re.compile(r"[a-z0-9]+")
+_CJK = re.compile(r"[一-鿿]+")
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+
+
+def tokenize(text: str) -> list:
+    text = _CAMEL.sub(r"\1 \2", text or "").lower()
+    terms = _WORD.findall(text)
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def tool_text(tool) -> str:
+    """参与检索的文本：工具名、描述，以及参数名和参数描述"""
+    parts = [tool.name, tool.description or ""]
+    for name, prop in (tool.input_schema.get("properties") or {}).items():
+        parts.append(name)
+        if isinstance(prop, dict):
+            parts.append(prop.get("description", ""))
+    return " ".join(parts)
+
+
+def _normalize(vector: list) -> list:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class ToolIndex:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, embed=None):
+        self.k1 = k1
+        self.b = b
+        # async def embed(texts: list) -> list[list[float]]；为 None 时只用 BM25
+        self.embed = embed
+        # server_id -> [(tool, 词频, 文档长度)]
+        self._docs = {}
+        self._df = Counter()
+        self._total_length = 0
+        self._count = 0
+        # tool.id -> 归一化后的向量
+        self._vectors = {}
+        self.stats = {"bm25_queries": 0, "vector_queries": 0, "vector_failures": 0, "updates": 0}
+
+    def replace(self, server_id: str, tools: list):
+        """用新的工具列表替换某个服务器的工具（为空即删除）"""
+        self._remove(server_id)
+        docs = []
+        for tool in tools:
+            terms = Counter(tokenize(tool_text(tool)))
+            length = sum(terms.values())
+            docs.append((tool, terms, length))
+            self._df.update(terms.keys())
+            self._total_length += length
+            self._count += 1
+        if docs:
+            self._docs[server_id] = docs
+        self.stats["updates"] += 1
+
+    def _remove(self, server_id: str):
+        for tool, terms, length in self._docs.pop(server_id, []):
+            self._df.subtract(terms.keys())
+            self._total_length -= length
+            self._count -= 1
+            self._vectors.pop(tool.id, None)
+        self._df = +self._df
+
+    def clear(self):
+        for server_id in list(self._docs):
+            self._remove(server_id)
+
+    def tools(self) -> list:
+        return [tool for docs in self._docs.values() for tool, _, _ in docs]
+
+    async def embed_pending(self):
+        """给还没有向量的工具计算向量，失败时保留 BM25"""
+        if self.embed is None:
+            return
+        pending = [tool for tool in self.tools() if tool.id not in self._vectors]
+        if not pending:
+            return
+        try:
+            vectors = await self.embed([tool_text(tool) for tool in pending])
+        except Exception as e:
+            print(f"计算工具向量失败，使用 BM25: {str(e)}")
+            return
+        for tool, vector in zip(pending, vectors):
+            self._vectors[tool.id] = _normalize(vector)
+
+    def _bm25(self, query: str) -> dict:
+        terms = set(tokenize(query))
+        avg_length = self._total_length / self._count if self._count else 0
+        scores = {}
+        for docs in self._docs.values():
+            for tool, tf, length in docs:
+                score = 0.0
+                for term in terms:
+                    freq = tf.get(term)
+                    if not freq:
+                        continue
+                    idf = math.log(1 + (self._count - self._df[term] + 0.5) / (self._df[term] + 0.5))
+                    score += idf * freq * (self.k1 + 1) / (freq + self.k1 * (1 - self.b + self.b * length / avg_length))
+                scores[tool.id] = score
+        return scores
+
+    async def _similarity(self, query: str):
+        tools = self.tools()
+        if self.embed is None or not tools or any(tool.id not in self._vectors for tool in tools):
+            return None
+        try:
+            [vector] = await asyncio.wait_for(self.embed([query]), TOOL_EMBEDDING_TIMEOUT)
+        except Exception as e:
+            self.stats["vector_failures"] += 1
+            print(f"计算问题向量失败，使用 BM25: {str(e)}")
+            return None
+        vector = _normalize(vector)
+        return {tool.id: sum(a * b for a, b in zip(vector, self._vectors[tool.id])) for tool in tools}
+
+    async def select(self, query: str, k: int = None) -> list:
+        """
+        返回与问题最相关的前 k 个工具。工具总数不超过 k 时原样返回全部工具；
+        BM25 下所有工具都不相关（比如中文问题、英文描述）时无法排序，同样返回前 k 个。
+        """
+        k = k or TOOL_SELECT_TOP_K
+        tools = self.tools()
+        if len(tools) <= k:
+            return tools
+        scores = await self._similarity(query)
+        if scores is not None:
+            self.stats["vector_queries"] += 1
+        else:
+            self.stats["bm25_queries"] += 1
+            scores = self._bm25(query)
+            if not any(scores.values()):
+                return tools[:k]
+            # BM25 下得分为 0 的工具与问题没有任何共同词，不放进提示词
+            tools = [tool for tool in tools if scores[tool.id] > 0]
+        order = {tool.id: i for i, tool in enumerate(tools)}
+        return sorted(tools, key=lambda tool: (-scores[tool.id], order[tool.id]))[:k]
+
+    def metrics(self) -> dict:
+        return {**self.stats, "tools": self._count, "vocabulary": len(self._df), "vectors": len(self._vectors),
+                "top_k": TOOL_SELECT_TOP_K, "embedding_model": TOOL_EMBEDDING_MODEL or None}
@@ -0,0 +1,119 @@
+# 博查(BochaAI)网络搜索的异步客户端
+# - 共享 httpx 连接池，连接/读取分别设置超时
+# - 可重试的错误（连接失败、超时、429、5xx）做有限次重试，退避时间带随机抖动
+# - 准入控制限制同时发往搜索服务的请求数，超出时有限排队，队列满或等待超时直接失败，避免超出外部搜索配额
+# - 返回解析后的结构化结果，而不是整个响应的 str()
+# 参考文档 https://bocha-ai.feishu.cn/wiki/RXEOw02rFiwzGSkd9mUcqoeAnNK
+import asyncio
+import os
+import random
+
+import httpx
+
+from admission import admission
+
+BOCHAAI_SEARCH_API_KEY = os.getenv("BOCHAAI_SEARCH_API_KEY")
+BOCHAAI_SEARCH_URL = os.getenv("BOCHAAI_SEARCH_URL", "https://api.bochaai.com/v1/web-search")
+WEB_SEARCH_CONNECT_TIMEOUT = float(os.getenv("WEB_SEARCH_CONNECT_TIMEOUT", "3"))
+WEB_SEARCH_READ_TIMEOUT = float(os.getenv("WEB_SEARCH_READ_TIMEOUT", "10"))
+WEB_SEARCH_RETRIES = int(os.getenv("WEB_SEARCH_RETRIES", "2"))
+WEB_SEARCH_BACKOFF = float(os.getenv("WEB_SEARCH_BACKOFF", "0.3"))
+WEB_SEARCH_CONCURRENCY = int(os.getenv("WEB_SEARCH_CONCURRENCY", "8"))
+WEB_SEARCH_QUEUE_SIZE = int(os.getenv("WEB_SEARCH_QUEUE_SIZE", str(WEB_SEARCH_CONCURRENCY * 2)))
+WEB_SEARCH_MAX_WAIT = float(os.getenv("WEB_SEARCH_MAX_WAIT", "3"))
+WEB_SEARCH_COUNT = int(os.getenv("WEB_SEARCH_COUNT", "10"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class WebSearchError(Exception):
+    pass
+
+
+_client = None
+_admission = admission.resource("web_search", WEB_SEARCH_CONCURRENCY, WEB_SEARCH_QUEUE_SIZE, WEB_SEARCH_MAX_WAIT)
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WEB_SEARCH_READ_TIMEOUT, connect=WEB_SEARCH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=WEB_SEARCH_CONCURRENCY, max_keepalive_connections=WEB_SEARCH_CONCURRENCY),
+        )
+    return _client
+
+
+def parse_results(json_data: dict) -> list:
+    """从博查的响应里取出网页结果，只保留回答问题需要的字段"""
+    pages = ((json_data.get("data") or {}).get("webPages") or {}).get("value") or []
+    return [
+        {
+            "title": page.get("name", ""),
+            "url": page.get("url", ""),
+            "site": page.get("siteName", ""),
+            "date": page.get("datePublished", ""),
+            "summary": page.get("summary") or page.get("snippet", ""),
+        }
+        for page in pages
+    ]
+
+
+def format_results(results: list) -> str:
+    """把结构化结果整理成给大模型的上下文文本"""
+    if not results:
+        return "网络搜索没有找到相关结果"
+    return "\n\n".join(
+        f"[{i}] {result['title']}\n来源: {result['site']} {result['url']} {result['date']}\n{result['summary']}"
+        for i, result in enumerate(results, start=1)
+    )
+
+
+def _backoff(attempt: int, retry_after: str = None) -> float:
+    if retry_after:
+        try:
+            return min(float(retry_after), 10.0)
+        except ValueError:
+            pass
+    # full jitter：在 [0, base * 2^attempt] 之间随机，避免大量请求同时重试
+    return random.uniform(0, WEB_SEARCH_BACKOFF * (2 ** attempt))
+
+
+async def search(query: str, count: int = None) -> list:
+    payload = {
+        "query": query,
+        "freshness": "noLimit",
+        "summary": True,
+        "count": count or WEB_SEARCH_COUNT
+    }
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {BOCHAAI_SEARCH_API_KEY}'
+    }
+    async with admission.slot(_admission):
+        for attempt in range(WEB_SEARCH_RETRIES + 1):
+            last_attempt = attempt == WEB_SEARCH_RETRIES
+            try:
+                response = await get_client().post(BOCHAAI_SEARCH_URL, headers=headers, json=payload)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                if last_attempt:
+                    raise WebSearchError(f"网络搜索请求失败: {type(e).__name__}")
+                await asyncio.sleep(_backoff(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS and not last_attempt:
+                await asyncio.sleep(_backoff(attempt, response.headers.get("Retry-After")))
+                continue
+            if response.status_code != 200:
+                raise WebSearchError(f"搜索失败，状态码: {response.status_code}")
+            try:
+                return parse_results(response.json())
+            except ValueError as e:
+                raise WebSearchError(f"搜索结果JSON解析失败: {str(e)}")
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None